@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+App Inventory - Cache of the apps actually installed on each device
+
+Blocking profiles listed every selected bundle ID whether or not the app was
+on the phone, so large category selections produced large profiles full of
+irrelevant IDs. The inventory asks each device for its InstalledApplicationList
+through nanomdm, receives the result from nanomdm's webhook and caches the
+bundle IDs per device. Profile generation then only blacklists selected apps
+that are installed.
+
+A snapshot is only trusted for `ttl` seconds - after that (or if a device
+never answered) the full selection is used, so an app installed since the
+last inventory is never left unblocked for long. Every snapshot carries a
+digest of its sorted bundle IDs; a report with a different digest counts
+as a change and is passed to `on_change` so callers can re-send profiles.
+
+Run nanomdm with `-webhook-url http://127.0.0.1:9101/webhook/<backend>`. The
+same webhook tells the command tracker which commands devices have answered
+and pins each enrolling device to its backend (see backend_registry).
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import plistlib
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mdm_commands import build_installed_application_list_command
+from command_tracker import CommandTracker, send_tracked
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_INVENTORY_PATH = os.path.join(HOME_DIR, "hideaway_setup", "inventory.db")
+DEFAULT_TTL = 6 * 3600
+# Don't ask a device again while an earlier request may still be answered
+REQUEST_GRACE = 15 * 60
+# Command tracker target for InstalledApplicationList requests
+INVENTORY_TARGET = "com.hideaway.inventory"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory (
+    device_id TEXT PRIMARY KEY,
+    apps TEXT,
+    digest TEXT,
+    updated_at REAL,
+    pending_uuid TEXT,
+    requested_at REAL
+);
+"""
+
+
+def _digest(bundle_ids):
+    return hashlib.sha256("\n".join(bundle_ids).encode()).hexdigest()
+
+
+class AppInventory:
+    """Installed bundle IDs per device, with TTL and change detection"""
+
+    def __init__(self, path=DEFAULT_INVENTORY_PATH, ttl=DEFAULT_TTL, on_change=None):
+        self.path = path
+        self.ttl = ttl
+        self.on_change = on_change
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def _row(self, device_id):
+        return self.conn.execute(
+            "SELECT apps, digest, updated_at, pending_uuid, requested_at FROM inventory WHERE device_id = ?",
+            (device_id,)
+        ).fetchone()
+
+    def is_fresh(self, device_id):
+        with self._lock:
+            row = self._row(device_id)
+        return bool(row and row[2] and time.time() - row[2] < self.ttl)
+
+    def installed(self, device_id):
+        """Set of installed bundle IDs, or None if unknown or expired"""
+        with self._lock:
+            row = self._row(device_id)
+        if not row or not row[2] or time.time() - row[2] >= self.ttl:
+            return None
+        return set(json.loads(row[0]))
+
+    def fingerprint(self, device_id):
+        """Digest of the cached app list (changes whenever the apps do)"""
+        with self._lock:
+            row = self._row(device_id)
+        return row[1] if row else None
+
+    def request(self, client, tracker, device_id, force=False):
+        """Enqueue an InstalledApplicationList command unless the cache is fresh
+
+        The command is recorded in `tracker` so it isn't cleared from the
+        queue by a superseding send. Returns the command UUID, or None if
+        nothing was sent.
+        """
+        with self._lock:
+            row = self._row(device_id)
+        now = time.time()
+        if not force and row:
+            if row[2] and now - row[2] < self.ttl:
+                return None
+            if row[4] and now - row[4] < REQUEST_GRACE:
+                return None
+
+        command_uuid, command = build_installed_application_list_command()
+        response = send_tracked(client, tracker, device_id, INVENTORY_TARGET, command_uuid, command)
+        if response.status_code != 200:
+            raise Exception(f"InstalledApplicationList failed: HTTP {response.status_code}")
+
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO inventory (device_id, pending_uuid, requested_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(device_id) DO UPDATE SET pending_uuid = excluded.pending_uuid, "
+                "requested_at = excluded.requested_at",
+                (device_id, command_uuid, now)
+            )
+        return command_uuid
+
+    def forget_request(self, device_id, targets=None):
+        """Forget an outstanding request whose command was cleared from the queue
+
+        The next request() then asks the device again. Takes the arguments of
+        send_superseding's on_dropped callback.
+        """
+        with self._lock:
+            self.conn.execute(
+                "UPDATE inventory SET pending_uuid = NULL, requested_at = NULL WHERE device_id = ?",
+                (device_id,)
+            )
+
+    def record(self, device_id, bundle_ids):
+        """Store a device's installed apps; returns True if they changed"""
+        apps = sorted(set(bundle_ids))
+        digest = _digest(apps)
+
+        with self._lock:
+            row = self._row(device_id)
+            previous = set(json.loads(row[0])) if row and row[0] else None
+            changed = previous is not None and row[1] != digest
+            self.conn.execute(
+                "INSERT INTO inventory (device_id, apps, digest, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(device_id) DO UPDATE SET apps = excluded.apps, digest = excluded.digest, "
+                "updated_at = excluded.updated_at, pending_uuid = NULL, requested_at = NULL",
+                (device_id, json.dumps(apps), digest, time.time())
+            )
+
+        if changed and self.on_change:
+            self.on_change(device_id, set(apps) - previous, previous - set(apps))
+        return changed
+
+    def handle_acknowledge(self, device_id, payload):
+        """Take an InstalledApplicationList result; returns False for other results"""
+        apps = payload.get("InstalledApplicationList")
+        if payload.get("Status") != "Acknowledged" or apps is None:
+            return False
+        self.record(device_id, [app["Identifier"] for app in apps if app.get("Identifier")])
+        return True
+
+    def close(self):
+        self.conn.close()
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    inventory = None
+    tracker = None
+    registry = None
+
+    def _record_enrollment(self, event):
+        """Pin a device to the backend named in the webhook path (/webhook/<name>)"""
+        checkin = event.get("checkin_event")
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if not checkin or self.registry is None or len(parts) != 2:
+            return
+        device_id = checkin.get("enrollment_id") or checkin.get("udid")
+        if event.get("topic") in ("mdm.Authenticate", "mdm.TokenUpdate"):
+            self.registry.assign(device_id, parts[1])
+        elif event.get("topic") == "mdm.CheckOut":
+            self.registry.unassign(device_id)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            event = json.loads(body or b"{}")
+            self._record_enrollment(event)
+            ack = event.get("acknowledge_event")
+            if ack and ack.get("raw_payload"):
+                payload = plistlib.loads(base64.b64decode(ack["raw_payload"]))
+                device_id = ack.get("enrollment_id") or ack.get("udid") or payload.get("UDID")
+                if self.tracker is not None:
+                    self.tracker.handle_acknowledge(device_id, payload)
+                self.inventory.handle_acknowledge(device_id, payload)
+        except (ValueError, KeyError, sqlite3.Error, plistlib.InvalidFileException):
+            pass
+
+        # Always 200 so nanomdm doesn't retry events we don't care about
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_webhook(inventory, tracker=None, host="127.0.0.1", port=9101, registry=None):
+    """Start the nanomdm webhook receiver on a daemon thread and return the server
+
+    With a CommandTracker, acknowledged commands are forgotten as they arrive.
+    With a BackendRegistry, enrolling devices are pinned to their backend.
+    """
+    handler = type("WebhookHandler", (_WebhookHandler,), {
+        "inventory": inventory, "tracker": tracker, "registry": registry
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="inventory-webhook", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Installed-app inventory for Hideaway devices")
+    parser.add_argument('--db', default=DEFAULT_INVENTORY_PATH, help='Path to the inventory database')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser('serve', help='Receive InstalledApplicationList results from nanomdm')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=9101)
+
+    request_parser = subparsers.add_parser('request', help='Ask devices for their installed apps')
+    request_parser.add_argument('device_ids', nargs='+')
+    request_parser.add_argument('--force', action='store_true', help='Ask even if the cache is fresh')
+
+    show_parser = subparsers.add_parser('show', help="Show a device's cached apps")
+    show_parser.add_argument('device_id')
+
+    args = parser.parse_args()
+    inventory = AppInventory(args.db)
+    tracker = CommandTracker()
+
+    if args.command == 'serve':
+        from backend_registry import BackendRegistry
+        registry = BackendRegistry.load()
+        server = serve_webhook(inventory, tracker, args.host, args.port, registry)
+        print(f"📡 Webhook listening on http://{args.host}:{args.port}/webhook")
+        print(f"   Start each nanomdm with: -webhook-url http://{args.host}:{args.port}/webhook/<backend>")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.command == 'request':
+        from backend_registry import ShardedClient
+        client = ShardedClient()
+        try:
+            for device_id in args.device_ids:
+                command_uuid = inventory.request(client, tracker, device_id, force=args.force)
+                print(f"✅ {device_id}: {'requested ' + command_uuid if command_uuid else 'cache is fresh'}")
+        finally:
+            client.close()
+    elif args.command == 'show':
+        apps = inventory.installed(args.device_id)
+        if apps is None:
+            print(f"❌ No fresh inventory for {args.device_id}")
+        else:
+            print(f"📱 {len(apps)} apps installed on {args.device_id}")
+            for bundle_id in sorted(apps):
+                print(f"  {bundle_id}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
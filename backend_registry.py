@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Backend Registry - Spread devices over several nanomdm instances
+
+One nanomdm (and its storage) serves every device by default. The registry
+lists the available nanomdm instances and places new enrollments on one of
+them with a consistent hash ring. Every instance owns many virtual nodes on
+the ring, so load is even.
+
+A device can only be managed by the instance it enrolled with, so the ring
+is only used to choose that instance. Enrollment profiles take their
+ServerURL/CheckInURL from the chosen backend (enrollment_url), and each
+instance runs with `-webhook-url http://127.0.0.1:9101/webhook/<name>`. When
+a device authenticates, the webhook pins its enrollment ID to that backend
+(assign). Pinned devices never move when backends are added; only devices
+without an assignment fall back to the ring.
+
+ShardedClient has the same interface as NanoMDMClient. Calls for several
+devices are split per backend and the parts run in parallel. Each backend
+fails on its own: an error from one shard only fails that shard's devices
+(see device_results), and with a CircuitBreaker per backend a dead instance
+is skipped without affecting the others.
+
+Usage:
+    python3 backend_registry.py list
+    python3 backend_registry.py add <name> <url> [--server-url URL --username U --password P]
+    python3 backend_registry.py remove <name>
+    python3 backend_registry.py assign <device_id> <name>
+    python3 backend_registry.py locate <device_id> [...]
+    python3 backend_registry.py preview-add <name> <url> --devices ids.txt
+"""
+
+import os
+import sys
+import json
+import bisect
+import time
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from nanomdm_client import NanoMDMClient
+from rate_limiter import RateLimitedClient
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_REGISTRY_PATH = os.path.join(HOME_DIR, "hideaway_setup", "backends.json")
+DEFAULT_HOST = "http://127.0.0.1:9000"
+DEFAULT_VNODES = 160
+# nanomdm webhook receiver (app_inventory.serve_webhook); instances post to <base>/<name>
+DEFAULT_WEBHOOK_BASE = "http://127.0.0.1:9101/webhook"
+
+ASSIGNMENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assignments (
+    device_id TEXT PRIMARY KEY,
+    backend TEXT NOT NULL,
+    assigned_at REAL NOT NULL
+);
+"""
+
+
+def _assignments_path(registry_path):
+    return os.path.join(os.path.dirname(os.path.abspath(registry_path)), "backend_assignments.db")
+
+
+def _hash(key):
+    """64-bit ring position - stable across processes, unlike hash()"""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes=(), vnodes=DEFAULT_VNODES):
+        self.vnodes = vnodes
+        self._positions = []
+        self._owners = []
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for index in range(self.vnodes):
+            position = _hash(f"{node}#{index}")
+            slot = bisect.bisect(self._positions, position)
+            self._positions.insert(slot, position)
+            self._owners.insert(slot, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        keep = [(p, o) for p, o in zip(self._positions, self._owners) if o != node]
+        self._positions = [p for p, _ in keep]
+        self._owners = [o for _, o in keep]
+
+    def node_for(self, key):
+        """The node owning `key` (first virtual node clockwise from it)"""
+        if not self._positions:
+            raise LookupError("Hash ring is empty")
+        slot = bisect.bisect(self._positions, _hash(key)) % len(self._positions)
+        return self._owners[slot]
+
+    def partition(self, keys):
+        """{node: [keys...]} preserving the order of `keys`"""
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.node_for(key), []).append(key)
+        return groups
+
+
+class BackendRegistry:
+    """Named nanomdm instances, sticky device assignments and the ring for new devices"""
+
+    def __init__(self, backends=None, vnodes=DEFAULT_VNODES, path=None, assignments_path=None):
+        # name -> {"host": ..., "server_url": ..., "username": ..., "password": ...}
+        self.backends = dict(backends or {"default": {"host": DEFAULT_HOST}})
+        self.vnodes = vnodes
+        self.path = path
+        self.ring = HashRing(self.backends, vnodes)
+
+        # Without an assignments database every device is placed by the ring
+        self.assignments_path = assignments_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=DEFAULT_REGISTRY_PATH, default_host=DEFAULT_HOST, username="nanomdm", password="nanomdm"):
+        """Registry from disk, or a single `default_host` backend if none is saved"""
+        assignments_path = _assignments_path(path)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            default = {"host": default_host, "username": username, "password": password}
+            return cls({"default": default}, path=path, assignments_path=assignments_path)
+        return cls(data["backends"], data.get("vnodes", DEFAULT_VNODES), path=path,
+                   assignments_path=assignments_path)
+
+    def save(self, path=None):
+        path = path or self.path or DEFAULT_REGISTRY_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"backends": self.backends, "vnodes": self.vnodes}, f, indent=2)
+        os.replace(tmp_path, path)
+        self.path = path
+
+    def add(self, name, host, username="nanomdm", password="nanomdm", server_url=None):
+        """Add an instance; `server_url` is its device-facing base URL if not `host`"""
+        self.backends[name] = {"host": host, "username": username, "password": password}
+        if server_url:
+            self.backends[name]["server_url"] = server_url
+        self.ring.add(name)
+
+    def remove(self, name):
+        if len(self.backends) == 1 and name in self.backends:
+            raise ValueError("Can't remove the last backend")
+        self.backends.pop(name, None)
+        self.ring.remove(name)
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.assignments_path)), exist_ok=True)
+            self._conn = sqlite3.connect(
+                self.assignments_path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(ASSIGNMENT_SCHEMA)
+        return self._conn
+
+    def assign(self, device_id, name):
+        """Pin a device to the backend it enrolled with"""
+        if name not in self.backends:
+            raise KeyError(f"Unknown backend: {name}")
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO assignments (device_id, backend, assigned_at) VALUES (?, ?, ?)",
+                (device_id, name, time.time())
+            )
+
+    def unassign(self, device_id):
+        with self._lock:
+            self._db().execute("DELETE FROM assignments WHERE device_id = ?", (device_id,))
+
+    def assigned(self, device_id):
+        """Backend a device is pinned to, or None"""
+        if self.assignments_path is None:
+            return None
+        with self._lock:
+            row = self._db().execute(
+                "SELECT backend FROM assignments WHERE device_id = ?", (device_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def backend_for(self, device_id):
+        """The device's pinned backend, or its place on the ring if it has none"""
+        name = self.assigned(device_id)
+        if name in self.backends:
+            return name
+        return self.ring.node_for(device_id)
+
+    def partition(self, device_ids):
+        """{backend: [device_ids...]} preserving the order of `device_ids`"""
+        groups = {}
+        for device_id in device_ids:
+            groups.setdefault(self.backend_for(device_id), []).append(device_id)
+        return groups
+
+    def enrollment_backend(self, key):
+        """Backend for a new enrollment, e.g. keyed by the roster device name"""
+        return self.ring.node_for(key)
+
+    def enrollment_url(self, name):
+        """Device-facing MDM URL of a backend, for ServerURL and CheckInURL"""
+        backend = self.backends[name]
+        return f"{(backend.get('server_url') or backend['host']).rstrip('/')}/mdm"
+
+    def find(self, host):
+        """Name of the backend whose API is at `host`, or None"""
+        for name, backend in self.backends.items():
+            if backend["host"].rstrip("/") == host.rstrip("/"):
+                return name
+        return None
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def client_for(self, name, timeout=10):
+        backend = self.backends[name]
+        return NanoMDMClient(
+            backend["host"],
+            backend.get("username", "nanomdm"),
+            backend.get("password", "nanomdm"),
+            timeout=timeout
+        )
+
+
+class ShardedResponse:
+    """Combined result of one call fanned out to several backends
+
+    Looks like a single requests.Response to existing callers: the status is
+    200 only if every backend returned 200, otherwise the first failure's
+    (503 if the only failures are backends that raised). Callers that can
+    handle partial success use device_results() instead.
+    """
+
+    def __init__(self, responses, groups=None, errors=None):
+        self.responses = responses   # backend -> requests.Response
+        self.groups = groups or {}   # backend -> device IDs sent to it
+        self.errors = errors or {}   # backend -> exception it raised
+        failures = [r for r in responses.values() if r.status_code != 200]
+        first = failures[0] if failures else next(iter(responses.values()))
+        self.status_code = 503 if self.errors and not failures else first.status_code
+        self.headers = first.headers
+        self.text = "\n".join(
+            [f"{name}: {r.text}" for name, r in responses.items()] +
+            [f"{name}: {e}" for name, e in self.errors.items()]
+        )
+
+    def device_results(self):
+        """{device_id: status code, or the exception its backend raised}"""
+        results = {}
+        for name, device_ids in self.groups.items():
+            result = self.errors[name] if name in self.errors else self.responses[name].status_code
+            results.update(dict.fromkeys(device_ids or (), result))
+        return results
+
+
+def device_results(response, device_ids):
+    """{device_id: status code or exception} for a NanoMDMClient or ShardedClient response"""
+    if isinstance(response, ShardedResponse):
+        return response.device_results()
+    if isinstance(device_ids, str):
+        device_ids = [device_ids]
+    return dict.fromkeys(device_ids, response.status_code)
+
+
+class ShardedClient:
+    """NanoMDMClient-compatible client that routes each device to its backend
+
+    `breakers` optionally maps backend names to CircuitBreakers; calls to a
+    backend then go through its breaker. With a RateLimiter each backend's
+    client is a RateLimitedClient with its own endpoint buckets, so one busy
+    instance doesn't slow down calls to the others.
+    """
+
+    def __init__(self, registry=None, timeout=10, max_workers=8, breakers=None, limiter=None, topic=None,
+                 limit_timeout=None):
+        self.registry = registry or BackendRegistry.load()
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.breakers = breakers or {}
+        self.limiter = limiter
+        self.topic = topic
+        self.limit_timeout = limit_timeout
+        self.queue_api = True
+
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def host(self):
+        """URL of the first backend, for callers that need a single host"""
+        return next(iter(self.registry.backends.values()))["host"].rstrip("/")
+
+    def client(self, name):
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                client = self.registry.client_for(name, self.timeout)
+                if self.limiter is not None:
+                    client = RateLimitedClient(client, self.limiter, self.topic, self.limit_timeout, backend=name)
+                self._clients[name] = client
+            return client
+
+    def _call_shard(self, name, call, part):
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            return call(self.client(name), part)
+        return breaker.call(call, self.client(name), part)
+
+    def _fan_out(self, groups, call):
+        """Run call(client, part) per backend, in parallel when there are several
+
+        A backend that raises only fails its own devices; the exception is
+        re-raised only when every backend raised.
+        """
+        if not groups:
+            raise ValueError("No device IDs given")
+        if len(groups) == 1:
+            name, part = next(iter(groups.items()))
+            return ShardedResponse({name: self._call_shard(name, call, part)}, groups)
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="nanomdm-shard")
+        futures = {name: self._pool.submit(self._call_shard, name, call, part) for name, part in groups.items()}
+
+        responses, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                responses[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+        if not responses:
+            raise next(iter(errors.values()))
+        return ShardedResponse(responses, groups, errors)
+
+    def _by_backend(self, device_ids):
+        if isinstance(device_ids, str):
+            device_ids = [device_ids]
+        return self.registry.partition(device_ids)
+
+    def push(self, device_ids):
+        return self._fan_out(self._by_backend(device_ids), lambda client, ids: client.push(ids))
+
+    def enqueue(self, device_ids, command_bytes, no_push=False):
+        return self._fan_out(
+            self._by_backend(device_ids),
+            lambda client, ids: client.enqueue(ids, command_bytes, no_push=no_push)
+        )
+
+    def clear_queue(self, device_ids):
+        return self._fan_out(self._by_backend(device_ids), lambda client, ids: client.clear_queue(ids))
+
+    def upload_push_cert(self, pem_bundle):
+        # Every instance sends pushes, so every instance needs the certificate
+        groups = {name: None for name in self.registry.backends}
+        return self._fan_out(groups, lambda client, _: client.upload_push_cert(pem_bundle))
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the nanomdm backends devices are sharded over")
+    parser.add_argument('--registry', default=DEFAULT_REGISTRY_PATH, help='Path to backends.json')
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('list', help='Show configured backends')
+
+    add_parser = subparsers.add_parser('add', help='Add a nanomdm instance')
+    add_parser.add_argument('name')
+    add_parser.add_argument('host')
+    add_parser.add_argument('--server-url', default=None, help='Device-facing URL (default: host)')
+    add_parser.add_argument('--username', default='nanomdm')
+    add_parser.add_argument('--password', default='nanomdm')
+
+    remove_parser = subparsers.add_parser('remove', help='Remove a nanomdm instance')
+    remove_parser.add_argument('name')
+
+    assign_parser = subparsers.add_parser('assign', help='Pin an enrolled device to its backend')
+    assign_parser.add_argument('device_id')
+    assign_parser.add_argument('name')
+
+    locate_parser = subparsers.add_parser('locate', help='Show which backend serves a device')
+    locate_parser.add_argument('device_ids', nargs='+')
+
+    preview_parser = subparsers.add_parser('preview-add', help='How many unpinned devices would move if a backend is added')
+    preview_parser.add_argument('name')
+    preview_parser.add_argument('host')
+    preview_parser.add_argument('--devices', required=True, help='File with one enrollment ID per line')
+
+    args = parser.parse_args()
+    registry = BackendRegistry.load(args.registry)
+
+    if args.command == 'list':
+        for name, backend in registry.backends.items():
+            print(f"  {name}: {backend['host']} (devices enroll at {registry.enrollment_url(name)})")
+    elif args.command == 'add':
+        registry.add(args.name, args.host, args.username, args.password, args.server_url)
+        registry.save()
+        print(f"✅ Added backend {args.name} ({args.host})")
+        print(f"   Start it with: -webhook-url {DEFAULT_WEBHOOK_BASE}/{args.name}")
+    elif args.command == 'remove':
+        registry.remove(args.name)
+        registry.save()
+        print(f"✅ Removed backend {args.name}")
+    elif args.command == 'assign':
+        registry.assign(args.device_id, args.name)
+        print(f"✅ {args.device_id} is pinned to {args.name}")
+    elif args.command == 'locate':
+        for device_id in args.device_ids:
+            name = registry.backend_for(device_id)
+            how = "pinned" if registry.assigned(device_id) == name else "ring"
+            print(f"  {device_id} -> {name} ({registry.backends[name]['host']}, {how})")
+    elif args.command == 'preview-add':
+        with open(args.devices) as f:
+            device_ids = [line.strip() for line in f if line.strip()]
+        # Pinned devices stay on their backend, so only unpinned ones can move
+        device_ids = [device_id for device_id in device_ids if registry.assigned(device_id) is None]
+        before = {device_id: registry.backend_for(device_id) for device_id in device_ids}
+        registry.add(args.name, args.host)
+        moved = sum(1 for device_id in device_ids if registry.backend_for(device_id) != before[device_id])
+        share = moved / len(device_ids) if device_ids else 0
+        print(f"📊 {moved}/{len(device_ids)} devices ({share:.1%}) would move to {args.name}")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Bulk Enrollment - Per-device enrollment profiles with one-time SCEP challenges
+
+Takes a device roster and builds one enrollment profile per device, each with
+its own random SCEP challenge, in parallel across all cores. Profiles are
+streamed straight into a zip file as they are built. Every issued challenge
+is recorded, as its SHA-256 only, in the challenge_service database that the
+SCEP server's csrverifier checks. The append-only JSONL ledger is kept for
+setups that verify challenges themselves (--ledger); its challenges are not
+accepted by the shipped csrverifier.
+
+Without a fixed --nanomdm-url each device is placed on a backend from
+backends.json, and its profile's ServerURL/CheckInURL point at that backend.
+"""
+
+import os
+import csv
+import json
+import time
+import uuid
+import hashlib
+import secrets
+import zipfile
+import plistlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_LEDGER_PATH = os.path.join(HOME_DIR, "hideaway_setup", "challenges.jsonl")
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def generate_challenge():
+    """Random one-time SCEP challenge password"""
+    return secrets.token_urlsafe(24)
+
+
+def hash_challenge(challenge):
+    return hashlib.sha256(challenge.encode()).hexdigest()
+
+
+class ChallengeLedger:
+    """Append-only record of issued challenges with O(1) verification
+
+    Only challenge hashes are stored, so the ledger itself can't be used to
+    enroll a device. Each line is either an issue record
+    {"hash", "device", "expires"} or a use record {"hash", "used"}.
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}  # challenge hash -> {"device", "expires", "used"}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Torn write at the end of the file
+
+                if "used" in record:
+                    entry = self._entries.get(record["hash"])
+                    if entry:
+                        entry["used"] = record["used"]
+                else:
+                    self._entries[record["hash"]] = {
+                        "device": record["device"],
+                        "expires": record["expires"],
+                        "used": None
+                    }
+
+    def _append(self, records):
+        with open(self.path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def issue_many(self, devices, ttl=DEFAULT_TTL):
+        """Issue one challenge per device; returns {device: challenge}"""
+        expires = time.time() + ttl
+        challenges = {device: generate_challenge() for device in devices}
+        records = [
+            {"hash": hash_challenge(challenge), "device": device, "expires": expires}
+            for device, challenge in challenges.items()
+        ]
+
+        with self._lock:
+            self._append(records)
+            for record in records:
+                self._entries[record["hash"]] = {
+                    "device": record["device"],
+                    "expires": expires,
+                    "used": None
+                }
+
+        return challenges
+
+    def issue(self, device, ttl=DEFAULT_TTL):
+        return self.issue_many([device], ttl)[device]
+
+    def verify(self, challenge, consume=True):
+        """Return the device a valid challenge was issued to, or None
+
+        A challenge is valid once: verifying with `consume` marks it used.
+        """
+        challenge_hash = hash_challenge(challenge)
+
+        with self._lock:
+            entry = self._entries.get(challenge_hash)
+            if not entry or entry["used"] or entry["expires"] < time.time():
+                return None
+
+            if consume:
+                entry["used"] = time.time()
+                self._append([{"hash": challenge_hash, "used": entry["used"]}])
+
+            return entry["device"]
+
+    def outstanding(self):
+        """Number of unused, unexpired challenges"""
+        now = time.time()
+        with self._lock:
+            return sum(1 for e in self._entries.values() if not e["used"] and e["expires"] >= now)
+
+
+def build_enrollment_profile(device, challenge, mdm_url, scep_url, push_topic):
+    """Build one device's enrollment profile (same layout as setup_iphone's)
+
+    `mdm_url` is the full check-in URL of the device's backend.
+    """
+    scep_uuid = str(uuid.uuid4())
+
+    profile = {
+        "PayloadContent": [
+            # SCEP payload for device certificate
+            {
+                "PayloadDisplayName": "Device Certificate",
+                "PayloadIdentifier": "com.focuscontroller.scep",
+                "PayloadType": "com.apple.security.scep",
+                "PayloadUUID": scep_uuid,
+                "PayloadVersion": 1,
+
+                "URL": f"{scep_url}/scep",
+                "Challenge": challenge,
+                "Subject": [
+                    [ ["CN", device] ],
+                    [ ["O", "Focus Controller"] ]
+                ],
+                "KeyType": "RSA",
+                "KeySize": 2048,
+                "KeyUsage": 5,  # Digital signature + Key encipherment
+                "AllowAllAppsAccess": False
+            },
+
+            # MDM payload
+            {
+                "PayloadDisplayName": "Focus Controller MDM",
+                "PayloadIdentifier": "com.focuscontroller.mdm",
+                "PayloadType": "com.apple.mdm",
+                "PayloadUUID": str(uuid.uuid4()),
+                "PayloadVersion": 1,
+
+                "IdentityCertificateUUID": scep_uuid,
+                "Topic": push_topic,
+                "ServerURL": mdm_url,
+                "CheckInURL": mdm_url,
+                "CheckOutWhenRemoved": True,
+
+                "AccessRights": 8191,  # All access rights
+                "UseDevelopmentAPNS": False
+            }
+        ],
+
+        "PayloadDescription": "Focus Controller - Remote iPhone app blocking",
+        "PayloadDisplayName": "Focus Controller",
+        "PayloadIdentifier": "com.focuscontroller.enrollment",
+        "PayloadOrganization": "Focus Controller",
+        "PayloadRemovalDisallowed": False,
+        "PayloadType": "Configuration",
+        "PayloadUUID": str(uuid.uuid4()),
+        "PayloadVersion": 1
+    }
+
+    return plistlib.dumps(profile)
+
+
+def _build_one(job):
+    device, challenge, mdm_url, scep_url, push_topic = job
+    return device, build_enrollment_profile(device, challenge, mdm_url, scep_url, push_topic)
+
+
+def read_roster(path):
+    """Read device names from a roster file (first CSV column, '#' comments)"""
+    devices = []
+    seen = set()
+    with open(path, 'r', newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].lstrip().startswith('#'):
+                continue
+            device = row[0].strip()
+            if device.lower() == "device" and not devices:
+                continue  # Header row
+            if device not in seen:
+                seen.add(device)
+                devices.append(device)
+    return devices
+
+
+def _safe_filename(device):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in device)
+
+
+def _unique_filenames(devices):
+    """{device: file name}, with a numeric suffix where names would collide"""
+    names, used = {}, set()
+    for device in devices:
+        base = name = _safe_filename(device)
+        suffix = 2
+        while name.lower() in used:
+            name = f"{base}-{suffix}"
+            suffix += 1
+        used.add(name.lower())
+        names[device] = name
+    return names
+
+
+def enrollment_urls(devices, nanomdm_url=None, registry=None):
+    """{device: MDM check-in URL}, all `nanomdm_url` or each device's backend"""
+    if nanomdm_url:
+        return {device: f"{nanomdm_url.rstrip('/')}/mdm" for device in devices}
+
+    from backend_registry import BackendRegistry
+    registry = registry or BackendRegistry.load()
+    return {device: registry.enrollment_url(registry.enrollment_backend(device)) for device in devices}
+
+
+def build_enrollment_zip(devices, zip_path, nanomdm_url, scep_url, push_topic,
+                         ledger=None, ttl=DEFAULT_TTL, processes=None, chunksize=None, registry=None):
+    """Issue challenges and stream per-device enrollment profiles into a zip
+
+    Challenges go into `ledger`, by default the challenge_service database
+    the SCEP csrverifier checks. With `nanomdm_url` None, devices are spread
+    over the backends in `registry` (backends.json by default). Returns the
+    number of profiles written.
+    """
+    devices = list(devices)
+    if not devices:
+        return 0
+
+    if ledger is None:
+        from challenge_service import ChallengeStore
+        ledger = ChallengeStore()
+    filenames = _unique_filenames(devices)
+    challenges = ledger.issue_many(devices, ttl)
+    urls = enrollment_urls(devices, nanomdm_url, registry)
+    jobs = [(device, challenges[device], urls[device], scep_url, push_topic) for device in devices]
+
+    processes = processes or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (processes * 4))
+
+    os.makedirs(os.path.dirname(os.path.abspath(zip_path)), exist_ok=True)
+    tmp_path = f"{zip_path}.{os.getpid()}.tmp"
+    written = 0
+
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        def write(results):
+            nonlocal written
+            for device, profile_bytes in results:
+                archive.writestr(f"{filenames[device]}.mobileconfig", profile_bytes)
+                written += 1
+
+        # Small batches aren't worth the process start-up cost
+        if processes == 1 or len(jobs) < 2 * processes:
+            write(_build_one(job) for job in jobs)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                write(executor.map(_build_one, jobs, chunksize=chunksize))
+
+    os.replace(tmp_path, zip_path)
+    return written
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build per-device enrollment profiles with one-time challenges")
+    parser.add_argument('roster', help='Roster file with one device name per line (first CSV column)')
+    parser.add_argument('--output', default='enrollment_profiles.zip')
+    parser.add_argument('--db', default=None, help='challenge_service database (default: the one csrverifier checks)')
+    parser.add_argument('--ledger', nargs='?', const=DEFAULT_LEDGER_PATH, default=None,
+                        help='Issue into a JSONL ledger instead (not checked by the shipped csrverifier)')
+    parser.add_argument('--ttl-hours', type=float, default=DEFAULT_TTL / 3600)
+    parser.add_argument('--nanomdm-url', default=None, help='Single nanomdm URL (default: backends.json)')
+    parser.add_argument('--scep-url', default='http://127.0.0.1:8080')
+    parser.add_argument('--topic', default='com.apple.mgmt.External.placeholder')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    devices = read_roster(args.roster)
+    if not devices:
+        print("❌ Roster is empty")
+        return
+
+    from challenge_service import ChallengeStore, DEFAULT_DB_PATH
+    if args.ledger:
+        ledger = ChallengeLedger(args.ledger)
+    else:
+        ledger = ChallengeStore(args.db or DEFAULT_DB_PATH)
+
+    start = time.time()
+    count = build_enrollment_zip(
+        devices, args.output, args.nanomdm_url, args.scep_url, args.topic,
+        ledger=ledger, ttl=args.ttl_hours * 3600, processes=args.processes
+    )
+
+    print(f"✅ {count} enrollment profiles written to {args.output} in {time.time() - start:.2f}s")
+    print(f"🔑 Challenges recorded in {ledger.path} (valid {args.ttl_hours:g}h, one use each)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+CA Certificate - Fetch, convert and cache the SCEP CA certificate in-process
+
+Replaces the `curl ...GetCACert` + `openssl x509 -inform DER` pair used by
+the setup scripts. The certificate is fetched over a reused HTTP session,
+converted DER -> PEM in-process, verified, and cached on disk by SHA-256
+fingerprint so unchanged certificates are never rewritten.
+"""
+
+import os
+import ssl
+import json
+import time
+import hashlib
+import datetime
+import requests
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives.serialization import pkcs7, Encoding
+except ImportError:
+    x509 = None
+
+# Reused across calls so repeated fetches share one connection pool
+_session = requests.Session()
+
+
+class CACertificateError(Exception):
+    """Raised when the CA certificate can't be fetched or fails verification"""
+
+
+def fetch_ca_certificate(scep_url, timeout=10, session=None):
+    """Fetch the raw GetCACert response from a SCEP server base URL"""
+    session = session or _session
+    response = session.get(
+        f"{scep_url.rstrip('/')}/scep",
+        params={"operation": "GetCACert"},
+        timeout=timeout
+    )
+    if response.status_code != 200 or not response.content:
+        raise CACertificateError(f"GetCACert failed: HTTP {response.status_code}")
+    return response.content
+
+
+def extract_ca_certificate(data):
+    """Return the DER CA certificate from a GetCACert response
+
+    SCEP servers answer with a bare DER certificate, or with a degenerate
+    PKCS#7 bundle when RA certificates are also published.
+    """
+    if x509 is None:
+        # Without cryptography we can only handle the bare certificate case
+        return data
+
+    try:
+        x509.load_der_x509_certificate(data)
+        return data
+    except ValueError:
+        pass
+
+    try:
+        certificates = pkcs7.load_der_pkcs7_certificates(data)
+    except ValueError:
+        raise CACertificateError("GetCACert response is neither a certificate nor a PKCS#7 bundle")
+
+    for certificate in certificates:
+        try:
+            if certificate.extensions.get_extension_for_class(x509.BasicConstraints).value.ca:
+                return certificate.public_bytes(Encoding.DER)
+        except x509.ExtensionNotFound:
+            continue
+
+    if not certificates:
+        raise CACertificateError("GetCACert bundle contains no certificates")
+    return certificates[0].public_bytes(Encoding.DER)
+
+
+def verify_ca_certificate(der):
+    """Check the certificate is currently valid, a CA, and correctly self-signed"""
+    if x509 is None:
+        # Best effort: at least make sure it parses as a certificate
+        try:
+            ssl.DER_cert_to_PEM_cert(der)
+        except Exception as e:
+            raise CACertificateError(f"Invalid certificate: {e}")
+        return
+
+    try:
+        certificate = x509.load_der_x509_certificate(der)
+    except ValueError as e:
+        raise CACertificateError(f"Invalid certificate: {e}")
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if not (certificate.not_valid_before_utc <= now <= certificate.not_valid_after_utc):
+        raise CACertificateError(f"CA certificate is not valid now (valid until {certificate.not_valid_after_utc:%Y-%m-%d})")
+
+    try:
+        constraints = certificate.extensions.get_extension_for_class(x509.BasicConstraints).value
+        if not constraints.ca:
+            raise CACertificateError("Certificate is not a CA certificate")
+    except x509.ExtensionNotFound:
+        raise CACertificateError("CA certificate has no BasicConstraints extension")
+
+    if certificate.issuer == certificate.subject:
+        try:
+            certificate.verify_directly_issued_by(certificate)
+        except Exception as e:
+            raise CACertificateError(f"CA self-signature does not verify: {e}")
+
+
+def _atomic_write(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def store_ca_certificate(der, certs_dir):
+    """Write ca.der/ca.pem (and a fingerprint-named copy) unless unchanged
+
+    Returns (pem_path, fingerprint).
+    """
+    fingerprint = hashlib.sha256(der).hexdigest()
+    pem_path = os.path.join(certs_dir, "ca.pem")
+    cached_path = os.path.join(certs_dir, "by-fingerprint", f"{fingerprint}.pem")
+
+    if os.path.exists(cached_path) and os.path.exists(pem_path):
+        with open(pem_path, 'rb') as f, open(cached_path, 'rb') as g:
+            if f.read() == g.read():
+                return pem_path, fingerprint
+
+    pem = ssl.DER_cert_to_PEM_cert(der).encode()
+
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    _atomic_write(cached_path, pem)
+    _atomic_write(os.path.join(certs_dir, "ca.der"), der)
+    _atomic_write(pem_path, pem)
+
+    with open(os.path.join(certs_dir, "ca.json"), 'w') as f:
+        json.dump({"fingerprint": fingerprint, "stored_at": time.time()}, f)
+
+    return pem_path, fingerprint
+
+
+def get_ca_certificate(scep_url, certs_dir, response_data=None, timeout=10):
+    """Fetch (unless `response_data` is given), verify and store the CA certificate
+
+    Returns (pem_path, fingerprint).
+    """
+    os.makedirs(certs_dir, exist_ok=True)
+
+    if response_data is None:
+        response_data = fetch_ca_certificate(scep_url, timeout)
+
+    der = extract_ca_certificate(response_data)
+    verify_ca_certificate(der)
+    return store_ca_certificate(der, certs_dir)
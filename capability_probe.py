@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Capability Probe - Fast, cached checks for the tools setup depends on
+
+Binaries are resolved with a PATH lookup instead of spawning them. Version
+probes that are still needed run concurrently, and results are cached in a
+small state file keyed by binary path, mtime and size, so repeat setup runs
+don't spawn anything at all.
+"""
+
+import os
+import sys
+import json
+import shutil
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_STATE_PATH = os.path.join(HOME_DIR, "hideaway_setup", "capabilities.json")
+
+# Tool name -> version command arguments (binary is resolved from PATH)
+DEFAULT_REQUIREMENTS = {
+    "python3": ["--version"],
+    "go": ["version"],
+    "curl": ["--version"],
+    "openssl": ["version"]
+}
+
+
+def _load_state(state_path):
+    try:
+        with open(state_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state_path, state):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    tmp_path = f"{state_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+
+def _fingerprint(path):
+    """Identify a binary by its resolved path, mtime and size"""
+    real_path = os.path.realpath(path)
+    st = os.stat(real_path)
+    return real_path, f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def _run_version(path, args):
+    """Spawn a version probe; returns (ok, first line of output)"""
+    try:
+        result = subprocess.run([path] + args, capture_output=True, text=True, timeout=15)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return False, str(e)
+
+    output = (result.stdout or result.stderr).strip().splitlines()
+    return result.returncode == 0, output[0] if output else ""
+
+
+def probe_requirements(requirements=None, state_path=DEFAULT_STATE_PATH, use_cache=True):
+    """Check required tools and return {tool: {"ok", "path", "version"}}"""
+    requirements = requirements or DEFAULT_REQUIREMENTS
+    state = _load_state(state_path) if use_cache else {}
+    results = {}
+    to_probe = {}
+
+    for tool, args in requirements.items():
+        path = shutil.which(tool)
+        if path is None:
+            # Not on PATH - no need to spawn anything to know it's missing
+            results[tool] = {"ok": False, "path": None, "version": None}
+            continue
+
+        real_path, stamp = _fingerprint(path)
+        cached = state.get(real_path)
+        if cached and cached.get("stamp") == stamp:
+            results[tool] = {"ok": cached["ok"], "path": path, "version": cached["version"]}
+            continue
+
+        # The running interpreter can answer for itself
+        if tool.startswith("python") and real_path == os.path.realpath(sys.executable):
+            version = f"Python {platform.python_version()}"
+            results[tool] = {"ok": True, "path": path, "version": version}
+            state[real_path] = {"stamp": stamp, "ok": True, "version": version}
+            continue
+
+        to_probe[tool] = (path, real_path, stamp, args)
+
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=len(to_probe)) as executor:
+            futures = {
+                tool: executor.submit(_run_version, path, args)
+                for tool, (path, _, _, args) in to_probe.items()
+            }
+
+        for tool, future in futures.items():
+            path, real_path, stamp, _ = to_probe[tool]
+            ok, version = future.result()
+            results[tool] = {"ok": ok, "path": path, "version": version}
+            state[real_path] = {"stamp": stamp, "ok": ok, "version": version}
+
+    if use_cache:
+        try:
+            _save_state(state_path, state)
+        except OSError:
+            pass  # Caching is best-effort
+
+    return results
+
+
+def main():
+    for tool, info in probe_requirements().items():
+        if info["ok"]:
+            print(f"  ✅ {tool}: {info['version']}")
+        else:
+            print(f"  ❌ {tool}: Not found")
+
+
+if __name__ == "__main__":
+    main()
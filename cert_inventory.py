@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Certificate Inventory - Index of the SCEP depot for expiry planning
+
+Parses the SCEP CA's OpenSSL-style database (scep/depot/index.txt) into an
+in-memory index keyed by serial, subject and expiry. The index refreshes
+incrementally: only lines appended since the last refresh are parsed, and
+the file is only re-read in full when it was replaced or truncated. Issued
+certificates in the depot are read once each, to fill in subjects and dates
+that index.txt doesn't have.
+
+index.txt columns (tab separated):
+    status (V/R/E), expiry, revocation date[,reason], serial (hex), filename, subject
+"""
+
+import os
+import bisect
+import datetime
+import threading
+
+try:
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+except ImportError:
+    x509 = None
+
+DEFAULT_DEPOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scep", "depot")
+
+STATUS_NAMES = {"V": "valid", "R": "revoked", "E": "expired"}
+
+
+def parse_openssl_time(value):
+    """Parse UTCTime (YYMMDDHHMMSSZ) or GeneralizedTime (YYYYMMDDHHMMSSZ)"""
+    value = value.strip().rstrip("Z")
+    if not value:
+        return None
+
+    if len(value) == 12:
+        year = int(value[:2])
+        value = f"{1900 + year if year >= 50 else 2000 + year}{value[2:]}"
+
+    when = datetime.datetime.strptime(value, "%Y%m%d%H%M%S")
+    return when.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def parse_subject(subject):
+    """Split an OpenSSL one-line DN (/CN=x/O=y) into a dict"""
+    fields = {}
+    for part in subject.strip("/").split("/"):
+        if "=" in part:
+            key, value = part.split("=", 1)
+            fields.setdefault(key, value)
+    return fields
+
+
+def parse_index_line(line):
+    """Parse one index.txt line into an entry dict (None if malformed)"""
+    columns = line.rstrip("\r\n").split("\t")
+    if len(columns) < 6:
+        return None
+
+    status, expiry, revoked, serial, filename, subject = columns[:6]
+    try:
+        expires = parse_openssl_time(expiry)
+        revoked_at = parse_openssl_time(revoked.split(",")[0]) if revoked else None
+    except ValueError:
+        return None
+
+    return {
+        "serial": serial.upper(),
+        "status": STATUS_NAMES.get(status, status),
+        "expires": expires,
+        "revoked_at": revoked_at,
+        "filename": filename,
+        "subject": subject,
+        "cn": parse_subject(subject).get("CN")
+    }
+
+
+class CertInventory:
+    """In-memory index over the SCEP depot with incremental refresh"""
+
+    def __init__(self, depot_dir=DEFAULT_DEPOT_DIR, load_certs=True):
+        self.depot_dir = depot_dir
+        self.index_path = os.path.join(depot_dir, "index.txt")
+        self.load_certs = load_certs
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.by_serial = {}
+        self.by_subject = {}   # subject -> [serial, ...] in issue order
+        self._expiry = []      # sorted [(expires, serial)]
+        self._offset = 0
+        self._inode = None
+        self._partial = ""
+        self._seen_files = set()
+
+    def _add(self, entry):
+        serial = entry["serial"]
+        previous = self.by_serial.get(serial)
+        if previous is not None and previous["expires"] is not None:
+            index = bisect.bisect_left(self._expiry, (previous["expires"], serial))
+            if index < len(self._expiry) and self._expiry[index] == (previous["expires"], serial):
+                del self._expiry[index]
+
+        self.by_serial[serial] = entry
+        if entry["expires"] is not None:
+            bisect.insort(self._expiry, (entry["expires"], serial))
+
+        if previous is None or previous["subject"] != entry["subject"]:
+            if previous is not None:
+                self.by_subject.get(previous["subject"], []).remove(serial)
+            self.by_subject.setdefault(entry["subject"], []).append(serial)
+
+    def _refresh_index(self):
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return 0
+
+        # OpenSSL rewrites index.txt (new inode) on revocation; a rewrite or
+        # truncation invalidates the offset, so start over
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            self._reset()
+            self._inode = st.st_ino
+
+        if st.st_size == self._offset:
+            return 0
+
+        with open(self.index_path, 'r') as f:
+            f.seek(self._offset)
+            data = self._partial + f.read()
+            self._offset = f.tell()
+
+        lines = data.split("\n")
+        self._partial = lines.pop()  # Incomplete last line, finished next time
+
+        added = 0
+        for line in lines:
+            entry = parse_index_line(line)
+            if entry:
+                self._add(entry)
+                added += 1
+        return added
+
+    def _load_cert_file(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if data.lstrip().startswith(b"-----BEGIN"):
+            certificate = x509.load_pem_x509_certificate(data)
+        else:
+            certificate = x509.load_der_x509_certificate(data)
+
+        serial = format(certificate.serial_number, "X")
+        if len(serial) % 2:
+            serial = "0" + serial
+
+        cn = certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+        entry = self.by_serial.get(serial)
+        if entry is None:
+            # Issued but not (yet) in index.txt
+            entry = {
+                "serial": serial,
+                "status": "valid",
+                "expires": certificate.not_valid_after_utc.timestamp(),
+                "revoked_at": None,
+                "filename": os.path.basename(path),
+                "subject": "/" + "/".join(
+                    f"{a.rfc4514_attribute_name}={a.value}" for a in certificate.subject
+                ),
+                "cn": cn[0].value if cn else None
+            }
+            self._add(entry)
+        elif entry["cn"] is None and cn:
+            entry["cn"] = cn[0].value
+        entry["path"] = path
+
+    def _refresh_certs(self):
+        if not self.load_certs or x509 is None or not os.path.isdir(self.depot_dir):
+            return 0
+
+        loaded = 0
+        for name in os.listdir(self.depot_dir):
+            if name in self._seen_files or not name.endswith((".pem", ".crt", ".der")):
+                continue
+            if name.startswith("ca."):
+                self._seen_files.add(name)
+                continue
+
+            self._seen_files.add(name)
+            try:
+                self._load_cert_file(os.path.join(self.depot_dir, name))
+                loaded += 1
+            except (OSError, ValueError):
+                continue
+        return loaded
+
+    def refresh(self):
+        """Pick up new index lines and certificate files; returns entries added"""
+        with self._lock:
+            return self._refresh_index() + self._refresh_certs()
+
+    def expiring_within(self, days, now=None, include_expired=False):
+        """Valid certificates expiring in the next `days` days, soonest first"""
+        self.refresh()
+        now = now or datetime.datetime.now(datetime.timezone.utc).timestamp()
+
+        with self._lock:
+            start = 0 if include_expired else bisect.bisect_left(self._expiry, (now, ""))
+            end = bisect.bisect_right(self._expiry, (now + days * 86400, chr(0x10FFFF)))
+            entries = [self.by_serial[serial] for _, serial in self._expiry[start:end]]
+        return [e for e in entries if e["status"] == "valid"]
+
+    def latest_by_device(self):
+        """Newest valid certificate per device (CN)"""
+        self.refresh()
+        latest = {}
+        with self._lock:
+            for entry in self.by_serial.values():
+                if entry["status"] != "valid" or not entry["cn"] or entry["expires"] is None:
+                    continue
+                current = latest.get(entry["cn"])
+                if current is None or entry["expires"] > current["expires"]:
+                    latest[entry["cn"]] = entry
+        return latest
+
+    def devices_expiring_within(self, days, now=None):
+        """Devices whose newest certificate expires in the next `days` days
+
+        Devices that already renewed aren't returned, even if an older
+        certificate of theirs is about to expire.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc).timestamp()
+        deadline = now + days * 86400
+        devices = [
+            entry for entry in self.latest_by_device().values()
+            if entry["expires"] <= deadline
+        ]
+        return sorted(devices, key=lambda e: e["expires"])
+
+    def find(self, serial=None, subject=None, cn=None):
+        """Look up entries by serial, exact subject or CN"""
+        self.refresh()
+        with self._lock:
+            if serial is not None:
+                entry = self.by_serial.get(serial.upper())
+                return [entry] if entry else []
+            if subject is not None:
+                return [self.by_serial[s] for s in self.by_subject.get(subject, [])]
+            if cn is not None:
+                return [e for e in self.by_serial.values() if e["cn"] == cn]
+        return []
+
+    def stats(self):
+        self.refresh()
+        counts = {}
+        with self._lock:
+            for entry in self.by_serial.values():
+                counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Certificate inventory for the SCEP depot")
+    parser.add_argument('--depot', default=DEFAULT_DEPOT_DIR)
+    subparsers = parser.add_subparsers(dest='command')
+
+    expiring_parser = subparsers.add_parser('expiring', help='Devices whose certificate expires soon')
+    expiring_parser.add_argument('--days', type=int, default=30)
+
+    find_parser = subparsers.add_parser('find', help='Look up certificates')
+    find_parser.add_argument('--serial')
+    find_parser.add_argument('--cn')
+
+    subparsers.add_parser('stats', help='Certificate counts by status')
+
+    args = parser.parse_args()
+    inventory = CertInventory(args.depot)
+
+    def describe(entry):
+        expires = datetime.datetime.fromtimestamp(entry["expires"]).strftime("%Y-%m-%d")
+        return f"  {entry['cn'] or entry['subject']}  serial {entry['serial']}  expires {expires}  ({entry['status']})"
+
+    if args.command == 'expiring':
+        devices = inventory.devices_expiring_within(args.days)
+        print(f"📜 {len(devices)} device(s) need renewal within {args.days} days")
+        for entry in devices:
+            print(describe(entry))
+    elif args.command == 'find':
+        for entry in inventory.find(serial=args.serial, cn=args.cn):
+            print(describe(entry))
+    elif args.command == 'stats':
+        for status, count in sorted(inventory.stats().items()):
+            print(f"  {status}: {count}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Challenge Service - One-time, expiring SCEP challenges with an indexed store
+
+Replaces the static `-challenge focuscontroller` the SCEP server was started
+with. Challenges are batch-issued alongside enrollment generation and kept in
+a SQLite table keyed by the challenge's SHA-256, so verification is a single
+primary-key lookup no matter how many challenges are outstanding. Verifying
+consumes the challenge atomically, so a leaked profile can't enroll twice.
+
+The service exposes an HTTP webhook:
+    POST /verify   body: {"challenge": "..."} (JSON) or a PEM/DER CSR
+    -> 200 {"valid": true, "device": "..."} or 403 {"valid": false}
+
+and a `csrverifier` mode for SCEP servers that run an executable per CSR:
+the CSR is read from stdin, checked against the service, and the exit
+status reports the result. scepserver's -csrverifierexec takes a single
+path without arguments, so the setup scripts pass it the shipped
+scep_csrverifier.sh wrapper (CSR_VERIFIER) and start the service with
+service_command().
+
+Usage:
+    python3 challenge_service.py serve --port 8090
+    python3 challenge_service.py issue device-1 device-2
+    python3 challenge_service.py csrverifier < request.csr
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bulk_enrollment import generate_challenge, hash_challenge, DEFAULT_TTL
+
+try:
+    from cryptography import x509
+    from cryptography.x509.oid import AttributeOID
+except ImportError:
+    x509 = None
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_DB_PATH = os.path.join(HOME_DIR, "hideaway_setup", "challenges.db")
+DEFAULT_SERVICE_URL = "http://127.0.0.1:8090"
+# Executable for scepserver -csrverifierexec (runs `csrverifier` below)
+CSR_VERIFIER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scep_csrverifier.sh")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS challenges (
+    hash TEXT PRIMARY KEY,
+    device TEXT NOT NULL,
+    issued_at REAL NOT NULL,
+    expires REAL NOT NULL,
+    used_at REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS challenges_expires ON challenges (expires);
+"""
+
+
+class ChallengeStore:
+    """SQLite-backed challenge store with atomic one-time verification
+
+    Has the same issue/verify interface as bulk_enrollment.ChallengeLedger,
+    so it can be passed to build_enrollment_zip directly.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn.executescript(SCHEMA)
+
+    @property
+    def conn(self):
+        """One connection per thread (the webhook server is threaded)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def issue_many(self, devices, ttl=DEFAULT_TTL):
+        """Issue one challenge per device in one transaction; returns {device: challenge}"""
+        now = time.time()
+        challenges = {device: generate_challenge() for device in devices}
+        rows = [
+            (hash_challenge(challenge), device, now, now + ttl)
+            for device, challenge in challenges.items()
+        ]
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "INSERT INTO challenges (hash, device, issued_at, expires) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        return challenges
+
+    def issue(self, device, ttl=DEFAULT_TTL):
+        return self.issue_many([device], ttl)[device]
+
+    def verify(self, challenge, consume=True):
+        """Return the device a valid challenge was issued to, or None"""
+        challenge_hash = hash_challenge(challenge)
+        now = time.time()
+
+        if not consume:
+            row = self.conn.execute(
+                "SELECT device FROM challenges WHERE hash = ? AND used_at IS NULL AND expires >= ?",
+                (challenge_hash, now)
+            ).fetchone()
+            return row[0] if row else None
+
+        # The conditional UPDATE makes check-and-consume a single atomic step;
+        # only the caller whose UPDATE hit the row gets the device back
+        cursor = self.conn.execute(
+            "UPDATE challenges SET used_at = ? WHERE hash = ? AND used_at IS NULL AND expires >= ?",
+            (now, challenge_hash, now)
+        )
+        if cursor.rowcount != 1:
+            return None
+
+        row = self.conn.execute("SELECT device FROM challenges WHERE hash = ?", (challenge_hash,)).fetchone()
+        return row[0] if row else None
+
+    def revoke_device(self, device):
+        """Invalidate all outstanding challenges for a device"""
+        cursor = self.conn.execute(
+            "UPDATE challenges SET used_at = ? WHERE device = ? AND used_at IS NULL",
+            (time.time(), device)
+        )
+        return cursor.rowcount
+
+    def purge(self, older_than_days=30):
+        """Delete challenges that expired more than `older_than_days` ago"""
+        cursor = self.conn.execute(
+            "DELETE FROM challenges WHERE expires < ?",
+            (time.time() - older_than_days * 86400,)
+        )
+        return cursor.rowcount
+
+    def outstanding(self):
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM challenges WHERE used_at IS NULL AND expires >= ?",
+            (time.time(),)
+        ).fetchone()
+        return row[0]
+
+    def import_ledger(self, ledger_path):
+        """Import outstanding challenges from a bulk_enrollment JSONL ledger"""
+        issued = {}
+        used = set()
+        with open(ledger_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "used" in record:
+                    used.add(record["hash"])
+                else:
+                    issued[record["hash"]] = record
+
+        now = time.time()
+        rows = [
+            (h, r["device"], now, r["expires"])
+            for h, r in issued.items() if h not in used and r["expires"] >= now
+        ]
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO challenges (hash, device, issued_at, expires) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+
+def challenge_from_csr(data):
+    """Extract the challengePassword attribute from a PEM or DER CSR"""
+    if x509 is None:
+        raise RuntimeError("cryptography is required to parse CSRs (pip install cryptography)")
+
+    if data.lstrip().startswith(b"-----BEGIN"):
+        csr = x509.load_pem_x509_csr(data)
+    else:
+        csr = x509.load_der_x509_csr(data)
+
+    try:
+        value = csr.attributes.get_attribute_for_oid(AttributeOID.CHALLENGE_PASSWORD).value
+    except x509.AttributeNotFound:
+        return None
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    store = None
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != "/verify":
+            self._reply(404, {"error": "not found"})
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                challenge = json.loads(body).get("challenge")
+            else:
+                challenge = challenge_from_csr(body)
+        except Exception as e:
+            self._reply(400, {"valid": False, "error": str(e)})
+            return
+
+        device = self.store.verify(challenge) if challenge else None
+        if device:
+            self._reply(200, {"valid": True, "device": device})
+        else:
+            self._reply(403, {"valid": False})
+
+    def do_GET(self):
+        if self.path.rstrip('/') == "/health":
+            self._reply(200, {"outstanding": self.store.outstanding()})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        pass  # Keep the SCEP log readable
+
+
+def serve(store, host="127.0.0.1", port=8090):
+    """Run the verification webhook until interrupted"""
+    handler = type("WebhookHandler", (_WebhookHandler,), {"store": store})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"🔑 Challenge service listening on http://{host}:{port}/verify")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def service_command(db_path=DEFAULT_DB_PATH, port=8090):
+    """Arguments that run the verification webhook, e.g. for ServerSupervisor"""
+    return [sys.executable, os.path.abspath(__file__), "--db", db_path, "serve", "--port", str(port)]
+
+
+def verify_csr_via_service(csr_bytes, service_url=DEFAULT_SERVICE_URL, timeout=5):
+    """Ask a running challenge service about a CSR; returns True if accepted"""
+    import requests
+
+    challenge = challenge_from_csr(csr_bytes)
+    if not challenge:
+        return False
+
+    response = requests.post(
+        f"{service_url.rstrip('/')}/verify",
+        json={"challenge": challenge},
+        timeout=timeout
+    )
+    return response.status_code == 200
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="One-time SCEP challenge service")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='Path to the challenge database')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser('serve', help='Run the verification webhook')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8090)
+
+    issue_parser = subparsers.add_parser('issue', help='Issue challenges for devices')
+    issue_parser.add_argument('devices', nargs='+')
+    issue_parser.add_argument('--ttl-hours', type=float, default=DEFAULT_TTL / 3600)
+
+    import_parser = subparsers.add_parser('import', help='Import a bulk_enrollment ledger')
+    import_parser.add_argument('ledger')
+
+    verifier_parser = subparsers.add_parser('csrverifier', help='Verify a CSR from stdin (exit 0 = valid)')
+    verifier_parser.add_argument('--service', default=DEFAULT_SERVICE_URL)
+
+    subparsers.add_parser('purge', help='Delete long-expired challenges')
+    subparsers.add_parser('stats', help='Show outstanding challenge count')
+
+    args = parser.parse_args()
+
+    if args.command == 'csrverifier':
+        # Runs once per CSR, so don't open the database - ask the service
+        try:
+            sys.exit(0 if verify_csr_via_service(sys.stdin.buffer.read(), args.service) else 1)
+        except Exception as e:
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+
+    store = ChallengeStore(args.db)
+
+    if args.command == 'serve':
+        serve(store, args.host, args.port)
+    elif args.command == 'issue':
+        for device, challenge in store.issue_many(args.devices, args.ttl_hours * 3600).items():
+            print(f"  {device}: {challenge}")
+    elif args.command == 'import':
+        print(f"✅ Imported {store.import_ledger(args.ledger)} outstanding challenge(s)")
+    elif args.command == 'purge':
+        print(f"✅ Purged {store.purge()} expired challenge(s)")
+    elif args.command == 'stats':
+        print(f"  outstanding: {store.outstanding()}")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
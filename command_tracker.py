@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Command Tracker - Supersede stale pending commands in nanomdm's queue
+
+If BLOCK and then UNBLOCK are sent while the phone is offline, both
+InstallProfile commands would run back-to-back on the next check-in. The
+tracker records every command enqueued per device together with the target
+it affects (e.g. the blocking profile slot). When a newer command for the
+same target is sent, the older ones are cleared from nanomdm's queue first,
+so a device coming online only processes the final state.
+
+nanomdm can't delete individual commands - its queue API clears a device's
+whole queue (DELETE /v1/queue/<ids>). A device's queue is therefore only
+cleared when every command still tracked for it targets the same thing;
+if anything unrelated is pending, the new command is simply queued behind
+it. Servers without the queue API fall back to plain enqueueing.
+
+Some commands are cheap to send again, such as an InstalledApplicationList
+query. Their targets can be passed as `replaceable`. They then don't hold
+up a clear; they are dropped with the stale commands, and `on_dropped`
+lets the caller send them again.
+
+Every command sent to nanomdm must therefore be tracked, not only the ones
+that supersede each other: send_tracked() records a command under its own
+target without clearing anything. Entries are forgotten once the device
+answers (nanomdm's webhook reports each acknowledgement, see
+handle_acknowledge), so only commands still waiting in the queue count.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+from backend_registry import device_results
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_TRACKER_PATH = os.path.join(HOME_DIR, "hideaway_setup", "commands.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    command_uuid TEXT NOT NULL,
+    device_id TEXT NOT NULL,
+    target TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    PRIMARY KEY (device_id, command_uuid)
+);
+CREATE INDEX IF NOT EXISTS pending_target ON pending (device_id, target);
+"""
+
+
+class CommandTracker:
+    """Pending command UUIDs per device and target"""
+
+    def __init__(self, path=DEFAULT_TRACKER_PATH, ttl_days=7):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def record(self, device_ids, target, command_uuid):
+        """Remember a command that was just enqueued"""
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pending (command_uuid, device_id, target, enqueued_at) VALUES (?, ?, ?, ?)",
+                [(command_uuid, device_id, target, now) for device_id in device_ids]
+            )
+
+    def pending(self, device_id):
+        """[(command_uuid, target), ...] still tracked for a device, oldest first"""
+        with self._lock:
+            # Commands we never heard back about are assumed done eventually
+            self.conn.execute("DELETE FROM pending WHERE enqueued_at < ?", (time.time() - self.ttl,))
+            return self.conn.execute(
+                "SELECT command_uuid, target FROM pending WHERE device_id = ? ORDER BY enqueued_at",
+                (device_id,)
+            ).fetchall()
+
+    def forget(self, device_ids, command_uuid=None):
+        """Stop tracking a device's commands (all, or a single completed one)"""
+        with self._lock:
+            if command_uuid is None:
+                self.conn.executemany("DELETE FROM pending WHERE device_id = ?", [(d,) for d in device_ids])
+            else:
+                self.conn.executemany(
+                    "DELETE FROM pending WHERE device_id = ? AND command_uuid = ?",
+                    [(d, command_uuid) for d in device_ids]
+                )
+
+    def handle_acknowledge(self, device_id, payload):
+        """Forget a command the device has answered; returns True if one was
+
+        NotNow means the device will be asked again, so the command stays
+        pending.
+        """
+        command_uuid = payload.get("CommandUUID")
+        if not command_uuid or payload.get("Status") in (None, "Idle", "NotNow"):
+            return False
+        self.forget([device_id], command_uuid)
+        return True
+
+    def superseded(self, device_id, target, replaceable=()):
+        """Command UUIDs a new `target` command would supersede
+
+        Commands for `replaceable` targets are included. Returns None when
+        the queue can't be cleared safely because commands for other targets
+        are pending too.
+        """
+        rows = self.pending(device_id)
+        if any(row_target != target and row_target not in replaceable for _, row_target in rows):
+            return None
+        return [command_uuid for command_uuid, _ in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+def send_tracked(client, tracker, device_ids, target, command_uuid, command_bytes, no_push=False):
+    """Enqueue a command and track it under `target` without clearing anything
+
+    The command is recorded before it is sent, so an acknowledgement that
+    arrives before enqueue returns still finds it.
+    """
+    if isinstance(device_ids, str):
+        device_ids = [device_ids]
+
+    tracker.record(device_ids, target, command_uuid)
+    try:
+        response = client.enqueue(device_ids, command_bytes, no_push=no_push)
+    except Exception:
+        tracker.forget(device_ids, command_uuid)
+        raise
+    if response.status_code != 200:
+        # Devices on backends that did take the command keep it tracked
+        results = device_results(response, device_ids)
+        tracker.forget([d for d in device_ids if results.get(d) != 200], command_uuid)
+    return response
+
+
+def send_superseding(client, tracker, device_ids, target, command_uuid, command_bytes, no_push=False,
+                     replaceable=(), on_dropped=None):
+    """Enqueue a command, clearing superseded commands for the same target first
+
+    Pending commands for `replaceable` targets don't prevent the clear; they
+    are removed too, and `on_dropped(device_id, targets)` is called for each
+    device that lost one so the caller can send it again.
+
+    Returns (response, cleared) where `cleared` maps device ID -> list of
+    superseded command UUIDs that were removed from its queue.
+    """
+    if isinstance(device_ids, str):
+        device_ids = [device_ids]
+
+    cleared, dropped = {}, {}
+    for device_id in device_ids:
+        stale = tracker.superseded(device_id, target, replaceable)
+        if stale:
+            cleared[device_id] = stale
+            targets = {row_target for _, row_target in tracker.pending(device_id) if row_target in replaceable}
+            if targets:
+                dropped[device_id] = sorted(targets)
+
+    if cleared and getattr(client, "queue_api", True):
+        response = client.clear_queue(list(cleared))
+        if response.status_code in (404, 405, 501):
+            # Server predates the queue API - leave the stale commands queued
+            client.queue_api = False
+            cleared = {}
+        else:
+            # Only queues on backends that answered were actually cleared
+            results = device_results(response, list(cleared))
+            cleared = {d: uuids for d, uuids in cleared.items() if results.get(d) in (200, 204)}
+            tracker.forget(list(cleared))
+            if on_dropped:
+                for device_id, targets in dropped.items():
+                    if device_id in cleared:
+                        on_dropped(device_id, targets)
+    else:
+        cleared = {}
+
+    response = send_tracked(client, tracker, device_ids, target, command_uuid, command_bytes, no_push)
+    return response, cleared
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+DDM Store - Declarative Device Management state for Hideaway
+
+Instead of sending an InstallProfile command for every block/unblock, the
+selected restrictions are compiled into DDM declarations (a legacy-profile
+configuration plus an activation that turns it on or off) and served from a
+local declaration store. Devices converge on the declared state themselves;
+a toggle only changes the activation and bumps the sync token, and at most
+an APNs push is sent to prompt a check-in - no per-device commands.
+
+Each declaration's ServerToken is the hash of its content, computed once
+when it is stored. A declaration set's DeclarationsToken is derived from its
+members' server tokens and cached; storing a declaration only invalidates
+the tokens of the sets that contain it, and storing identical content
+changes nothing at all.
+
+Each device gets its own declaration set (named after its enrollment ID)
+with its own copies of the declarations, so one device's toggle - or a
+profile built from its app inventory - never reaches another device, and
+every device has its own DeclarationsToken.
+
+The HTTP server speaks the endpoints nanomdm forwards to its `-dm` URL
+(tokens, declaration-items, declaration/<type>/<id>, status), with the
+enrollment ID in the X-Enrollment-ID header, and serves the referenced
+profiles under /profiles/. Run nanomdm with `-dm http://127.0.0.1:9100/dm/`.
+
+Devices download those profiles themselves, and only over HTTPS, so the
+ProfileURLs use a device-reachable HTTPS base URL (e.g. a TLS reverse proxy
+or tunnel in front of port 9100) taken from HIDEAWAY_DDM_BASE_URL or
+--base-url. Without one DDM can't work, and the store refuses to start.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import datetime
+import ipaddress
+import threading
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from profile_archive import ProfileArchive
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_DDM_DIR = os.path.join(HOME_DIR, "hideaway_setup", "ddm")
+# Device-reachable HTTPS URL that serves this store's /profiles/
+BASE_URL_ENV = "HIDEAWAY_DDM_BASE_URL"
+
+RESTRICTIONS_CONFIGURATION = "com.hideaway.configuration.restrictions"
+FOCUS_ACTIVATION = "com.hideaway.activation.focus"
+DEFAULT_SET = "default"
+
+# Declaration type prefix -> section of the declaration-items response
+_ITEM_SECTIONS = {
+    "com.apple.activation.": "Activations",
+    "com.apple.configuration.management.": "Management",
+    "com.apple.configuration.": "Configurations",
+    "com.apple.asset.": "Assets",
+    "com.apple.management.": "Management"
+}
+
+
+def _section_for(declaration_type):
+    for prefix, section in _ITEM_SECTIONS.items():
+        if declaration_type.startswith(prefix):
+            return section
+    return "Configurations"
+
+
+def device_base_url(base_url=None):
+    """The configured HTTPS base URL for profile downloads
+
+    Raises ValueError if none is configured or devices couldn't use it
+    (plain HTTP, loopback or an unspecified address).
+    """
+    base_url = (base_url or os.environ.get(BASE_URL_ENV) or "").strip().rstrip("/")
+    if not base_url:
+        raise ValueError(f"DDM needs a device-reachable HTTPS base URL - set {BASE_URL_ENV}")
+
+    parsed = urlparse(base_url)
+    if parsed.scheme != "https" or not parsed.hostname:
+        raise ValueError(f"DDM base URL must be an https:// URL, got {base_url}")
+    if parsed.hostname == "localhost":
+        raise ValueError(f"DDM base URL {base_url} isn't reachable from devices")
+    try:
+        address = ipaddress.ip_address(parsed.hostname)
+    except ValueError:
+        return base_url
+    if address.is_loopback or address.is_unspecified:
+        raise ValueError(f"DDM base URL {base_url} isn't reachable from devices")
+    return base_url
+
+
+def set_identifier(identifier, set_name):
+    """Identifier of a declaration within a set (unsuffixed for the default set)"""
+    return identifier if set_name == DEFAULT_SET else f"{identifier}.{set_name}"
+
+
+def _server_token(declaration_type, payload):
+    data = json.dumps([declaration_type, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+
+class DeclarationStore:
+    """Declarations, declaration sets and enrollment assignments on disk"""
+
+    def __init__(self, root=DEFAULT_DDM_DIR, base_url=None, archive=None):
+        self.root = root
+        self.state_path = os.path.join(root, "state.json")
+        # Validated up front so DDM is never enabled with unusable ProfileURLs
+        self.base_url = device_base_url(base_url)
+        self.archive = archive or ProfileArchive(os.path.join(root, "profiles"))
+
+        self._lock = threading.RLock()
+        self._token_cache = {}  # set name -> (DeclarationsToken, timestamp)
+
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+
+        self.declarations = state.get("declarations", {})  # identifier -> declaration
+        self.sets = state.get("sets", {})                  # set name -> [identifier, ...]
+        self.enrollments = state.get("enrollments", {})    # enrollment ID -> {"set", "enabled"}
+        self.set_timestamps = state.get("set_timestamps", {})
+        self.sources = state.get("sources", {})            # identifier -> what it was compiled from
+        self.status = {}
+
+    def _save(self):
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "declarations": self.declarations,
+                "sets": self.sets,
+                "enrollments": self.enrollments,
+                "set_timestamps": self.set_timestamps,
+                "sources": self.sources
+            }, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def _invalidate(self, identifier=None, set_name=None):
+        """Drop cached tokens for one set, or for every set containing a declaration"""
+        now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        names = [set_name] if set_name else [
+            name for name, members in self.sets.items() if identifier in members
+        ]
+        for name in names:
+            self._token_cache.pop(name, None)
+            self.set_timestamps[name] = now
+
+    def put_declaration(self, declaration_type, identifier, payload, source=None):
+        """Store a declaration; returns True if its content changed
+
+        `source` optionally records what the declaration was compiled from
+        (see compiled_from) so callers can skip recompiling it.
+        """
+        token = _server_token(declaration_type, payload)
+
+        with self._lock:
+            if source is not None:
+                self.sources[identifier] = source
+
+            current = self.declarations.get(identifier)
+            if current and current["ServerToken"] == token:
+                if source is not None:
+                    self._save()
+                return False
+
+            self.declarations[identifier] = {
+                "Type": declaration_type,
+                "Identifier": identifier,
+                "ServerToken": token,
+                "Payload": payload
+            }
+            self._invalidate(identifier=identifier)
+            self._save()
+            return True
+
+    def compiled_from(self, identifier):
+        return self.sources.get(identifier)
+
+    def remove_declaration(self, identifier):
+        with self._lock:
+            if self.declarations.pop(identifier, None) is None:
+                return False
+            self._invalidate(identifier=identifier)
+            for members in self.sets.values():
+                if identifier in members:
+                    members.remove(identifier)
+            self._save()
+            return True
+
+    def set_members(self, set_name, identifiers):
+        """Replace the declarations in a set; returns True if it changed"""
+        identifiers = sorted(set(identifiers))
+        with self._lock:
+            if self.sets.get(set_name) == identifiers:
+                return False
+            self.sets[set_name] = identifiers
+            self._invalidate(set_name=set_name)
+            self._save()
+            return True
+
+    def assign(self, enrollment_id, set_name=DEFAULT_SET):
+        """Serve a declaration set to an enrollment"""
+        with self._lock:
+            self.enrollments.setdefault(enrollment_id, {"set": set_name, "enabled": False})["set"] = set_name
+            self._save()
+
+    def mark_enabled(self, enrollment_id):
+        """Record that the DeclarativeManagement command was sent to a device"""
+        with self._lock:
+            self.enrollments.setdefault(enrollment_id, {"set": DEFAULT_SET, "enabled": False})["enabled"] = True
+            self._save()
+
+    def is_enabled(self, enrollment_id):
+        return self.enrollments.get(enrollment_id, {}).get("enabled", False)
+
+    def _set_for(self, enrollment_id):
+        return self.enrollments.get(enrollment_id, {}).get("set", DEFAULT_SET)
+
+    def declarations_token(self, set_name):
+        """DeclarationsToken for a set (cached until one of its members changes)"""
+        with self._lock:
+            cached = self._token_cache.get(set_name)
+            if cached:
+                return cached
+
+            digest = hashlib.sha256()
+            for identifier in self.sets.get(set_name, []):
+                declaration = self.declarations.get(identifier)
+                if declaration:
+                    digest.update(f"{identifier}:{declaration['ServerToken']}\n".encode())
+
+            timestamp = self.set_timestamps.get(set_name) or "1970-01-01T00:00:00Z"
+            self._token_cache[set_name] = (digest.hexdigest()[:32], timestamp)
+            return self._token_cache[set_name]
+
+    def tokens(self, enrollment_id):
+        """Body of the `tokens` endpoint"""
+        token, timestamp = self.declarations_token(self._set_for(enrollment_id))
+        return {"SyncTokens": {"DeclarationsToken": token, "Timestamp": timestamp}}
+
+    def declaration_items(self, enrollment_id):
+        """Body of the `declaration-items` endpoint"""
+        set_name = self._set_for(enrollment_id)
+        items = {"Activations": [], "Configurations": [], "Assets": [], "Management": []}
+
+        with self._lock:
+            for identifier in self.sets.get(set_name, []):
+                declaration = self.declarations.get(identifier)
+                if declaration:
+                    items[_section_for(declaration["Type"])].append({
+                        "Identifier": identifier,
+                        "ServerToken": declaration["ServerToken"]
+                    })
+
+        return {
+            "Declarations": items,
+            "DeclarationsToken": self.declarations_token(set_name)[0]
+        }
+
+    def declaration(self, enrollment_id, identifier):
+        """A single declaration, if it belongs to the enrollment's set"""
+        with self._lock:
+            if identifier not in self.sets.get(self._set_for(enrollment_id), []):
+                return None
+            return self.declarations.get(identifier)
+
+    def record_status(self, enrollment_id, report):
+        with self._lock:
+            self.status[enrollment_id] = {"received_at": time.time(), "report": report}
+
+    def profile_url(self, profile_bytes):
+        """Store a profile and return the URL a legacy configuration can fetch it from"""
+        profile_hash = self.archive.put(profile_bytes)
+        return f"{self.base_url}/profiles/{profile_hash}.mobileconfig"
+
+
+def compile_blocking_state(store, blocked_apps, build_profile, blocking, set_name=DEFAULT_SET, variant=None):
+    """Compile the block/unblock state into the declarations of one set
+
+    The restrictions profile becomes a legacy-profile configuration that
+    stays in the set; blocking only toggles whether the activation
+    references it. `build_profile(blocked_apps)` returns profile bytes and is
+    only called when the app selection (or `variant`, anything else the
+    profile depends on) changed. Pass the device's enrollment ID as
+    `set_name` so the state only applies to that device. Returns True if
+    anything the set's devices see changed.
+    """
+    configuration = set_identifier(RESTRICTIONS_CONFIGURATION, set_name)
+    activation = set_identifier(FOCUS_ACTIVATION, set_name)
+    selection = sorted(blocked_apps)
+    source = selection if variant is None else [selection, variant]
+    changed = False
+    if store.compiled_from(configuration) != source:
+        changed = store.put_declaration(
+            "com.apple.configuration.legacy",
+            configuration,
+            {"ProfileURL": store.profile_url(build_profile(selection))},
+            source=source
+        )
+    changed |= store.put_declaration(
+        "com.apple.activation.simple",
+        activation,
+        {"StandardConfigurations": [configuration] if blocking else []}
+    )
+    changed |= store.set_members(set_name, [configuration, activation])
+    return changed
+
+
+def build_enable_command(store, enrollment_id):
+    """DeclarativeManagement command that turns on DDM for a device (sent once)"""
+    from mdm_commands import build_command
+
+    data = json.dumps(store.tokens(enrollment_id)).encode()
+    return build_command("DeclarativeManagement", Data=data)
+
+
+class _DDMHandler(BaseHTTPRequestHandler):
+    store = None
+
+    def _reply(self, status, body=None, content_type="application/json"):
+        payload = b"" if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self):
+        path = self.path.split("?")[0]
+
+        if path.startswith("/profiles/"):
+            profile_hash = path[len("/profiles/"):].split(".")[0]
+            try:
+                self._reply(200, self.store.archive.get(profile_hash), "application/x-apple-aspen-config")
+            except (OSError, ValueError):
+                self._reply(404)
+            return
+
+        if not path.startswith("/dm/"):
+            self._reply(404)
+            return
+
+        enrollment_id = self.headers.get("X-Enrollment-ID")
+        if not enrollment_id:
+            self._reply(400, {"error": "missing X-Enrollment-ID"})
+            return
+
+        endpoint = path[len("/dm/"):].strip("/")
+        if endpoint == "tokens":
+            self._reply(200, self.store.tokens(enrollment_id))
+        elif endpoint == "declaration-items":
+            self._reply(200, self.store.declaration_items(enrollment_id))
+        elif endpoint.startswith("declaration/"):
+            declaration = self.store.declaration(enrollment_id, endpoint.split("/")[-1])
+            if declaration:
+                self._reply(200, declaration)
+            else:
+                self._reply(404)
+        elif endpoint == "status":
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            try:
+                self.store.record_status(enrollment_id, json.loads(body or b"{}"))
+            except ValueError:
+                pass
+            self._reply(200)
+        else:
+            self._reply(404)
+
+    do_GET = _handle
+    do_PUT = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_in_background(store, host="127.0.0.1", port=9100):
+    """Start the DDM server on a daemon thread and return the server"""
+    handler = type("DDMHandler", (_DDMHandler,), {"store": store})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="ddm-server", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve Hideaway DDM declarations for nanomdm -dm")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--root', default=DEFAULT_DDM_DIR)
+    parser.add_argument('--base-url', default=None, help=f'HTTPS URL devices fetch profiles from (default: ${BASE_URL_ENV})')
+    args = parser.parse_args()
+
+    try:
+        store = DeclarationStore(args.root, base_url=args.base_url)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    server = serve_in_background(store, args.host, args.port)
+    print(f"📜 DDM declarations served at http://{args.host}:{args.port}/dm/")
+    print(f"   Profiles are fetched by devices from {store.base_url}/profiles/")
+    print(f"   Start nanomdm with: -dm http://{args.host}:{args.port}/dm/")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Domain Trie - Minimal web-filter deny lists and allow/deny conflict checks
+
+Blocked domains are stored in a trie keyed by their labels in reverse order
+(com -> youtube -> www). An entry blocks the domain and all of its
+subdomains, so "www.youtube.com" and "m.youtube.com" add nothing once
+"youtube.com" is present. Lookups walk one node per label, so "is X blocked"
+costs O(labels) however many domains are loaded.
+
+    trie = DomainTrie(["youtube.com", "www.youtube.com", "m.youtube.com"])
+    trie.minimized()                 -> ["youtube.com"]
+    trie.blocked_by("music.youtube.com") -> "youtube.com"
+    trie.conflicts(["www.youtube.com"])  -> [("www.youtube.com", "youtube.com")]
+
+Usage:
+    python3 domain_trie.py minimize domains.txt
+    python3 domain_trie.py check domains.txt <domain> [...]
+    python3 domain_trie.py conflicts domains.txt permitted.txt
+"""
+
+import sys
+
+# Marks a node whose domain is itself blocked (not a string, so no label can collide)
+_END = object()
+
+
+def normalize_domain(entry):
+    """Host part of a deny/allow entry: no scheme, path, port, wildcard or trailing dot"""
+    host = entry.strip().lower()
+    if "://" in host:
+        host = host.split("://", 1)[1]
+    host = host.split("/", 1)[0].split(":", 1)[0].rstrip(".")
+    if host.startswith("*."):
+        host = host[2:]
+    return host
+
+
+def _labels(domain):
+    """Labels of a domain, last first; raises ValueError for malformed entries"""
+    labels = normalize_domain(domain).split(".")
+    if not all(labels) or any("*" in label for label in labels):
+        raise ValueError(f"Invalid domain: {domain!r}")
+    return reversed(labels)
+
+
+class DomainTrie:
+    """Blocked domains by reversed labels; an entry covers its subdomains"""
+
+    def __init__(self, domains=()):
+        self.root = {}
+        self.count = 0
+        self.update(domains)
+
+    def add(self, domain):
+        """Add a domain; returns False if it was already covered
+
+        Raises ValueError for malformed entries ("a..com", "*.").
+        """
+        node = self.root
+        for label in _labels(domain):
+            if _END in node:
+                return False
+            node = node.setdefault(label, {})
+        if _END in node:
+            return False
+        # Entries below this one are now redundant
+        self.count -= sum(1 for _ in self._walk(node))
+        node.clear()
+        node[_END] = normalize_domain(domain)
+        self.count += 1
+        return True
+
+    def update(self, domains):
+        for domain in domains:
+            self.add(domain)
+
+    def blocked_by(self, domain):
+        """The entry that blocks `domain`, or None (ValueError if malformed)"""
+        node = self.root
+        for label in _labels(domain):
+            if _END in node:
+                return node[_END]
+            node = node.get(label)
+            if node is None:
+                return None
+        return node.get(_END)
+
+    def __contains__(self, domain):
+        return self.blocked_by(domain) is not None
+
+    def entries_under(self, domain):
+        """Blocked entries equal to or below `domain`"""
+        node = self.root
+        for label in _labels(domain):
+            node = node.get(label)
+            if node is None:
+                return []
+        return list(self._walk(node))
+
+    def _walk(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if _END in node:
+                yield node[_END]
+                continue
+            stack.extend(node.values())
+
+    def minimized(self):
+        """Smallest deny list with the same coverage, sorted by reversed labels"""
+        return sorted(self._walk(self.root), key=lambda d: d.split(".")[::-1])
+
+    def conflicts(self, permitted):
+        """[(permitted entry, blocked entry), ...] where the two overlap
+
+        A permitted domain conflicts with the entry that blocks it, and with
+        any blocked subdomain below it (the allow is only partly effective).
+        """
+        found = []
+        for entry in permitted:
+            blocker = self.blocked_by(entry)
+            if blocker is not None:
+                found.append((entry, blocker))
+            else:
+                found.extend((entry, below) for below in self.entries_under(entry))
+        return found
+
+    def __len__(self):
+        return self.count
+
+
+def _bare_host(entry):
+    """Host of an entry that names a whole domain, or None
+
+    Entries with a path, port or wildcard only block part of a domain, and
+    malformed ones can't be compared at all, so neither covers anything.
+    """
+    host = entry.strip().lower()
+    if "://" in host:
+        host = host.split("://", 1)[1]
+    host = host.rstrip("/").rstrip(".")
+    if not host or any(c in host for c in "/:*"):
+        return None
+    labels = host.split(".")
+    if not all(labels):
+        return None
+    return host
+
+
+def minimize_domains(domains):
+    """Deny list without entries covered by a parent domain (order of first appearance)
+
+    Only whole-domain entries cover others. Path-scoped entries
+    ("reddit.com/r/python") and entries that can't be parsed are kept
+    exactly as given unless a whole-domain parent covers their host, so
+    minimizing never widens what the list blocks.
+    """
+    trie = DomainTrie(host for host in map(_bare_host, domains) if host)
+    result, seen = [], set()
+    for domain in domains:
+        host = _bare_host(domain)
+        if host is not None:
+            # Kept only if no other entry covers it
+            if trie.blocked_by(host) == host and host not in seen:
+                seen.add(host)
+                result.append(host)
+            continue
+        try:
+            covered = trie.blocked_by(normalize_domain(domain)) is not None
+        except ValueError:
+            covered = False
+        if not covered and domain not in seen:
+            seen.add(domain)
+            result.append(domain)
+    return result
+
+
+def _read_list(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Minimize and check web-filter domain lists")
+    subparsers = parser.add_subparsers(dest='command')
+
+    minimize_parser = subparsers.add_parser('minimize', help='Print the minimal deny list')
+    minimize_parser.add_argument('domains')
+
+    check_parser = subparsers.add_parser('check', help='Show whether domains are blocked')
+    check_parser.add_argument('domains')
+    check_parser.add_argument('names', nargs='+')
+
+    conflicts_parser = subparsers.add_parser('conflicts', help='Find permitted domains that overlap the deny list')
+    conflicts_parser.add_argument('domains')
+    conflicts_parser.add_argument('permitted')
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(1)
+
+    domains = _read_list(args.domains)
+    if args.command == 'minimize':
+        minimized = minimize_domains(domains)
+        for domain in minimized:
+            print(domain)
+        print(f"📊 {len(domains)} entries -> {len(minimized)}", file=sys.stderr)
+        return
+
+    try:
+        trie = DomainTrie(domains)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.command == 'check':
+        for name in args.names:
+            try:
+                blocker = trie.blocked_by(name)
+            except ValueError as e:
+                print(f"  ❌ {e}")
+                continue
+            print(f"  🚫 {name} (by {blocker})" if blocker else f"  ✅ {name}")
+    elif args.command == 'conflicts':
+        conflicts = trie.conflicts(_read_list(args.permitted))
+        for permitted, blocked in conflicts:
+            print(f"  ⚠️ {permitted} overlaps {blocked}")
+        print(f"📊 {len(conflicts)} conflict(s)")
+
+
+if __name__ == "__main__":
+    main()
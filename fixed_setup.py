@@ -6,126 +6,123 @@ This script detects your Mac's IP address and creates a proper enrollment profil
 """
 
 import os
-import subprocess
-import time
 import uuid
 import plistlib
-import socket
-import re
+
+from server_supervisor import ServerSupervisor
+from readiness import wait_for_scep, wait_for_nanomdm, ServiceNotReady
+import ca_certificate
+import network_interfaces
+from backend_registry import BackendRegistry, DEFAULT_WEBHOOK_BASE
+from challenge_service import ChallengeStore, CSR_VERIFIER, service_command
+
+# Project directory (override with HIDEAWAY_BASE_DIR instead of editing paths)
+BASE_DIR = os.environ.get("HIDEAWAY_BASE_DIR", "/Users/paul/Files/vsc_projekte/app_block")
+
+# Shared supervisor so server output is drained and crashes are restarted
+supervisor = ServerSupervisor(log_dir=f"{BASE_DIR}/logs")
+
+# Where the controller reaches the nanomdm API started here
+NANOMDM_API_URL = "http://127.0.0.1:9000"
 
 def get_mac_ip():
     """Get Mac's IP address on local network"""
-    try:
-        # Method 1: Connect to a remote address to get local IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        
-        # Verify it's a local network IP
-        if ip.startswith(('192.168.', '10.', '172.')):
-            return ip
-            
-        # Method 2: Parse ifconfig output
-        result = subprocess.run(['ifconfig'], capture_output=True, text=True)
-        lines = result.stdout.split('\n')
-        
-        for line in lines:
-            if 'inet ' in line and '127.0.0.1' not in line:
-                match = re.search(r'inet (\d+\.\d+\.\d+\.\d+)', line)
-                if match:
-                    ip = match.group(1)
-                    if ip.startswith(('192.168.', '10.', '172.')):
-                        return ip
-        
-        print("⚠️  Could not detect Mac IP address, using 172.20.10.4")
-        return "172.20.10.4"
-        
-    except Exception as e:
-        print(f"⚠️  Error detecting IP: {e}, using 172.20.10.4")
-        return "172.20.10.4"
+    # Read from the interface list directly - works offline and spawns nothing
+    ip = network_interfaces.best_address()
+    if ip:
+        return ip
+
+    print("⚠️  Could not detect a LAN address, using 127.0.0.1 (iPhone won't be able to connect)")
+    return "127.0.0.1"
 
 def start_scep_server(bind_ip="0.0.0.0"):
     """Start SCEP server bound to all interfaces"""
     print("🚀 Starting SCEP server...")
     
-    scep_binary = "/Users/paul/Files/vsc_projekte/app_block/scep/scepserver"
+    scep_binary = f"{BASE_DIR}/scep/scepserver"
     
     if not os.path.exists(scep_binary):
         print("❌ SCEP server not found.")
         return None
         
     try:
+        # One-time challenges are checked (and consumed) by the challenge service
+        supervisor.start("challenges", service_command())
+        
         # Start SCEP server bound to all interfaces
-        process = subprocess.Popen([
+        process = supervisor.start("scep", [
             scep_binary,
             "-allowrenew", "0",
-            "-challenge", "focuscontroller",
+            "-csrverifierexec", CSR_VERIFIER,
             "-port", "8080",
             "-listen", f"{bind_ip}:8080"
-        ], cwd="/Users/paul/Files/vsc_projekte/app_block/scep")
+        ], cwd=f"{BASE_DIR}/scep")
         
         print("✅ SCEP server started on port 8080 (all interfaces)")
-        print("🔑 Challenge password: focuscontroller")
+        print("🔑 Challenges: one-time, issued per enrollment profile")
         return process
         
     except Exception as e:
         print(f"❌ Failed to start SCEP server: {e}")
         return None
 
-def get_ca_certificate(mac_ip):
+def get_ca_certificate(mac_ip, response_data=None):
     """Get CA certificate from SCEP server"""
     print("📜 Getting CA certificate...")
     
-    ca_dir = "/Users/paul/Files/vsc_projekte/app_block/certs"
-    os.makedirs(ca_dir, exist_ok=True)
+    ca_dir = f"{BASE_DIR}/certs"
     
     try:
-        time.sleep(3)  # Wait for SCEP to start
+        # Fetched, converted to PEM and verified in-process
+        ca_path, fingerprint = ca_certificate.get_ca_certificate(
+            f"http://{mac_ip}:8080", ca_dir, response_data
+        )
         
-        # Get CA cert from SCEP server using Mac's IP
-        ca_url = f"http://{mac_ip}:8080/scep?operation=GetCACert"
-        print(f"  Requesting CA cert from: {ca_url}")
-        
-        subprocess.run([
-            "curl", ca_url, "-o", f"{ca_dir}/ca.der"
-        ], check=True)
-        
-        # Convert to PEM
-        subprocess.run([
-            "openssl", "x509", "-inform", "DER", "-in", f"{ca_dir}/ca.der",
-            "-out", f"{ca_dir}/ca.pem"
-        ], check=True)
-        
-        print(f"✅ CA certificate saved to {ca_dir}/ca.pem")
-        return f"{ca_dir}/ca.pem"
+        print(f"✅ CA certificate saved to {ca_path}")
+        return ca_path
         
     except Exception as e:
         print(f"❌ Failed to get CA certificate: {e}")
         print("  Make sure SCEP server is running and accessible")
         return None
 
-def start_nanomdm_server(ca_path, bind_ip="0.0.0.0"):
+def register_backend(mac_ip):
+    """Record the local nanomdm in backends.json with the URL iPhones reach it at
+
+    Returns (registry, backend name). Enrollment profiles point at this
+    backend, and its webhook pins enrolling devices to it.
+    """
+    registry = BackendRegistry.load(default_host=NANOMDM_API_URL)
+    name = registry.find(NANOMDM_API_URL)
+    if name is None:
+        name = "local"
+        registry.add(name, NANOMDM_API_URL)
+    registry.backends[name]["server_url"] = f"http://{mac_ip}:9000"
+    registry.save()
+    return registry, name
+
+def start_nanomdm_server(ca_path, bind_ip="0.0.0.0", backend_name="default"):
     """Start nanomdm server bound to all interfaces"""
     print("🚀 Starting nanomdm server...")
     
-    nanomdm_binary = "/Users/paul/Files/vsc_projekte/app_block/nanomdm/nanomdm-darwin-arm64"
+    nanomdm_binary = f"{BASE_DIR}/nanomdm/nanomdm-darwin-arm64"
     
     if not os.path.exists(nanomdm_binary):
         print("❌ nanomdm binary not found. Please build it first:")
-        print("  cd /Users/paul/Files/vsc_projekte/app_block/nanomdm")
+        print(f"  cd {BASE_DIR}/nanomdm")
         print("  make my")
         return None
     
     try:
         # Start nanomdm bound to all interfaces
-        process = subprocess.Popen([
+        process = supervisor.start("nanomdm", [
             nanomdm_binary,
             "-ca", ca_path,
             "-api", "nanomdm",
             "-debug",
+            "-webhook-url", f"{DEFAULT_WEBHOOK_BASE}/{backend_name}",
             "-listen", f"{bind_ip}:9000"
-        ], cwd="/Users/paul/Files/vsc_projekte/app_block/nanomdm")
+        ], cwd=f"{BASE_DIR}/nanomdm")
         
         print("✅ nanomdm server started on port 9000 (all interfaces)")
         print("🔑 API key: nanomdm")
@@ -143,9 +140,10 @@ def create_enrollment_profile(mac_ip):
     scep_uuid = str(uuid.uuid4())
     mdm_uuid = str(uuid.uuid4())
     
-    # URLs that iPhone can access
+    # URLs that iPhone can access (MDM from the backend the device is pinned to)
+    registry, backend_name = register_backend(mac_ip)
     scep_url = f"http://{mac_ip}:8080/scep"
-    mdm_url = f"http://{mac_ip}:9000/mdm"
+    mdm_url = registry.enrollment_url(backend_name)
     
     profile = {
         "PayloadContent": [
@@ -158,7 +156,7 @@ def create_enrollment_profile(mac_ip):
                 "PayloadVersion": 1,
                 
                 "URL": scep_url,
-                "Challenge": "focuscontroller",
+                "Challenge": ChallengeStore().issue("iPhone"),
                 "Subject": [
                     [ ["CN", "Focus Controller Device"] ],
                     [ ["O", "Focus Controller"] ]
@@ -199,7 +197,7 @@ def create_enrollment_profile(mac_ip):
     }
     
     # Save profile
-    profile_path = "/Users/paul/Files/vsc_projekte/app_block/FocusController_Fixed.mobileconfig"
+    profile_path = f"{BASE_DIR}/FocusController_Fixed.mobileconfig"
     with open(profile_path, 'wb') as f:
         plistlib.dump(profile, f)
         
@@ -239,20 +237,34 @@ def main():
     if not scep_process:
         return False
     
+    # Wait until SCEP actually serves its CA certificate
+    try:
+        ca_response = wait_for_scep(f"http://{mac_ip}:8080", server=scep_process)
+    except ServiceNotReady as e:
+        print(f"❌ {e}")
+        supervisor.stop_all()
+        return False
+    
     # Get CA certificate
-    ca_path = get_ca_certificate(mac_ip)
+    ca_path = get_ca_certificate(mac_ip, ca_response)
     if not ca_path:
-        scep_process.terminate()
+        supervisor.stop_all()
         return False
     
-    # Start nanomdm server
-    nanomdm_process = start_nanomdm_server(ca_path, "0.0.0.0")
+    # Start nanomdm server (its webhook pins enrolling devices to it)
+    _, backend_name = register_backend(mac_ip)
+    nanomdm_process = start_nanomdm_server(ca_path, "0.0.0.0", backend_name)
     if not nanomdm_process:
-        scep_process.terminate()
+        supervisor.stop_all()
         return False
     
-    # Wait for servers to start
-    time.sleep(3)
+    # Wait until nanomdm is listening
+    try:
+        wait_for_nanomdm(f"http://{mac_ip}:9000", server=nanomdm_process)
+    except ServiceNotReady as e:
+        print(f"❌ {e}")
+        supervisor.stop_all()
+        return False
     
     # Create enrollment profile with correct IP
     profile_path = create_enrollment_profile(mac_ip)
@@ -276,17 +288,17 @@ def main():
     print("")
     print("Press Ctrl+C to stop servers")
     
-    # Keep servers running
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("\n🛑 Stopping servers...")
-        if scep_process:
-            scep_process.terminate()
-        if nanomdm_process:
-            nanomdm_process.terminate()
-        print("✅ Servers stopped")
+    # Servers listen on all interfaces, so only the profile needs the new IP
+    def on_address_change(old_ip, new_ip):
+        if new_ip:
+            print(f"\n🌐 Mac IP changed: {old_ip} -> {new_ip}, regenerating enrollment profile")
+            create_enrollment_profile(new_ip)
+    
+    watcher = network_interfaces.InterfaceWatcher(on_address_change).start()
+    
+    # Keep servers running (restarted on crash) until Ctrl+C
+    supervisor.wait_forever()
+    watcher.stop()
     
     return True
 
@@ -8,11 +8,9 @@ All functionality bundled into a single file for easy distribution.
 
 import sys
 import os
-import subprocess
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import requests
-from requests.auth import HTTPBasicAuth
 import json
 import uuid
 import tempfile
@@ -22,66 +20,56 @@ import plistlib
 from datetime import datetime, timedelta
 import platform
 
+from profile_archive import ProfileArchive
+from profile_signer import signer_from_env
+from supervised_profile_generator import SupervisedProfileGenerator as CatalogProfileGenerator
+from domain_trie import DomainTrie
+from payload_packer import DEFAULT_PAYLOAD_BUDGET, split_payload
+from backend_registry import BackendRegistry, ShardedClient
+from app_inventory import AppInventory, serve_webhook, INVENTORY_TARGET
+from mdm_commands import build_install_profile_command
+from command_tracker import CommandTracker, send_superseding, send_tracked
+from send_dispatcher import SendDispatcher
+from rate_limiter import RateLimiter
+from push_certificate import cached_topic
+from push_queue import PushQueue, PushWorker
+from nanomdm_health import CircuitBreaker, CircuitOpenError, HealthMonitor
+from ddm_store import DeclarationStore, compile_blocking_state, build_enable_command, serve_in_background
+
+# Queue slot shared by block and unblock profiles (see command_tracker)
+BLOCKING_TARGET = "com.hideaway.blocking"
+# Queue slot of the command that turns on declarative management
+DDM_TARGET = "com.hideaway.ddm"
+
 # Get user's home directory and Desktop path
 HOME_DIR = os.path.expanduser("~")
 DESKTOP_DIR = os.path.join(HOME_DIR, "Desktop")
 
-class SupervisedProfileGenerator:
-    """Profile generator compatible with nanomdm and iOS MDM standards"""
+class SupervisedProfileGenerator(CatalogProfileGenerator):
+    """Profile generator compatible with nanomdm and iOS MDM standards
     
-    def __init__(self):
-        # Comprehensive app bundle database
-        self.app_bundles = {
-            # Social Media
-            "Instagram": "com.burbn.instagram",
-            "YouTube": "com.google.ios.youtube", 
-            "TikTok": "com.zhiliaoapp.musically",
-            "Facebook": "com.facebook.Facebook",
-            "Twitter/X": "com.twitter.twitter",
-            "Snapchat": "com.toyopagroup.picaboo",
-            "Reddit": "com.reddit.Reddit",
-            "Discord": "com.hammerandchisel.discord",
-            "LinkedIn": "com.linkedin.LinkedIn",
-            "Pinterest": "com.pinterest.pinterest",
-            
-            # Entertainment
-            "Netflix": "com.netflix.Netflix",
-            "Disney+": "com.disney.disneyplus",
-            "Amazon Prime": "com.amazon.avod.thirdpartyclient",
-            "Spotify": "com.spotify.client",
-            "Twitch": "tv.twitch",
-            
-            # Games (examples)
-            "Candy Crush": "com.king.candycrushsaga",
-            "PUBG Mobile": "com.tencent.ig",
-            "Clash of Clans": "com.supercell.magic",
-            
-            # Apple Apps (these can be blocked on supervised devices)
-            "Safari": "com.apple.mobilesafari",
-            "Camera": "com.apple.camera", 
-            "Photos": "com.apple.mobileslideshow",
-            "Music": "com.apple.Music",
-            "App Store": "com.apple.AppStore",
-            "iTunes Store": "com.apple.MobileStore",
-            "Messages": "com.apple.MobileSMS",
-            "Mail": "com.apple.mobilemail",
-            "FaceTime": "com.apple.facetime",
-            "Maps": "com.apple.Maps",
-            "News": "com.apple.news",
-            
-            # Messaging
-            "WhatsApp": "net.whatsapp.WhatsApp",
-            "Telegram": "ph.telegra.Telegraph",
-            "Signal": "org.whispersystems.signal",
-            "Messenger": "com.facebook.Messenger"
-        }
+    The app catalog and website mapping come from supervised_profile_generator.
+    """
+        
+    def create_app_blocking_profile(self, blocked_apps, profile_name="Focus Mode", installed_apps=None, mode="auto",
+                                    permitted_urls=None, payload_budget=DEFAULT_PAYLOAD_BUDGET):
+        """Create iOS-compatible configuration profile using proper MDM structures
         
-    def create_app_blocking_profile(self, blocked_apps, profile_name="Focus Mode"):
-        """Create iOS-compatible configuration profile using proper MDM structures"""
+        With `installed_apps` (the device's inventory) only installed apps are
+        blacklisted, or the equivalent allowlist is used when it is smaller
+        (see choose_app_restriction). A blacklist too long for `payload_budget`
+        bytes is split over several payloads. Websites are blocked for the
+        whole selection either way; `permitted_urls` that overlap them are
+        recorded in last_web_filter_conflicts.
+        """
         
         profile_uuid = str(uuid.uuid4()).upper()
         restrictions_uuid = str(uuid.uuid4()).upper()
         
+        restriction_key, restriction_ids, self.last_restriction_report = self.choose_app_restriction(
+            blocked_apps, installed_apps, mode
+        )
+        
         # Use the exact structure from Apple's Configuration Profile Reference
         profile = {
             "PayloadContent": [],
@@ -107,10 +95,35 @@ class SupervisedProfileGenerator:
             
             # Use the correct key name from Apple's documentation
             "familyControlsEnabled": False,
-            "blacklistedAppBundleIDs": blocked_apps,
+            restriction_key: restriction_ids,
         }
         
-        profile["PayloadContent"].append(restrictions_payload)
+        if restriction_key == "blacklistedAppBundleIDs":
+            profile["PayloadContent"].extend(split_payload(restrictions_payload, restriction_key, payload_budget))
+        else:
+            # Several allowlists would intersect, so an allowlist stays in one payload
+            profile["PayloadContent"].append(restrictions_payload)
+        
+        # Block the web versions too, whether or not the app is installed
+        websites = self._get_related_websites(blocked_apps)
+        self.last_web_filter_conflicts = DomainTrie(websites).conflicts(permitted_urls or [])
+        if websites:
+            web_filter_uuid = str(uuid.uuid4()).upper()
+            web_filter_payload = {
+                "PayloadDisplayName": "Web Content Filter",
+                "PayloadIdentifier": f"com.hideaway.webfilter.{web_filter_uuid.lower()}",
+                "PayloadType": "com.apple.webcontent-filter",
+                "PayloadUUID": web_filter_uuid,
+                "PayloadVersion": 1,
+                "FilterType": "BuiltIn",
+                "AutoFilterEnabled": True,
+                "FilterBrowsers": True,
+                "FilterSockets": True,
+                "DenyListURLs": websites
+            }
+            if permitted_urls:
+                web_filter_payload["PermittedURLs"] = list(permitted_urls)
+            profile["PayloadContent"].append(web_filter_payload)
         
         return profile
     
@@ -267,16 +280,85 @@ class HideawayController:
         self.api_username = "nanomdm" 
         self.api_password = "nanomdm"
         self.device_id = ""
+        
+        # Devices are spread over the nanomdm instances in backends.json
+        # (just nanomdm_host until more are added) and pinned to the one
+        # they enrolled with
+        self.backends = BackendRegistry.load(
+            default_host=self.nanomdm_host, username=self.api_username, password=self.api_password
+        )
         self.is_blocking = False
         
         # Initialize profile generator
         self.profile_generator = SupervisedProfileGenerator()
         
+        # Generated profiles go to a content-addressed archive instead of the Desktop
+        self.profile_archive = ProfileArchive()
+        
+        # Signing identity from HIDEAWAY_SIGNING_* (loaded after the UI exists so errors can be logged)
+        self.profile_signer = None
+        
+        # Token buckets shared by every nanomdm call (per backend endpoint and APNs topic)
+        self.rate_limiter = RateLimiter()
+        
+        # GUI sends go through the interactive lane, ahead of bulk/scheduled work
+        self.dispatcher = SendDispatcher()
+        
+        # Sends fail fast while a device's nanomdm is down; each backend has
+        # its own breaker and probe, so one dead instance doesn't stop sends
+        # to the others. Profiles queued meanwhile are delivered once its
+        # circuit closes.
+        self.breakers = {}
+        self.health = {}
+        for name, backend in self.backends.backends.items():
+            self.breakers[name] = CircuitBreaker(on_change=self.on_circuit_change)
+            self.health[name] = HealthMonitor(
+                backend["host"], self.breakers[name],
+                on_change=lambda state, name=name: self.on_health_change(name, state)
+            )
+        self.draining = threading.Lock()
+        
+        # Pending commands per device, so stale block/unblock commands get replaced
+        self.command_tracker = CommandTracker()
+        
+        # One client for every send, so pooled connections and what it learns
+        # about the server (e.g. no queue API) survive between sends
+        self.client = ShardedClient(
+            self.backends, breakers=self.breakers, limiter=self.rate_limiter, topic=cached_topic()
+        )
+        
+        # Installed apps per device, so profiles only list apps that are on the phone
+        self.app_inventory = AppInventory(on_change=self.on_inventory_change)
+        self.inventory_server = None
+        
+        # Declarative Device Management state (created on first use)
+        self.ddm_store = None
+        self.ddm_server = None
+        
         # App database with bundle IDs
         self.available_apps = self.profile_generator.app_bundles
         
         self.selected_apps = set()
+        # (selection, DomainTrie) for the web filter coverage lookup
+        self.coverage = None
         self.setup_ui()
+        for monitor in self.health.values():
+            monitor.start()
+        
+        try:
+            self.profile_signer = signer_from_env()
+            if self.profile_signer:
+                self.log("🔏 Profiles are signed before they are sent")
+        except (RuntimeError, OSError, ValueError) as e:
+            self.log(f"⚠️ Profile signing disabled: {e}")
+        
+        try:
+            self.inventory_server = serve_webhook(
+                self.app_inventory, self.command_tracker, registry=self.backends
+            )
+            self.log("📡 nanomdm webhook at http://127.0.0.1:9101/webhook/<backend> (nanomdm -webhook-url)")
+        except OSError as e:
+            self.log(f"⚠️ Inventory webhook not started: {e}")
         
     def setup_ui(self):
         # Main container
@@ -348,6 +430,28 @@ class HideawayController:
         self.control_button = ttk.Button(control_frame, text="🔴 BLOCK APPS", command=self.toggle_blocking)
         self.control_button.grid(row=1, column=0, pady=10)
         
+        # DDM: devices converge on declared state instead of receiving commands
+        self.use_ddm = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            control_frame,
+            text="Declarative mode (DDM, iOS 17+) - run nanomdm with -dm http://127.0.0.1:9100/dm/ and set HIDEAWAY_DDM_BASE_URL",
+            variable=self.use_ddm
+        ).grid(row=2, column=0, sticky=tk.W)
+        
+        # Web filter: sites to keep allowed, and a lookup of what the selection blocks
+        web_frame = ttk.Frame(control_frame)
+        web_frame.grid(row=3, column=0, sticky=tk.W, pady=(5, 0))
+        
+        ttk.Label(web_frame, text="Allowed sites:").grid(row=0, column=0, sticky=tk.W)
+        self.permitted_entry = ttk.Entry(web_frame, width=40)
+        self.permitted_entry.grid(row=0, column=1, padx=(5, 0))
+        
+        ttk.Label(web_frame, text="Check site:").grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        self.check_site_entry = ttk.Entry(web_frame, width=40)
+        self.check_site_entry.grid(row=1, column=1, padx=(5, 0), pady=(5, 0))
+        self.check_site_entry.bind("<Return>", lambda e: self.check_site())
+        ttk.Button(web_frame, text="Check", command=self.check_site).grid(row=1, column=2, padx=(5, 0), pady=(5, 0))
+        
         # Status and logs
         log_frame = ttk.LabelFrame(main_frame, text="📋 Activity Log", padding="10")
         log_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -376,6 +480,152 @@ class HideawayController:
         self.log_text.see(tk.END)
         self.root.update()
         
+    def on_health_change(self, name, state):
+        """Called from a health monitor thread when a nanomdm backend goes up or down"""
+        server = "nanomdm" if len(self.health) == 1 else f"nanomdm backend {name}"
+        if state["healthy"]:
+            message = f"✅ {server} is reachable ({state['latency_ms']} ms)"
+        else:
+            message = f"⚠️ {server} is unreachable ({state['error']}) - sends to its devices will be queued"
+        self.root.after(0, self.log, message)
+        if state["healthy"]:
+            self.drain_push_queue()
+        
+    def on_circuit_change(self, previous, state):
+        """Called (under the breaker's lock) when the circuit opens or closes"""
+        if state == CircuitBreaker.CLOSED:
+            self.drain_push_queue()
+            
+    def drain_push_queue(self):
+        """Deliver profiles queued during an outage, on a background thread
+        
+        Runs until nothing is left to send or every backend is down again.
+        Jobs for a backend that is still down wait without using up attempts.
+        The enqueues go through the bulk lane, so interactive sends stay first.
+        """
+        if not self.draining.acquire(blocking=False):
+            return
+            
+        def drain():
+            queue = PushQueue()
+            worker = PushWorker(range(queue.shards))
+            sent = 0
+            try:
+                while any(breaker.state == CircuitBreaker.CLOSED for breaker in self.breakers.values()):
+                    count = worker.process_batch(
+                        queue, self.nanomdm_client(), self.profile_archive,
+                        dispatcher=self.dispatcher, tracker=self.command_tracker
+                    )
+                    sent += count
+                    if count:
+                        continue
+                    ready_at = queue.next_ready(worker.shards)
+                    if ready_at is None:
+                        break
+                    # Wait out the retry backoff of the next job
+                    time.sleep(min(max(ready_at - time.time(), worker.poll_interval), 5.0))
+                dead = queue.stats()["dead"]
+            finally:
+                queue.close()
+                self.draining.release()
+            if sent:
+                self.root.after(0, self.log, f"📤 Delivered {sent} queued push job(s)")
+            if dead:
+                self.root.after(0, self.log, f"⚠️ {dead} push job(s) failed for good - retry with push_queue.py requeue-dead")
+                
+        threading.Thread(target=drain, name="push-drain", daemon=True).start()
+        
+    def on_inventory_change(self, device_id, added, removed):
+        """Called from the webhook thread when a device's installed apps change"""
+        self.root.after(0, self.reapply_blocking, device_id, added)
+        
+    def reapply_blocking(self, device_id, added):
+        """Re-send the blocking state if the installed apps change what it should list"""
+        selected = {bundle_id for bundle_id, var in self.app_vars.items() if var.get()}
+        newly_blockable = selected & added
+        
+        # An allowlist blocks every app it doesn't name, including new unselected ones
+        report = self.profile_generator.last_restriction_report
+        newly_allowed = added - selected if report and report["representation"] == "allowlist" else set()
+        
+        if device_id != self.device_id or not self.is_blocking or not (newly_blockable or newly_allowed):
+            return
+        
+        self.log(f"📱 {len(added)} app(s) were installed - updating the blocking profile")
+        try:
+            if self.use_ddm.get():
+                self.send_ddm_state(blocking=True)
+            else:
+                self.send_profile_to_device(self.generate_blocking_profile(block_apps=True))
+        except Exception as e:
+            self.log(f"❌ Error: {str(e)}")
+            
+    def refresh_inventory(self):
+        """Ask the device for its installed apps in the background (bulk lane)"""
+        device_id = self.device_id
+        
+        self.dispatcher.submit(
+            "bulk", self.app_inventory.request, self.nanomdm_client(), self.command_tracker, device_id
+        )
+        
+    def permitted_urls(self):
+        """Sites from the "Allowed sites" box"""
+        return [site.strip() for site in self.permitted_entry.get().split(",") if site.strip()]
+        
+    def website_coverage(self):
+        """Trie of the domains the current selection blocks (rebuilt when the selection changes)"""
+        selection = tuple(bundle_id for bundle_id, var in self.app_vars.items() if var.get())
+        if self.coverage is None or self.coverage[0] != selection:
+            websites = self.profile_generator._get_related_websites(selection)
+            self.coverage = (selection, DomainTrie(websites))
+        return self.coverage[1]
+        
+    def check_site(self):
+        """Show whether a site is blocked by the current selection, and by which entry"""
+        site = self.check_site_entry.get().strip()
+        if not site:
+            return
+        trie = self.website_coverage()
+        try:
+            blocker = trie.blocked_by(site)
+            allowed_by = DomainTrie(self.permitted_urls()).blocked_by(site)
+        except ValueError as e:
+            self.log(f"❌ {e}")
+            return
+        
+        if blocker is None:
+            self.log(f"✅ {site} is not blocked ({len(trie)} blocked domains)")
+        elif allowed_by is not None:
+            self.log(f"⚠️ {site} is blocked by {blocker} but also allowed by {allowed_by}")
+        else:
+            self.log(f"🚫 {site} is blocked by {blocker}")
+        
+    def log_web_filter_conflicts(self):
+        """Warn about allowed sites that overlap blocked ones in the last profile"""
+        for permitted, blocked in self.profile_generator.last_web_filter_conflicts:
+            self.log(f"⚠️ Allowed site {permitted} overlaps blocked {blocked}")
+            
+    def log_restriction_report(self):
+        """Log which app list representation the last profile used"""
+        report = self.profile_generator.last_restriction_report
+        if report["representation"] == "allowlist":
+            self.log(
+                f"📐 Allowlist of {report['allowlist_entries']} apps ({report['allowlist_bytes']} bytes) instead of "
+                f"blocklist of {report['blocklist_entries']} ({report['blocklist_bytes']} bytes) - "
+                f"saved {report['bytes_saved']} bytes"
+            )
+        else:
+            self.log(f"📐 Blocklist of {report['blocklist_entries']} apps ({report['blocklist_bytes']} bytes)")
+            
+    def device_inventory(self):
+        """Installed bundle IDs on the device, or None while unknown (everything selected is listed)"""
+        if self.device_id in ("", "demo_device"):
+            return None
+        installed = self.app_inventory.installed(self.device_id)
+        if installed is None:
+            self.refresh_inventory()
+        return installed
+        
     def select_social_media(self):
         """Quick select common social media apps"""
         social_apps = [
@@ -427,39 +677,42 @@ class HideawayController:
         if not device_id:
             # If no device ID provided, just simulate connection for demo
             self.device_id = "demo_device"
-            self.log("✅ Demo mode - profiles will be saved to Desktop")
+            self.log("✅ Demo mode - profiles will be saved to the profile archive")
             self.status_label.config(text="Status: Demo mode active")
-            messagebox.showinfo("Demo Mode", "No device UDID provided. Running in demo mode - profiles will be saved to Desktop.")
+            messagebox.showinfo("Demo Mode", "No device UDID provided. Running in demo mode - profiles will be saved to the profile archive.")
             return
         
         # Try to connect to nanomdm server
         try:
             # Test nanomdm API endpoint
-            url = f"{self.nanomdm_host}/v1/push/{device_id}"
-            response = requests.get(
-                url,
-                auth=HTTPBasicAuth(self.api_username, self.api_password),
-                timeout=10
-            )
+            response = self.nanomdm_client().push(device_id)
             
             if response.status_code == 200:
                 self.device_id = device_id
                 self.log(f"✅ Connected to nanomdm server for device {device_id}")
+                self.refresh_inventory()
                 self.status_label.config(text=f"Status: Connected to {device_id[:8]}...")
                 messagebox.showinfo("Success", "Connection to nanomdm server successful!")
             else:
                 self.log(f"❌ nanomdm server connection failed: {response.status_code}")
-                # Fall back to demo mode
+                # The server answered but doesn't know this device - fall back to demo mode
                 self.device_id = "demo_device"
-                self.status_label.config(text="Status: Demo mode (server not available)")
-                messagebox.showwarning("Server Unavailable", f"Could not connect to nanomdm server.\nUsing demo mode - profiles will be saved to Desktop.")
+                self.status_label.config(text="Status: Demo mode (device not available)")
+                messagebox.showwarning("Device Unavailable", f"nanomdm rejected device {device_id} (HTTP {response.status_code}).\nUsing demo mode - profiles will be saved to the profile archive.")
                 
+        except (CircuitOpenError, requests.ConnectionError, requests.Timeout) as e:
+            # nanomdm itself is down - keep the device and queue sends until it recovers
+            self.device_id = device_id
+            self.log(f"❌ nanomdm unavailable: {str(e)}")
+            self.status_label.config(text=f"Status: {device_id[:8]}... (nanomdm down, sends queued)")
+            messagebox.showwarning("Server Unavailable", f"Could not reach nanomdm: {str(e)}\n\nProfiles will be queued and delivered once the server is back.")
+            
         except Exception as e:
             self.log(f"❌ Connection error: {str(e)}")
             # Fall back to demo mode
             self.device_id = "demo_device" 
             self.status_label.config(text="Status: Demo mode (server unavailable)")
-            messagebox.showwarning("Connection Error", f"Could not connect to nanomdm server: {str(e)}\n\nUsing demo mode - profiles will be saved to Desktop.")
+            messagebox.showwarning("Connection Error", f"Could not connect to nanomdm server: {str(e)}\n\nUsing demo mode - profiles will be saved to the profile archive.")
             
     def generate_blocking_profile(self, block_apps=True):
         """Generate nanomdm-compatible iOS configuration profile"""
@@ -478,10 +731,21 @@ class HideawayController:
                         app_names.append(app_name)
                         break
             
+            installed = self.device_inventory()
+            if installed is not None:
+                skipped = sum(1 for bundle_id in selected_bundles if bundle_id not in installed)
+                if skipped:
+                    self.log(f"📱 {skipped} selected app(s) aren't installed - only their websites are blocked")
+            
             profile = self.profile_generator.create_app_blocking_profile(
                 selected_bundles, 
-                f"Hideaway Block - {', '.join(app_names)}"[:50]
+                f"Hideaway Block - {', '.join(app_names)}"[:50],
+                installed_apps=installed,
+                mode="auto",
+                permitted_urls=self.permitted_urls()
             )
+            self.log_restriction_report()
+            self.log_web_filter_conflicts()
         else:
             # Simple removal profile - just empty payload
             profile = {
@@ -498,55 +762,185 @@ class HideawayController:
             
         return profile
         
+    def serialize_profile(self, profile_content):
+        """Profile bytes as sent to devices - signed when a signing identity is configured"""
+        profile_bytes = plistlib.dumps(profile_content)
+        if self.profile_signer:
+            profile_bytes = self.profile_signer.sign(profile_bytes)
+        return profile_bytes
+        
     def send_profile_to_device(self, profile_content):
-        """Send profile to device via nanomdm or save to Desktop"""
+        """Send profile to device via nanomdm or store it in the profile archive"""
         if not self.device_id:
             raise Exception("No device connected")
         
-        # Save profile to Desktop with timestamp
-        filename = f"hideaway_nanomdm_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mobileconfig"
-        filepath = os.path.join(DESKTOP_DIR, filename)
-        
-        with open(filepath, 'wb') as f:
-            plistlib.dump(profile_content, f)
+        # Store profile in the archive (identical profiles are only written once)
+        entry = self.profile_archive.store(
+            self.device_id,
+            self.serialize_profile(profile_content),
+            label=profile_content.get("PayloadDisplayName", "")
+        )
+        filepath = entry["path"]
             
-        self.log(f"📁 Profile saved to Desktop: {filename}")
+        self.log(f"📁 Profile archived: {filepath}")
         
-        # If we have a real device connection, also try to send via nanomdm
+        # If we have a real device connection, also send it via nanomdm
         if self.device_id != "demo_device":
             try:
-                # Use nanomdm's cmdr.py approach - send InstallProfile command
-                # This requires nanomdm tools to be available
-                cmdr_path = os.path.join(os.path.dirname(__file__), "nanomdm", "tools", "cmdr.py")
-                if os.path.exists(cmdr_path):
-                    # Generate InstallProfile command using cmdr.py
-                    cmd = ["python3", cmdr_path, "InstallProfile", filepath]
-                    result = subprocess.run(cmd, capture_output=True, text=True)
+                profile_bytes = self.profile_archive.get(entry["hash"])
+                command_uuid, command = build_install_profile_command(profile_bytes)
+                
+                # A profile queued during an outage must not land after this one
+                self.cancel_queued()
+                
+                # Block and unblock target the same slot, so a newer one
+                # replaces any still waiting for an offline device. A pending
+                # inventory query doesn't hold that up - it is asked again.
+                dropped = []
+                
+                def on_dropped(device_id, targets):
+                    self.app_inventory.forget_request(device_id)
+                    dropped.append(device_id)
+                    
+                def send():
+                    return send_superseding(
+                        self.nanomdm_client(), self.command_tracker, self.device_id,
+                        BLOCKING_TARGET, command_uuid, command,
+                        replaceable=(INVENTORY_TARGET,), on_dropped=on_dropped
+                    )
+                    
+                response, cleared = self.send_interactive(send)
                     
-                    if result.returncode == 0:
-                        # Send command to nanomdm
-                        url = f"{self.nanomdm_host}/v1/enqueue/{self.device_id}"
-                        response = requests.put(
-                            url,
-                            data=result.stdout.encode(),
-                            headers={'Content-Type': 'application/x-plist'},
-                            auth=HTTPBasicAuth(self.api_username, self.api_password)
-                        )
-                        
-                        if response.status_code == 200:
-                            self.log("📡 Profile sent to device via nanomdm!")
-                            return {"status": "sent_via_nanomdm", "filepath": filepath}
-                        else:
-                            self.log(f"⚠️ nanomdm send failed: {response.status_code}")
-                    else:
-                        self.log(f"⚠️ Command generation failed: {result.stderr}")
+                if cleared:
+                    self.log(f"🧹 Cleared {len(cleared[self.device_id])} superseded command(s) from the queue")
+                if dropped:
+                    self.refresh_inventory()
+                    
+                if response.status_code == 200:
+                    self.log("📡 Profile sent to device via nanomdm!")
+                    return {"status": "sent_via_nanomdm", "filepath": filepath}
                 else:
-                    self.log("⚠️ nanomdm tools not found - profile saved to Desktop only")
+                    self.log(f"⚠️ nanomdm send failed: {response.status_code}")
+            except (CircuitOpenError, requests.ConnectionError, requests.Timeout) as e:
+                # Backend is down - hand the profile to the durable push queue
+                self.log(f"⚠️ nanomdm unavailable: {str(e)}")
+                self.queue_for_later(entry["hash"])
+                return {"status": "queued", "filepath": filepath}
             except Exception as e:
                 self.log(f"⚠️ nanomdm send error: {str(e)}")
         
         self.log("📱 Transfer this profile to your iPhone and install it manually")
-        return {"status": "saved_to_desktop", "filepath": filepath}
+        return {"status": "archived", "filepath": filepath}
+            
+    def queue_for_later(self, profile_hash):
+        """Queue an archived profile to be delivered when the circuit closes
+        
+        It replaces any block/unblock profile still queued for the device.
+        """
+        queue = PushQueue()
+        try:
+            job_id = queue.enqueue(self.device_id, profile_hash, target=BLOCKING_TARGET)
+        finally:
+            queue.close()
+        self.log(f"📥 Queued as push job {job_id} - it is delivered once nanomdm is back")
+        
+    def cancel_queued(self):
+        """Drop block/unblock profiles still queued for the device"""
+        queue = PushQueue()
+        try:
+            cancelled = queue.cancel(self.device_id, BLOCKING_TARGET)
+        finally:
+            queue.close()
+        if cancelled:
+            self.log(f"🧹 Dropped {cancelled} queued profile(s) replaced by this one")
+        
+    def nanomdm_client(self):
+        """nanomdm API client that routes each device to its backend and respects the shared rate limits"""
+        return self.client
+        
+    def send_interactive(self, func):
+        """Run a send on the interactive lane and wait for it
+        
+        Raises CircuitOpenError right away while the device's nanomdm is
+        known to be down (the client checks each backend's breaker).
+        """
+        result = self.dispatcher.submit("interactive", func).result()
+        
+        latency = self.dispatcher.report()["interactive"]
+        self.log(f"⏱️ Send took {latency['total_p50_ms']} ms (p50), {latency['total_p95_ms']} ms (p95)")
+        return result
+        
+    def send_ddm_state(self, blocking):
+        """Declare the block/unblock state instead of sending a profile"""
+        if not self.device_id:
+            raise Exception("No device connected")
+        
+        if self.ddm_store is None:
+            # Raises ValueError without a device-reachable HTTPS base URL
+            self.ddm_store = DeclarationStore()
+            self.ddm_server = serve_in_background(self.ddm_store)
+            self.log("📜 DDM declarations served at http://127.0.0.1:9100/dm/")
+            self.log(f"📜 Devices fetch profiles from {self.ddm_store.base_url}/profiles/")
+            
+        selected_bundles = [bundle_id for bundle_id, var in self.app_vars.items() if var.get()]
+        installed = self.device_inventory()
+        permitted = self.permitted_urls()
+        
+        def build_profile(bundle_ids):
+            profile = self.profile_generator.create_app_blocking_profile(
+                bundle_ids, "Hideaway Focus", installed_apps=installed, mode="auto",
+                permitted_urls=permitted
+            )
+            self.log_restriction_report()
+            self.log_web_filter_conflicts()
+            return self.serialize_profile(profile)
+        
+        # The profile also depends on the inventory and allowed sites, so changes to them trigger a rebuild
+        inventory = self.app_inventory.fingerprint(self.device_id) if installed is not None else None
+        # Each device has its own set, so this state (and its sync token) only reaches this device
+        changed = compile_blocking_state(
+            self.ddm_store, selected_bundles, build_profile, blocking,
+            set_name=self.device_id, variant=[inventory, sorted(permitted)]
+        )
+        self.ddm_store.assign(self.device_id, set_name=self.device_id)
+        
+        if self.device_id == "demo_device":
+            self.log("📜 Declarations updated (demo mode - no device to notify)")
+            return {"status": "ddm_declared", "filepath": self.ddm_store.state_path}
+            
+        def notify():
+            client = self.nanomdm_client()
+            if not self.ddm_store.is_enabled(self.device_id):
+                # One-time command that switches the device to declarative management
+                command_uuid, command = build_enable_command(self.ddm_store, self.device_id)
+                response = send_tracked(
+                    client, self.command_tracker, self.device_id, DDM_TARGET, command_uuid, command
+                )
+                if response.status_code != 200:
+                    raise Exception(f"enabling DDM failed: HTTP {response.status_code}")
+                self.ddm_store.mark_enabled(self.device_id)
+                return "enabled"
+            if not changed:
+                return "unchanged"
+            # No command needed - a push makes the device fetch new tokens
+            response = client.push(self.device_id)
+            return "notified" if response.status_code == 200 else f"push failed: HTTP {response.status_code}"
+            
+        try:
+            outcome = self.send_interactive(notify)
+        except (CircuitOpenError, requests.ConnectionError, requests.Timeout) as e:
+            # Declarations are stored either way; the device picks them up on its next sync
+            self.log(f"⚠️ nanomdm unavailable, device not notified: {str(e)}")
+            return {"status": "ddm_declared", "filepath": self.ddm_store.state_path}
+            
+        if outcome == "enabled":
+            self.log("📡 Declarative management enabled on device")
+        elif outcome.startswith("push failed"):
+            self.log(f"⚠️ Device not notified ({outcome}) - it picks up the change on its next sync")
+            return {"status": "ddm_declared", "filepath": self.ddm_store.state_path}
+            
+        self.log("📡 Declarations updated - device will sync on its own" if changed else "📜 Declarations unchanged")
+        return {"status": "ddm_synced", "filepath": self.ddm_store.state_path}
             
     def toggle_blocking(self):
         """Toggle app blocking on/off"""
@@ -559,34 +953,48 @@ class HideawayController:
             if not self.is_blocking:
                 # Block apps
                 self.log(f"🚫 Creating blocking profile for {selected_count} apps...")
-                profile = self.generate_blocking_profile(block_apps=True)
-                result = self.send_profile_to_device(profile)
+                if self.use_ddm.get():
+                    result = self.send_ddm_state(blocking=True)
+                else:
+                    profile = self.generate_blocking_profile(block_apps=True)
+                    result = self.send_profile_to_device(profile)
                 
                 self.is_blocking = True
                 self.control_button.config(text="🟢 UNBLOCK APPS")
                 self.status_label.config(text=f"Status: Blocking {selected_count} apps")
                 self.log(f"✅ Blocking profile created successfully")
                 
-                if result["status"] == "sent_via_nanomdm":
+                if result["status"].startswith("ddm_"):
+                    messagebox.showinfo("Declarations Updated", f"Blocking declared for {selected_count} apps.\n\nYour iPhone applies it on its next sync.")
+                elif result["status"] == "sent_via_nanomdm":
                     messagebox.showinfo("Profile Sent", f"Blocking profile sent to device via nanomdm!\n\nIt should install automatically on your iPhone.")
+                elif result["status"] == "queued":
+                    messagebox.showinfo("Profile Queued", "nanomdm is unavailable - the blocking profile is queued and will be sent once the server is back.")
                 else:
-                    messagebox.showinfo("Profile Created", f"Blocking profile saved to Desktop!\n\nTransfer it to your iPhone and install to block {selected_count} apps.")
+                    messagebox.showinfo("Profile Created", f"Blocking profile saved to:\n{result['filepath']}\n\nTransfer it to your iPhone and install to block {selected_count} apps.")
                 
             else:
                 # Unblock apps (remove profile)
                 self.log("🟢 Creating unblock profile...")
-                profile = self.generate_blocking_profile(block_apps=False)
-                result = self.send_profile_to_device(profile)
+                if self.use_ddm.get():
+                    result = self.send_ddm_state(blocking=False)
+                else:
+                    profile = self.generate_blocking_profile(block_apps=False)
+                    result = self.send_profile_to_device(profile)
                 
                 self.is_blocking = False
                 self.control_button.config(text="🔴 BLOCK APPS")
                 self.status_label.config(text="Status: Apps unblocked")
                 self.log("✅ Unblock profile created successfully")
                 
-                if result["status"] == "sent_via_nanomdm":
+                if result["status"].startswith("ddm_"):
+                    messagebox.showinfo("Declarations Updated", "Unblocking declared.\n\nYour iPhone applies it on its next sync.")
+                elif result["status"] == "sent_via_nanomdm":
                     messagebox.showinfo("Profile Sent", "Unblock profile sent to device via nanomdm!")
+                elif result["status"] == "queued":
+                    messagebox.showinfo("Profile Queued", "nanomdm is unavailable - the unblock profile is queued and will be sent once the server is back.")
                 else:
-                    messagebox.showinfo("Profile Created", "Unblock profile saved to Desktop!\n\nTransfer it to your iPhone and install to remove app restrictions.")
+                    messagebox.showinfo("Profile Created", f"Unblock profile saved to:\n{result['filepath']}\n\nTransfer it to your iPhone and install to remove app restrictions.")
                 
         except Exception as e:
             self.log(f"❌ Error: {str(e)}")
@@ -594,7 +1002,10 @@ class HideawayController:
             
     def run(self):
         """Start the GUI application"""
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.client.close()
 
 class HideawayLauncher:
     """Main launcher interface for Hideaway (nanomdm Compatible)"""
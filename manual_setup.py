@@ -6,88 +6,110 @@ This script manually sets up the required servers for Focus Controller
 """
 
 import os
-import subprocess
-import time
 import uuid
 import plistlib
 
+from server_supervisor import ServerSupervisor
+from readiness import wait_for_scep, wait_for_nanomdm, ServiceNotReady
+import ca_certificate
+from backend_registry import BackendRegistry, DEFAULT_WEBHOOK_BASE
+from challenge_service import ChallengeStore, CSR_VERIFIER, service_command
+
+# Project directory (override with HIDEAWAY_BASE_DIR instead of editing paths)
+BASE_DIR = os.environ.get("HIDEAWAY_BASE_DIR", "/Users/paul/Files/vsc_projekte/app_block")
+
+# Shared supervisor so server output is drained and crashes are restarted
+supervisor = ServerSupervisor(log_dir=f"{BASE_DIR}/logs")
+
+# Where the controller reaches the nanomdm API started here
+NANOMDM_API_URL = "http://127.0.0.1:9000"
+
 def start_scep_server():
     """Start SCEP server manually"""
     print("🚀 Starting SCEP server...")
     
-    scep_binary = "/Users/paul/Files/vsc_projekte/app_block/scep/scepserver"
+    scep_binary = f"{BASE_DIR}/scep/scepserver"
     
     if not os.path.exists(scep_binary):
         print("❌ SCEP server not found. Please run the automatic setup first.")
         return None
         
     try:
+        # One-time challenges are checked (and consumed) by the challenge service
+        supervisor.start("challenges", service_command())
+        
         # Start SCEP server
-        process = subprocess.Popen([
+        process = supervisor.start("scep", [
             scep_binary,
             "-allowrenew", "0",
-            "-challenge", "focuscontroller",
+            "-csrverifierexec", CSR_VERIFIER,
             "-port", "8080"
-        ], cwd="/Users/paul/Files/vsc_projekte/app_block/scep")
+        ], cwd=f"{BASE_DIR}/scep")
         
         print("✅ SCEP server started on port 8080")
-        print("🔑 Challenge password: focuscontroller")
+        print("🔑 Challenges: one-time, issued per enrollment profile")
         return process
         
     except Exception as e:
         print(f"❌ Failed to start SCEP server: {e}")
         return None
 
-def get_ca_certificate():
+def get_ca_certificate(response_data=None):
     """Get CA certificate from SCEP server"""
     print("📜 Getting CA certificate...")
     
-    ca_dir = "/Users/paul/Files/vsc_projekte/app_block/certs"
-    os.makedirs(ca_dir, exist_ok=True)
+    ca_dir = f"{BASE_DIR}/certs"
     
     try:
-        time.sleep(2)  # Wait for SCEP to start
-        
-        # Get CA cert from SCEP server
-        subprocess.run([
-            "curl", "http://127.0.0.1:8080/scep?operation=GetCACert",
-            "-o", f"{ca_dir}/ca.der"
-        ], check=True)
+        # Fetched, converted to PEM and verified in-process
+        ca_path, fingerprint = ca_certificate.get_ca_certificate(
+            "http://127.0.0.1:8080", ca_dir, response_data
+        )
         
-        # Convert to PEM
-        subprocess.run([
-            "openssl", "x509", "-inform", "DER", "-in", f"{ca_dir}/ca.der",
-            "-out", f"{ca_dir}/ca.pem"
-        ], check=True)
-        
-        print(f"✅ CA certificate saved to {ca_dir}/ca.pem")
-        return f"{ca_dir}/ca.pem"
+        print(f"✅ CA certificate saved to {ca_path}")
+        return ca_path
         
     except Exception as e:
         print(f"❌ Failed to get CA certificate: {e}")
         return None
 
-def start_nanomdm_server(ca_path):
+def register_backend():
+    """Name of the local nanomdm in backends.json (added if it isn't listed)
+
+    Its webhook reports acknowledgements, inventories and enrollments under
+    this name.
+    """
+    registry = BackendRegistry.load(default_host=NANOMDM_API_URL)
+    name = registry.find(NANOMDM_API_URL)
+    if name is None:
+        name = "local"
+        registry.add(name, NANOMDM_API_URL)
+        registry.save()
+    registry.close()
+    return name
+
+def start_nanomdm_server(ca_path, backend_name="default"):
     """Start nanomdm server"""
     print("🚀 Starting nanomdm server...")
     
-    nanomdm_binary = "/Users/paul/Files/vsc_projekte/app_block/nanomdm/nanomdm-darwin-arm64"
+    nanomdm_binary = f"{BASE_DIR}/nanomdm/nanomdm-darwin-arm64"
     
     if not os.path.exists(nanomdm_binary):
         print("❌ nanomdm binary not found. Please build it first:")
-        print("  cd /Users/paul/Files/vsc_projekte/app_block/nanomdm")
+        print(f"  cd {BASE_DIR}/nanomdm")
         print("  make my")
         return None
     
     try:
         # Start nanomdm
-        process = subprocess.Popen([
+        process = supervisor.start("nanomdm", [
             nanomdm_binary,
             "-ca", ca_path,
             "-api", "nanomdm",
             "-debug",
+            "-webhook-url", f"{DEFAULT_WEBHOOK_BASE}/{backend_name}",
             "-listen", ":9000"
-        ], cwd="/Users/paul/Files/vsc_projekte/app_block/nanomdm")
+        ], cwd=f"{BASE_DIR}/nanomdm")
         
         print("✅ nanomdm server started on port 9000")
         print("🔑 API key: nanomdm")
@@ -116,7 +138,7 @@ def create_enrollment_profile():
                 "PayloadVersion": 1,
                 
                 "URL": "http://127.0.0.1:8080/scep",
-                "Challenge": "focuscontroller",
+                "Challenge": ChallengeStore().issue("iPhone"),
                 "Subject": [
                     [ ["CN", "Focus Controller Device"] ],
                     [ ["O", "Focus Controller"] ]
@@ -157,7 +179,7 @@ def create_enrollment_profile():
     }
     
     # Save profile
-    profile_path = "/Users/paul/Files/vsc_projekte/app_block/FocusController_Enrollment.mobileconfig"
+    profile_path = f"{BASE_DIR}/FocusController_Enrollment.mobileconfig"
     with open(profile_path, 'wb') as f:
         plistlib.dump(profile, f)
         
@@ -173,20 +195,33 @@ def main():
     if not scep_process:
         return False
     
+    # Wait until SCEP actually serves its CA certificate
+    try:
+        ca_response = wait_for_scep("http://127.0.0.1:8080", server=scep_process)
+    except ServiceNotReady as e:
+        print(f"❌ {e}")
+        supervisor.stop_all()
+        return False
+    
     # Get CA certificate
-    ca_path = get_ca_certificate()
+    ca_path = get_ca_certificate(ca_response)
     if not ca_path:
-        scep_process.terminate()
+        supervisor.stop_all()
         return False
     
-    # Start nanomdm server
-    nanomdm_process = start_nanomdm_server(ca_path)
+    # Start nanomdm server (its webhook feeds the controller's inventory and command tracker)
+    nanomdm_process = start_nanomdm_server(ca_path, register_backend())
     if not nanomdm_process:
-        scep_process.terminate()
+        supervisor.stop_all()
         return False
     
-    # Wait for servers to start
-    time.sleep(3)
+    # Wait until nanomdm is listening
+    try:
+        wait_for_nanomdm(NANOMDM_API_URL, server=nanomdm_process)
+    except ServiceNotReady as e:
+        print(f"❌ {e}")
+        supervisor.stop_all()
+        return False
     
     # Create enrollment profile
     profile_path = create_enrollment_profile()
@@ -207,17 +242,8 @@ def main():
     print("")
     print("Press Ctrl+C to stop servers")
     
-    # Keep servers running
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("\n🛑 Stopping servers...")
-        if scep_process:
-            scep_process.terminate()
-        if nanomdm_process:
-            nanomdm_process.terminate()
-        print("✅ Servers stopped")
+    # Keep servers running (restarted on crash) until Ctrl+C
+    supervisor.wait_forever()
     
     return True
 
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+MDM Commands - Builds raw MDM command plists in-process
+
+Replaces the `python3 tools/cmdr.py InstallProfile ...` subprocess call with
+the equivalent plist construction so commands can be generated in bulk.
+"""
+
+import uuid
+import plistlib
+
+
+def build_command(request_type, command_uuid=None, **fields):
+    """Build a raw MDM command plist
+
+    Returns a (command_uuid, plist_bytes) tuple ready for /v1/enqueue.
+    """
+    if command_uuid is None:
+        command_uuid = str(uuid.uuid4()).upper()
+
+    command = {"RequestType": request_type}
+    command.update(fields)
+
+    plist = {
+        "Command": command,
+        "CommandUUID": command_uuid
+    }
+
+    return command_uuid, plistlib.dumps(plist)
+
+
+def build_install_profile_command(profile_bytes, command_uuid=None):
+    """Build an InstallProfile command for an already serialized profile"""
+    return build_command("InstallProfile", command_uuid, Payload=profile_bytes)
+
+
+def build_installed_application_list_command(identifiers=None, managed_only=False, command_uuid=None):
+    """Build an InstalledApplicationList command (optionally for specific bundle IDs)"""
+    fields = {"ManagedAppsOnly": managed_only}
+    if identifiers:
+        fields["Identifiers"] = list(identifiers)
+    return build_command("InstalledApplicationList", command_uuid, **fields)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+NanoMDM Client - Thin wrapper around the nanomdm HTTP API
+
+Keeps one requests.Session per client so repeated calls reuse connections
+instead of opening a new socket for every enqueue or push.
+"""
+
+import requests
+from requests.auth import HTTPBasicAuth
+
+
+class NanoMDMClient:
+    """Minimal client for the nanomdm /v1 API"""
+
+    def __init__(self, host="http://127.0.0.1:9000", username="nanomdm", password="nanomdm", timeout=10):
+        self.host = host.rstrip("/")
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(username, password)
+
+        # Cleared once the server turns out not to support DELETE /v1/queue
+        self.queue_api = True
+
+    def _ids(self, device_ids):
+        """nanomdm accepts several enrollment IDs comma-separated in the path"""
+        if isinstance(device_ids, str):
+            return device_ids
+        return ",".join(device_ids)
+
+    def push(self, device_ids):
+        """Send an APNs push to one or more devices"""
+        url = f"{self.host}/v1/push/{self._ids(device_ids)}"
+        return self.session.get(url, timeout=self.timeout)
+
+    def enqueue(self, device_ids, command_bytes, no_push=False):
+        """Enqueue a raw command plist for one or more devices"""
+        url = f"{self.host}/v1/enqueue/{self._ids(device_ids)}"
+        params = {"nopush": "1"} if no_push else None
+
+        return self.session.put(
+            url,
+            data=command_bytes,
+            params=params,
+            headers={'Content-Type': 'application/x-plist'},
+            timeout=self.timeout
+        )
+
+    def clear_queue(self, device_ids):
+        """Remove all pending commands for one or more devices"""
+        url = f"{self.host}/v1/queue/{self._ids(device_ids)}"
+        return self.session.delete(url, timeout=self.timeout)
+
+    def upload_push_cert(self, pem_bundle):
+        """Upload an APNs push certificate + key (concatenated PEM)"""
+        return self.session.put(
+            f"{self.host}/v1/pushcert",
+            data=pem_bundle,
+            timeout=self.timeout
+        )
+
+    def close(self):
+        """Close pooled connections"""
+        self.session.close()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+nanomdm Health - Background health probe and circuit breaker
+
+The controller used to find out nanomdm was down by waiting for each send
+to time out. A HealthMonitor now probes nanomdm's /version endpoint in the
+background and caches the result, and a CircuitBreaker opens after
+consecutive failures (from sends or probes). While it is open, sends fail
+immediately with CircuitOpenError so callers can queue durably instead of
+waiting. After `reset_timeout` one trial call is let through (half-open),
+and the first successful probe or call closes the circuit again.
+"""
+
+import time
+import threading
+import requests
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` failures -> half-open after `reset_timeout`"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=3, reset_timeout=15.0, on_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self._state:
+            previous, self._state = self._state, state
+            if self.on_change:
+                self.on_change(previous, state)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            return self._state
+
+    def allow(self):
+        """Whether a call may go through now (claims the half-open trial slot)"""
+        state = self.state
+        with self._lock:
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_running = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def call(self, func, *args, **kwargs):
+        """Run `func` through the breaker; raises CircuitOpenError when open"""
+        if not self.allow():
+            raise CircuitOpenError("nanomdm is unavailable (circuit open)")
+        try:
+            result = func(*args, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.record_failure()
+            raise
+        except Exception:
+            # Not a transport problem - the backend answered
+            self.record_success()
+            raise
+        self.record_success()
+        return result
+
+
+class HealthMonitor:
+    """Probes nanomdm periodically and keeps the last result"""
+
+    def __init__(self, host="http://127.0.0.1:9000", breaker=None, interval=10.0, timeout=2.0, on_change=None):
+        self.url = f"{host.rstrip('/')}/version"
+        self.breaker = breaker or CircuitBreaker()
+        self.interval = interval
+        self.timeout = timeout
+        self.on_change = on_change
+
+        self.session = requests.Session()
+        self.state = {"healthy": None, "checked_at": None, "latency_ms": None, "version": None, "error": None}
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="nanomdm-health", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.interval + self.timeout)
+        self.session.close()
+
+    def check(self):
+        """Probe once, update the cached state and the breaker; returns the state"""
+        started = time.monotonic()
+        try:
+            response = self.session.get(self.url, timeout=self.timeout)
+            healthy = response.status_code < 500
+            error = None if healthy else f"HTTP {response.status_code}"
+            version = response.text.strip()[:100] if healthy else None
+        except requests.RequestException as e:
+            healthy, error, version = False, str(e), None
+
+        state = {
+            "healthy": healthy,
+            "checked_at": time.time(),
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
+            "version": version,
+            "error": error
+        }
+
+        if healthy:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+        with self._lock:
+            changed = state["healthy"] != self.state["healthy"]
+            self.state = state
+
+        if changed and self.on_change:
+            self.on_change(state)
+        return state
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.state)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check()
+            # Probe faster while the backend is down so recovery is noticed quickly
+            interval = self.interval if self.state["healthy"] else min(self.interval, 2.0)
+            self._stop.wait(interval)
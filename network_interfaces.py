@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Network Interfaces - Find the Mac's LAN address without spawning processes
+
+Replaces the 8.8.8.8 UDP trick + `ifconfig` parsing used to pick the address
+baked into enrollment URLs. Interfaces and addresses come straight from
+getifaddrs(3) via ctypes (macOS and Linux), the default-route interface from
+/proc/net/route on Linux or a no-traffic UDP connect elsewhere. Candidates are
+ranked (default route, RFC1918, up/running), the result is cached briefly,
+and a watcher reports address changes (via netlink on Linux, polling
+elsewhere) so enrollment profiles can be regenerated.
+"""
+
+import sys
+import time
+import socket
+import select
+import ctypes
+import ctypes.util
+import ipaddress
+import threading
+
+CACHE_SECONDS = 5.0
+
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+IFF_RUNNING = 0x40
+
+# Virtual interfaces that iPhones on the LAN can't reach
+VIRTUAL_PREFIXES = ("utun", "awdl", "llw", "bridge", "docker", "veth", "vmnet", "anpi", "gif", "stf", "ap")
+
+_cache = {"time": 0.0, "interfaces": None}
+_cache_lock = threading.Lock()
+
+
+class _sockaddr(ctypes.Structure):
+    # BSD sockaddrs start with a length byte; Linux uses a 16-bit family
+    if sys.platform == "darwin" or "bsd" in sys.platform:
+        _fields_ = [("sa_len", ctypes.c_uint8), ("sa_family", ctypes.c_uint8)]
+    else:
+        _fields_ = [("sa_family", ctypes.c_uint16)]
+
+
+class _ifaddrs(ctypes.Structure):
+    pass
+
+
+_ifaddrs._fields_ = [
+    ("ifa_next", ctypes.POINTER(_ifaddrs)),
+    ("ifa_name", ctypes.c_char_p),
+    ("ifa_flags", ctypes.c_uint),
+    ("ifa_addr", ctypes.POINTER(_sockaddr)),
+    ("ifa_netmask", ctypes.POINTER(_sockaddr)),
+    ("ifa_dstaddr", ctypes.POINTER(_sockaddr)),
+    ("ifa_data", ctypes.c_void_p)
+]
+
+
+def _sockaddr_to_ip(pointer):
+    """Decode an AF_INET/AF_INET6 sockaddr pointer (None for other families)"""
+    if not pointer:
+        return None
+
+    family = pointer.contents.sa_family
+    base = ctypes.cast(pointer, ctypes.c_void_p).value
+    if family == socket.AF_INET:
+        return socket.inet_ntop(socket.AF_INET, ctypes.string_at(base + 4, 4))
+    if family == socket.AF_INET6:
+        return socket.inet_ntop(socket.AF_INET6, ctypes.string_at(base + 8, 16))
+    return None
+
+
+def _getifaddrs():
+    """List (name, flags, address, netmask) using getifaddrs(3)"""
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+    head = ctypes.POINTER(_ifaddrs)()
+    if libc.getifaddrs(ctypes.byref(head)) != 0:
+        raise OSError(ctypes.get_errno(), "getifaddrs failed")
+
+    results = []
+    try:
+        node = head
+        while node:
+            entry = node.contents
+            address = _sockaddr_to_ip(entry.ifa_addr)
+            if address:
+                results.append((
+                    entry.ifa_name.decode(errors="replace"),
+                    entry.ifa_flags,
+                    address.split("%")[0],
+                    _sockaddr_to_ip(entry.ifa_netmask)
+                ))
+            node = entry.ifa_next
+    finally:
+        libc.freeifaddrs(head)
+
+    return results
+
+
+def _fallback_addresses():
+    """Portable fallback when getifaddrs isn't available: resolve the hostname"""
+    results = []
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+            results.append(("unknown", IFF_UP | IFF_RUNNING, info[4][0], None))
+    except socket.gaierror:
+        pass
+    return results
+
+
+def default_route_interface():
+    """Name of the interface carrying the IPv4 default route, if known"""
+    try:
+        with open("/proc/net/route", "r") as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[1] == "00000000":
+                    return fields[0]
+    except (OSError, StopIteration):
+        pass
+    return None
+
+
+def default_route_address():
+    """Source address the kernel would use for the default route
+
+    Connecting a UDP socket only consults the routing table - no packet is
+    sent - but it still fails when offline, so the result is just a hint.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("192.0.2.1", 9))  # TEST-NET-1, never actually contacted
+        return s.getsockname()[0]
+    except OSError:
+        return None
+    finally:
+        s.close()
+
+
+def list_interfaces(use_cache=True):
+    """Return [{"name", "address", "netmask", "family", "up", "loopback"}, ...]"""
+    with _cache_lock:
+        if use_cache and _cache["interfaces"] is not None and time.monotonic() - _cache["time"] < CACHE_SECONDS:
+            return _cache["interfaces"]
+
+    try:
+        raw = _getifaddrs()
+    except (OSError, AttributeError, TypeError):
+        raw = _fallback_addresses()
+
+    interfaces = []
+    for name, flags, address, netmask in raw:
+        interfaces.append({
+            "name": name,
+            "address": address,
+            "netmask": netmask,
+            "family": 6 if ":" in address else 4,
+            "up": bool(flags & IFF_UP) and bool(flags & IFF_RUNNING),
+            "loopback": bool(flags & IFF_LOOPBACK) or ipaddress.ip_address(address).is_loopback
+        })
+
+    with _cache_lock:
+        _cache["time"] = time.monotonic()
+        _cache["interfaces"] = interfaces
+    return interfaces
+
+
+def rank_candidates(interfaces=None):
+    """IPv4 LAN candidates, best first
+
+    Prefers the default-route interface, then RFC1918 addresses, then
+    physical-looking interfaces. Loopback, link-local and down interfaces
+    are dropped.
+    """
+    interfaces = list_interfaces() if interfaces is None else interfaces
+    route_interface = default_route_interface()
+    route_address = None if route_interface else default_route_address()
+
+    candidates = []
+    for interface in interfaces:
+        if interface["family"] != 4 or interface["loopback"] or not interface["up"]:
+            continue
+        ip = ipaddress.ip_address(interface["address"])
+        if ip.is_link_local:
+            continue
+
+        on_default_route = (
+            interface["name"] == route_interface or interface["address"] == route_address
+        )
+        score = (
+            (4 if on_default_route else 0)
+            + (2 if ip.is_private else 0)
+            + (0 if interface["name"].startswith(VIRTUAL_PREFIXES) else 1)
+        )
+        candidates.append((score, interface))
+
+    candidates.sort(key=lambda item: -item[0])
+    return [interface for _, interface in candidates]
+
+
+def best_address(default=None):
+    """Best IPv4 address for iPhones on the LAN to reach this machine"""
+    candidates = rank_candidates()
+    return candidates[0]["address"] if candidates else default
+
+
+def _netlink_socket():
+    """Netlink socket notified on IPv4 address/link changes (Linux only)"""
+    if not hasattr(socket, "AF_NETLINK"):
+        return None
+    try:
+        s = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        s.bind((0, 0x1 | 0x10))  # RTMGRP_LINK | RTMGRP_IPV4_IFADDR
+        return s
+    except OSError:
+        return None
+
+
+class InterfaceWatcher:
+    """Calls `on_change(old, new)` when the best LAN address changes"""
+
+    def __init__(self, on_change, interval=5.0):
+        self.on_change = on_change
+        self.interval = interval
+        self.current = best_address()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="interface-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.interval + 1)
+
+    def _check(self):
+        address = best_address()
+        if address != self.current:
+            previous, self.current = self.current, address
+            try:
+                self.on_change(previous, address)
+            except Exception as e:
+                print(f"⚠️  Address change handler failed: {e}")
+
+    def _run(self):
+        netlink = _netlink_socket()
+        try:
+            while not self._stop.is_set():
+                if netlink is not None:
+                    # Wake up on kernel notifications; the timeout only bounds stop()
+                    readable, _, _ = select.select([netlink], [], [], self.interval)
+                    if not readable:
+                        continue
+                    while True:
+                        try:
+                            netlink.recv(65536, socket.MSG_DONTWAIT)
+                        except BlockingIOError:
+                            break
+                    # Let a burst of address/link messages settle
+                    time.sleep(0.2)
+                else:
+                    if self._stop.wait(self.interval):
+                        break
+
+                with _cache_lock:
+                    _cache["interfaces"] = None
+                self._check()
+        finally:
+            if netlink is not None:
+                netlink.close()
+
+
+def main():
+    route_interface = default_route_interface()
+    for interface in list_interfaces(use_cache=False):
+        flags = []
+        if interface["up"]:
+            flags.append("up")
+        if interface["loopback"]:
+            flags.append("loopback")
+        if interface["name"] == route_interface:
+            flags.append("default route")
+        print(f"  {interface['name']:<10} {interface['address']:<40} {', '.join(flags)}")
+
+    address = best_address()
+    if address:
+        print(f"✅ Best LAN address: {address}")
+    else:
+        print("❌ No usable LAN address found")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Payload Packer - Split large list payloads under a byte budget
+
+Blocking profiles used to put every bundle ID and domain into one payload,
+with no bound on its size. The packer estimates what each entry adds to the
+serialized plist and spreads long lists over several copies of a payload,
+each under `budget` bytes.
+
+Splits are stable. Entries are sorted, and a chunk ends after any entry
+whose hash hits a boundary value (content-defined chunking), so boundaries
+depend on the entries themselves, not on their position. Adding or removing
+one entry changes only the chunk it falls into. The other chunks keep the
+same content, identifier and UUID, and serialize to the same bytes. When a
+chunk would exceed the budget it is cut early; the next content boundary
+realigns the chunks after it.
+
+Only lists whose payloads combine by union may be split, such as
+blacklistedAppBundleIDs. Allowlists intersect and several built-in web
+content filters have no documented union semantics, so callers keep those
+payloads whole.
+"""
+
+import copy
+import uuid
+import zlib
+import hashlib
+import plistlib
+
+DEFAULT_PAYLOAD_BUDGET = 64 * 1024
+# Namespace for deterministic payload UUIDs
+_PAYLOAD_NAMESPACE = uuid.UUID("6f1c1bd2-6a4e-4c1e-9a83-3f5e0d2b7c10")
+
+_EMPTY_LIST = len(plistlib.dumps([]))
+
+
+def entry_size(entry, depth=1):
+    """Bytes an entry adds to a serialized plist array nested `depth` levels deep"""
+    # One tab of indentation per level beyond the top-level array
+    return len(plistlib.dumps([entry])) - _EMPTY_LIST + depth - 1
+
+
+def payload_size(payload):
+    return len(plistlib.dumps(payload))
+
+
+def _get(payload, key):
+    keys = (key,) if isinstance(key, str) else key
+    value = payload
+    for part in keys:
+        value = value[part]
+    return value
+
+
+def _set(payload, key, value):
+    keys = (key,) if isinstance(key, str) else key
+    target = payload
+    for part in keys[:-1]:
+        target = target[part]
+    target[keys[-1]] = value
+
+
+def stable_chunks(entries, budget, average_entries=None, depth=1):
+    """Split `entries` into sorted chunks of at most `budget` bytes each
+
+    `average_entries` sets how often content boundaries occur; it defaults
+    to half of what fits in the budget so most chunks end on a boundary
+    rather than being cut by size.
+    """
+    entries = sorted(set(entries))
+    if not entries:
+        return []
+
+    sizes = [entry_size(entry, depth) for entry in entries]
+    if average_entries is None:
+        average = sum(sizes) / len(sizes)
+        average_entries = max(1, int(budget / average) // 2)
+
+    chunks, current, current_size = [], [], 0
+    for entry, size in zip(entries, sizes):
+        if current and current_size + size > budget:
+            chunks.append(current)
+            current, current_size = [], 0
+        current.append(entry)
+        current_size += size
+        if zlib.crc32(entry.encode()) % average_entries == 0:
+            chunks.append(current)
+            current, current_size = [], 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_payload(payload, key, budget=DEFAULT_PAYLOAD_BUDGET):
+    """Copies of `payload` with the list at `key` split to fit `budget`
+
+    `key` is a payload key or a tuple path to a nested list. Returns
+    [payload] unchanged when it already fits. Otherwise each part gets a
+    PayloadIdentifier suffix and a PayloadUUID derived from its content,
+    so unchanged parts are identical between runs.
+    """
+    entries = _get(payload, key)
+    if payload_size(payload) <= budget or len(entries) < 2:
+        return [payload]
+
+    empty = copy.deepcopy(payload)
+    _set(empty, key, [])
+    room = budget - payload_size(empty) - len("-part-0000000000")
+    if room <= 0:
+        raise ValueError(f"Budget of {budget} bytes is smaller than the empty payload")
+
+    parts = []
+    depth = 2 if isinstance(key, str) else len(key) + 1
+    for chunk in stable_chunks(entries, room, depth=depth):
+        part = copy.deepcopy(empty)
+        _set(part, key, chunk)
+        digest = hashlib.sha256("\n".join(chunk).encode()).hexdigest()
+        # Named after its first entry so the identifier survives changes elsewhere
+        anchor = format(zlib.crc32(chunk[0].encode()), "010d")
+        part["PayloadIdentifier"] = f"{payload['PayloadIdentifier']}-part-{anchor}"
+        part["PayloadUUID"] = str(uuid.uuid5(_PAYLOAD_NAMESPACE, f"{part['PayloadIdentifier']}:{digest}")).upper()
+        parts.append(part)
+    return parts
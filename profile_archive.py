@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Profile Archive - Content-addressed store for generated profiles
+
+Replaces the timestamped .mobileconfig files that used to pile up on the
+Desktop. Profiles are written atomically (temp file + rename) under their
+SHA-256 hash, so identical profiles are stored once. A small append-only
+index maps device/timestamp to content hash and a retention policy keeps
+disk usage bounded.
+
+Several processes (the controller, push_queue enqueues and workers) share
+one archive. Appends and compaction hold an fcntl lock on index.lock, and
+compaction re-reads the on-disk index first, so entries written by other
+processes are kept and their objects are never collected.
+
+Layout:
+    <root>/objects/<ab>/<sha256>.mobileconfig
+    <root>/index.jsonl
+    <root>/index.lock
+"""
+
+import os
+import json
+import time
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_ARCHIVE_DIR = os.path.join(HOME_DIR, "hideaway_setup", "profiles")
+
+
+def _atomic_write(path, data):
+    """Write bytes to path via a temp file and rename"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ProfileArchive:
+    """Atomic, content-addressed profile archive with an index and retention"""
+
+    def __init__(self, root=DEFAULT_ARCHIVE_DIR, keep_per_device=20, max_age_days=30):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.index_path = os.path.join(root, "index.jsonl")
+        self.lock_path = os.path.join(root, "index.lock")
+        self.keep_per_device = keep_per_device
+        self.max_age_days = max_age_days
+
+        self._lock = threading.Lock()
+        self._entries = {}  # device_id -> list of entries, oldest first
+        self._appends_since_compaction = 0
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._entries = self._read_index()
+
+    def _read_index(self):
+        """Entries per device from index.jsonl, oldest first"""
+        entries = {}
+        if not os.path.exists(self.index_path):
+            return entries
+
+        with open(self.index_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash is simply dropped
+                    continue
+                entries.setdefault(entry["device_id"], []).append(entry)
+        return entries
+
+    @contextmanager
+    def _index_locked(self):
+        """Exclusive lock on the index across processes"""
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def path_for(self, profile_hash):
+        """Return the on-disk path of a stored profile"""
+        return os.path.join(self.objects_dir, profile_hash[:2], f"{profile_hash}.mobileconfig")
+
+    def put(self, profile_bytes):
+        """Store profile bytes (once per content) and return the content hash"""
+        profile_hash = hashlib.sha256(profile_bytes).hexdigest()
+        path = self.path_for(profile_hash)
+
+        try:
+            # Refresh the mtime so a concurrent compaction's grace period
+            # covers the object until the caller has indexed it
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _atomic_write(path, profile_bytes)
+
+        return profile_hash
+
+    def get(self, profile_hash):
+        """Read stored profile bytes by content hash"""
+        with open(self.path_for(profile_hash), 'rb') as f:
+            return f.read()
+
+    def store(self, device_id, profile_bytes, label=""):
+        """Store a profile for a device and record it in the index"""
+        profile_hash = self.put(profile_bytes)
+        entry = {
+            "device_id": device_id,
+            "timestamp": time.time(),
+            "hash": profile_hash,
+            "label": label
+        }
+
+        with self._lock, self._index_locked():
+            # Under the lock, so a concurrent compaction can't replace the file mid-append
+            with open(self.index_path, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+            self._entries.setdefault(device_id, []).append(entry)
+            self._appends_since_compaction += 1
+
+            # Compact occasionally so the index never grows unbounded
+            if self._appends_since_compaction >= max(100, self.keep_per_device * 5):
+                self._compact_locked()
+
+        return dict(entry, path=self.path_for(profile_hash))
+
+    def devices(self):
+        """Return the IDs of all devices with archived profiles"""
+        return list(self._entries)
+
+    def latest(self, device_id):
+        """Return the most recent index entry for a device, or None"""
+        entries = self._entries.get(device_id)
+        return entries[-1] if entries else None
+
+    def history(self, device_id):
+        """Return all retained index entries for a device, newest first"""
+        return list(reversed(self._entries.get(device_id, [])))
+
+    def apply_retention(self):
+        """Drop old index entries and delete objects nothing refers to"""
+        with self._lock, self._index_locked():
+            return self._compact_locked()
+
+    def _compact_locked(self):
+        """Retention + rewrite; the caller holds both the thread and the index lock"""
+        # Start from the on-disk index: other processes may have appended to it
+        self._entries = self._read_index()
+        cutoff = time.time() - self.max_age_days * 86400 if self.max_age_days else None
+
+        for device_id, entries in list(self._entries.items()):
+            kept = entries[-self.keep_per_device:] if self.keep_per_device else entries
+            if cutoff is not None:
+                # Always keep the latest entry so a device's current state survives
+                kept = [e for e in kept[:-1] if e["timestamp"] >= cutoff] + kept[-1:]
+            self._entries[device_id] = kept
+
+        # Rewrite the compacted index atomically
+        lines = "".join(
+            json.dumps(entry) + "\n"
+            for entries in self._entries.values()
+            for entry in entries
+        )
+        _atomic_write(self.index_path, lines.encode())
+        self._appends_since_compaction = 0
+
+        # Remove objects no longer referenced by any entry. Recent objects are
+        # left alone because another process may be about to index them.
+        referenced = {e["hash"] for entries in self._entries.values() for e in entries}
+        grace_cutoff = time.time() - 3600
+        removed = 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(prefix_dir, name)
+                if name.split('.')[0] not in referenced and os.path.getmtime(path) < grace_cutoff:
+                    os.unlink(path)
+                    removed += 1
+
+        return removed
+
+    def disk_usage(self):
+        """Return the total size of stored objects in bytes"""
+        total = 0
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for name in filenames:
+                total += os.path.getsize(os.path.join(dirpath, name))
+        return total
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect the Hideaway profile archive")
+    parser.add_argument('--root', default=DEFAULT_ARCHIVE_DIR)
+    parser.add_argument('--device', help='Show history for one device')
+    parser.add_argument('--gc', action='store_true', help='Apply the retention policy now')
+    args = parser.parse_args()
+
+    archive = ProfileArchive(args.root)
+
+    if args.gc:
+        removed = archive.apply_retention()
+        print(f"🧹 Removed {removed} unreferenced profile(s)")
+
+    if args.device:
+        for entry in archive.history(args.device):
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry["timestamp"]))
+            print(f"  {when}  {entry['hash'][:12]}  {entry.get('label', '')}")
+    else:
+        print(f"📁 {args.root}: {len(archive.devices())} device(s), {archive.disk_usage() / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Profile Signer - Signs configuration profiles in-process (CMS/PKCS#7)
+
+The signing identity is loaded once and kept in memory, so signing a profile
+is a single in-process operation rather than an `openssl smime` subprocess.
+Signed output is cached by content hash, both in memory and on disk.
+
+The controller signs every profile it sends or archives when a signing
+identity is configured through HIDEAWAY_SIGNING_CERT and HIDEAWAY_SIGNING_KEY
+(plus HIDEAWAY_SIGNING_KEY_PASSWORD and HIDEAWAY_SIGNING_CHAIN, a list of
+intermediate certificates separated by os.pathsep).
+
+Requires the `cryptography` package (pip3 install cryptography).
+"""
+
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.serialization import pkcs7
+except ImportError:
+    x509 = None
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_CACHE_DIR = os.path.join(HOME_DIR, "hideaway_setup", "signed")
+CERT_ENV = "HIDEAWAY_SIGNING_CERT"
+KEY_ENV = "HIDEAWAY_SIGNING_KEY"
+KEY_PASSWORD_ENV = "HIDEAWAY_SIGNING_KEY_PASSWORD"
+CHAIN_ENV = "HIDEAWAY_SIGNING_CHAIN"
+
+
+def _load_certificates(data):
+    """Load one or more certificates from PEM or DER bytes"""
+    if b"-----BEGIN" in data:
+        return x509.load_pem_x509_certificates(data)
+    return [x509.load_der_x509_certificate(data)]
+
+
+class ProfileSigner:
+    """Signs serialized profiles with a cached signing identity"""
+
+    def __init__(self, cert_path, key_path, key_password=None, chain_paths=(), cache_dir=DEFAULT_CACHE_DIR, memory_cache_size=1024):
+        if x509 is None:
+            raise RuntimeError("Profile signing requires the 'cryptography' package: pip3 install cryptography")
+
+        with open(cert_path, 'rb') as f:
+            self.certificate = _load_certificates(f.read())[0]
+
+        with open(key_path, 'rb') as f:
+            key_data = f.read()
+        password = key_password.encode() if isinstance(key_password, str) else key_password
+        if b"-----BEGIN" in key_data:
+            self.private_key = serialization.load_pem_private_key(key_data, password=password)
+        else:
+            self.private_key = serialization.load_der_private_key(key_data, password=password)
+
+        # Intermediate certificates are embedded so devices can build the chain
+        self.chain = []
+        for path in chain_paths:
+            with open(path, 'rb') as f:
+                self.chain.extend(_load_certificates(f.read()))
+
+        # Part of every cache key, so switching identities never serves stale output
+        self.fingerprint = self.certificate.fingerprint(hashes.SHA256()).hex()
+
+        self.cache_dir = cache_dir
+        self.memory_cache_size = memory_cache_size
+        self._memory_cache = {}
+        # sign_many calls sign() from several threads
+        self._lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_key(self, profile_bytes):
+        digest = hashlib.sha256(profile_bytes)
+        digest.update(self.fingerprint.encode())
+        return digest.hexdigest()
+
+    def _sign_uncached(self, profile_bytes):
+        builder = pkcs7.PKCS7SignatureBuilder().set_data(profile_bytes)
+        builder = builder.add_signer(self.certificate, self.private_key, hashes.SHA256())
+        for certificate in self.chain:
+            builder = builder.add_certificate(certificate)
+
+        # Profiles must carry their content, so no DetachedSignature option
+        return builder.sign(serialization.Encoding.DER, [pkcs7.PKCS7Options.Binary])
+
+    def sign(self, profile_bytes):
+        """Return the signed (DER-encoded CMS) form of a serialized profile"""
+        key = self._cache_key(profile_bytes)
+
+        with self._lock:
+            signed = self._memory_cache.get(key)
+        if signed is not None:
+            return signed
+
+        cache_path = os.path.join(self.cache_dir, f"{key}.mobileconfig") if self.cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                signed = f.read()
+        else:
+            signed = self._sign_uncached(profile_bytes)
+            if cache_path:
+                tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(signed)
+                os.replace(tmp_path, cache_path)
+
+        with self._lock:
+            if key not in self._memory_cache and len(self._memory_cache) >= self.memory_cache_size:
+                # Drop the oldest entry (dicts keep insertion order)
+                self._memory_cache.pop(next(iter(self._memory_cache)))
+            self._memory_cache[key] = signed
+
+        return signed
+
+    def sign_many(self, profiles, threads=None):
+        """Sign several serialized profiles, optionally on a thread pool
+
+        Returns the signed profiles in the same order as `profiles`.
+        """
+        profiles = list(profiles)
+        if not threads or threads == 1 or len(profiles) < 2:
+            return [self.sign(profile_bytes) for profile_bytes in profiles]
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return list(executor.map(self.sign, profiles))
+
+
+def signer_from_env():
+    """ProfileSigner for the identity configured in the environment, or None
+
+    Raises RuntimeError without the `cryptography` package and OSError or
+    ValueError if the certificate or key can't be loaded.
+    """
+    cert_path = os.environ.get(CERT_ENV)
+    key_path = os.environ.get(KEY_ENV)
+    if not cert_path or not key_path:
+        return None
+    chain = [path for path in os.environ.get(CHAIN_ENV, "").split(os.pathsep) if path]
+    return ProfileSigner(cert_path, key_path, os.environ.get(KEY_PASSWORD_ENV), chain_paths=chain)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sign .mobileconfig profiles")
+    parser.add_argument('profiles', nargs='+', help='Profile files to sign')
+    parser.add_argument('--cert', required=True, help='Signing certificate (PEM or DER)')
+    parser.add_argument('--key', required=True, help='Signing private key (PEM or DER)')
+    parser.add_argument('--chain', action='append', default=[], help='Intermediate certificate(s)')
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    signer = ProfileSigner(args.cert, args.key, chain_paths=args.chain)
+
+    contents = []
+    for path in args.profiles:
+        with open(path, 'rb') as f:
+            contents.append(f.read())
+
+    for path, signed in zip(args.profiles, signer.sign_many(contents, args.threads)):
+        output_path = path.replace('.mobileconfig', '') + '.signed.mobileconfig'
+        with open(output_path, 'wb') as f:
+            f.write(signed)
+        print(f"✅ Signed profile: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
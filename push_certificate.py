@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Push Certificate - Validate, upload and cache the APNs MDM push certificate
+
+Replaces the `cat push.pem push.key | curl -T - .../v1/pushcert` instructions.
+The PEM pair is validated in-process (parses, key matches certificate, not
+expired, MDM topic present), the topic is read from the certificate subject's
+UID attribute, and the pair is uploaded over the client's pooled session. The
+topic is cached so enrollment and profile generation can read it without
+touching the certificate again.
+
+Usage:
+    python3 push_certificate.py push.pem push.key [--url http://127.0.0.1:9000]
+"""
+
+import os
+import json
+import time
+import hashlib
+import datetime
+
+from nanomdm_client import NanoMDMClient
+
+try:
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import serialization
+except ImportError:
+    x509 = None
+
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_CACHE_PATH = os.path.join(HOME_DIR, "hideaway_setup", "push_topic.json")
+PLACEHOLDER_TOPIC = "com.apple.mgmt.External.placeholder"
+
+
+class PushCertificateError(Exception):
+    """Raised when the push certificate pair is invalid or can't be uploaded"""
+
+
+def _read_pem(path, marker):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if marker not in data:
+        raise PushCertificateError(f"{path} does not contain a PEM {marker.decode().strip('- ')}")
+    return data
+
+
+def inspect_push_pair(cert_pem, key_pem):
+    """Validate a PEM certificate/key pair and return (topic, not_after)"""
+    if x509 is None:
+        raise PushCertificateError("Cannot validate the push certificate - install the 'cryptography' package")
+
+    try:
+        certificate = x509.load_pem_x509_certificate(cert_pem)
+    except ValueError as e:
+        raise PushCertificateError(f"Invalid push certificate: {e}")
+
+    try:
+        key = serialization.load_pem_private_key(key_pem, password=None)
+    except (ValueError, TypeError) as e:
+        raise PushCertificateError(f"Invalid push key (must be unencrypted PEM): {e}")
+
+    public_format = (serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    if key.public_key().public_bytes(*public_format) != certificate.public_key().public_bytes(*public_format):
+        raise PushCertificateError("Push key does not match the push certificate")
+
+    not_after = certificate.not_valid_after_utc
+    if not_after < datetime.datetime.now(datetime.timezone.utc):
+        raise PushCertificateError(f"Push certificate expired on {not_after:%Y-%m-%d} - renew it at identity.apple.com")
+
+    uid = certificate.subject.get_attributes_for_oid(NameOID.USER_ID)
+    return (uid[0].value if uid else None), not_after.timestamp()
+
+
+def load_push_pair(cert_path, key_path):
+    """Read and validate a push certificate pair
+
+    Returns (pem_bundle, topic, not_after) where pem_bundle is the
+    certificate followed by the key, as nanomdm's /v1/pushcert expects.
+    """
+    cert_pem = _read_pem(cert_path, b"-----BEGIN CERTIFICATE-----")
+    key_pem = _read_pem(key_path, b"PRIVATE KEY-----")
+
+    topic, not_after = inspect_push_pair(cert_pem, key_pem)
+    if not topic or not topic.startswith("com.apple.mgmt."):
+        raise PushCertificateError(
+            f"{cert_path} is not an MDM push certificate (subject UID: {topic or 'missing'})"
+        )
+
+    return cert_pem.rstrip(b"\n") + b"\n" + key_pem, topic, not_after
+
+
+def cache_topic(topic, not_after=None, fingerprint=None, cache_path=DEFAULT_CACHE_PATH):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            "topic": topic,
+            "not_after": not_after,
+            "fingerprint": fingerprint,
+            "cached_at": time.time()
+        }, f, indent=2)
+    os.replace(tmp_path, cache_path)
+
+
+def cached_topic(default=None, cache_path=DEFAULT_CACHE_PATH):
+    """Topic from the last validated push certificate, or `default`"""
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f).get("topic") or default
+    except (OSError, ValueError):
+        return default
+
+
+def read_push_topic(cert_path, key_path, cache_path=DEFAULT_CACHE_PATH):
+    """Validate the pair and cache its topic without uploading; returns the topic"""
+    bundle, topic, not_after = load_push_pair(cert_path, key_path)
+    cache_topic(topic, not_after, hashlib.sha256(bundle).hexdigest(), cache_path)
+    return topic
+
+
+def upload_push_certificate(cert_path, key_path, client=None, cache_path=DEFAULT_CACHE_PATH):
+    """Validate the pair, upload it to nanomdm and cache the topic
+
+    Returns the topic.
+    """
+    bundle, topic, not_after = load_push_pair(cert_path, key_path)
+
+    owns_client = client is None
+    client = client or NanoMDMClient()
+    try:
+        response = client.upload_push_cert(bundle)
+    except Exception as e:
+        raise PushCertificateError(f"Push certificate upload failed: {e}")
+    finally:
+        if owns_client:
+            client.close()
+
+    if response.status_code != 200:
+        raise PushCertificateError(
+            f"Push certificate upload failed: HTTP {response.status_code} {response.text.strip()}"
+        )
+
+    # Trust the server's view of the topic when it reports one
+    try:
+        topic = response.json().get("topic") or topic
+    except ValueError:
+        pass
+
+    cache_topic(topic, not_after, hashlib.sha256(bundle).hexdigest(), cache_path)
+    return topic
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Upload the APNs MDM push certificate to nanomdm")
+    parser.add_argument('cert', help='Push certificate (PEM)')
+    parser.add_argument('key', help='Unencrypted push key (PEM)')
+    parser.add_argument('--url', default='http://127.0.0.1:9000')
+    parser.add_argument('--api-key', default='nanomdm')
+    parser.add_argument('--check', action='store_true', help='Only validate and cache the topic')
+    args = parser.parse_args()
+
+    try:
+        if args.check:
+            topic = read_push_topic(args.cert, args.key)
+            print(f"✅ Push certificate is valid, topic: {topic}")
+        else:
+            client = NanoMDMClient(args.url, password=args.api_key)
+            topic = upload_push_certificate(args.cert, args.key, client)
+            client.close()
+            print(f"✅ Push certificate uploaded, topic: {topic}")
+    except (OSError, PushCertificateError) as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
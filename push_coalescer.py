@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Push Coalescer - Batches APNs wake-up pushes for nanomdm
+
+Instead of pushing once per enqueued command, callers ask the coalescer to
+wake a device. Requests are collected over a short window (50 ms by default),
+deduplicated, and sent as one multi-ID /v1/push request per window.
+
+A failed push is retried with exponential backoff (`retries` times,
+starting at `retry_delay` seconds); only when every attempt failed is the
+batch passed to `on_error`. The commands themselves are already queued in
+nanomdm, so a device that never gets the push still receives them at its
+next check-in.
+"""
+
+import threading
+import time
+
+from backend_registry import device_results
+
+
+class PushCoalescer:
+    """Collects device IDs and pushes them in deduplicated batches"""
+
+    def __init__(self, client, window=0.05, max_batch=200, on_error=None, retries=3, retry_delay=2.0):
+        self.client = client
+        self.window = window
+        # Enrollment IDs go into the URL path, so keep each request reasonably short
+        self.max_batch = max_batch
+        self.on_error = on_error
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._timers = {}  # retry timer -> (batch, attempt)
+
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+
+        self.requested = 0
+        self.pushed = 0
+        self.requests_sent = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, device_ids):
+        """Ask for one or more devices to be woken up in the next window"""
+        if isinstance(device_ids, str):
+            device_ids = [device_ids]
+
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("PushCoalescer is closed")
+            self._pending.update(device_ids)
+            self.requested += len(device_ids)
+
+        self._wakeup.set()
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        return sorted(pending)
+
+    def _send(self, device_ids, attempt=0, final=False):
+        for start in range(0, len(device_ids), self.max_batch):
+            batch = device_ids[start:start + self.max_batch]
+            try:
+                response = self.client.push(batch)
+                self.requests_sent += 1
+                if response.status_code != 200:
+                    # With several backends only the devices on failed ones are retried
+                    results = device_results(response, batch)
+                    failed = [device_id for device_id in batch if results.get(device_id) != 200]
+                    self.pushed += len(batch) - len(failed)
+                    self._failed(failed, attempt, Exception(f"HTTP {response.status_code}: {response.text}"), final)
+                    continue
+                self.pushed += len(batch)
+            except Exception as e:
+                self._failed(batch, attempt, e, final)
+
+    def _failed(self, batch, attempt, error, final):
+        with self._lock:
+            if not final and not self._stopped and attempt < self.retries:
+                timer = threading.Timer(self.retry_delay * (2 ** attempt), self._retry, (batch, attempt + 1))
+                timer.daemon = True
+                self._timers[timer] = (batch, attempt + 1)
+                timer.start()
+                return
+        self.failed += len(batch)
+        if self.on_error:
+            self.on_error(batch, error)
+
+    def _retry(self, batch, attempt):
+        with self._lock:
+            for timer, (pending_batch, _) in list(self._timers.items()):
+                if pending_batch is batch:
+                    del self._timers[timer]
+        self._send(batch, attempt)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            if self._stopped:
+                break
+
+            # Let the window fill up before sending
+            time.sleep(self.window)
+            self._wakeup.clear()
+
+            device_ids = self._take_pending()
+            if device_ids:
+                self._send(device_ids)
+
+        # Drain anything requested before close()
+        device_ids = self._take_pending()
+        if device_ids:
+            self._send(device_ids)
+
+    def flush(self):
+        """Send everything pending right now, without waiting for the window"""
+        device_ids = self._take_pending()
+        if device_ids:
+            self._send(device_ids)
+
+    def close(self):
+        """Stop the background thread after sending any pending pushes
+
+        Scheduled retries are sent one last time right away.
+        """
+        with self._lock:
+            self._stopped = True
+            retries, self._timers = list(self._timers.items()), {}
+        self._wakeup.set()
+        self._thread.join()
+
+        for timer, (batch, attempt) in retries:
+            timer.cancel()
+            self._send(batch, attempt, final=True)
+
+    def stats(self):
+        """Return how many pushes were requested versus actually sent"""
+        return {
+            "requested": self.requested,
+            "pushed": self.pushed,
+            "requests_sent": self.requests_sent,
+            "failed": self.failed
+        }
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+Push Queue - Durable, sharded work queue for pushing profiles to many devices
+
+Jobs (device ID + profile hash) are stored in a local SQLite database and
+consumed by several worker processes. Each worker leases jobs from its own
+shards, retries failures with backoff and moves jobs that keep failing to a
+dead-letter state. No external broker is needed, so push throughput scales
+across the cores of a single Mac.
+
+Jobs may name a target (the command tracker's slot, e.g. the blocking
+profile). A newer job for the same device and target supersedes older ones
+that haven't been delivered, and cancel() does the same for a profile sent
+directly, so a stale BLOCK never lands after a newer UNBLOCK.
+
+Usage:
+    python3 push_queue.py enqueue <device_id> <profile.mobileconfig> [--target T]
+    python3 push_queue.py worker --processes 4
+    python3 push_queue.py stats
+"""
+
+import os
+import sys
+import time
+import zlib
+import socket
+import functools
+import sqlite3
+import multiprocessing
+
+from mdm_commands import build_install_profile_command
+from nanomdm_client import NanoMDMClient
+from backend_registry import ShardedClient, device_results
+from nanomdm_health import CircuitOpenError
+from rate_limiter import RateLimiter, RateLimitedClient
+from push_certificate import cached_topic
+from push_coalescer import PushCoalescer
+from command_tracker import CommandTracker, send_tracked
+from profile_archive import ProfileArchive, DEFAULT_ARCHIVE_DIR
+
+# Queue state lives next to the rest of the setup files
+HOME_DIR = os.path.expanduser("~")
+STATE_DIR = os.path.join(HOME_DIR, "hideaway_setup")
+DEFAULT_QUEUE_PATH = os.path.join(STATE_DIR, "push_queue.db")
+DEFAULT_PROFILE_DIR = DEFAULT_ARCHIVE_DIR
+# Command tracker target for profiles sent by the workers
+QUEUED_PROFILE_TARGET = "com.hideaway.push-queue"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT NOT NULL,
+    profile_hash TEXT NOT NULL,
+    target TEXT,
+    shard INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (shard, state, available_at, id);
+CREATE INDEX IF NOT EXISTS jobs_device ON jobs (device_id, state);
+CREATE INDEX IF NOT EXISTS jobs_open ON jobs (shard, state, device_id, id);
+"""
+
+# States a job can still be delivered from
+OPEN_STATES = "('pending', 'leased', 'dead')"
+
+
+@functools.lru_cache(maxsize=None)
+def _archive(profile_dir):
+    """One ProfileArchive per directory, so its index is only loaded once"""
+    return ProfileArchive(profile_dir)
+
+
+def store_profile(device_id, profile_bytes, profile_dir=DEFAULT_PROFILE_DIR):
+    """Archive a profile for a device and return its content hash for enqueueing"""
+    return _archive(profile_dir).store(device_id, profile_bytes, label="queued")["hash"]
+
+
+class PushQueue:
+    """SQLite-backed job queue with leasing, retries and dead-lettering"""
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, shards=8, lease_seconds=60, max_attempts=5, retry_delay=2.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # Autocommit mode - transactions are opened explicitly where needed
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+        if "target" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN target TEXT")
+
+        # The shard count is fixed once the queue exists, otherwise devices
+        # would move between workers and lose their ordering guarantee
+        self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('shards', ?)", (str(shards),))
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'shards'").fetchone()
+        self.shards = int(row[0])
+
+    def shard_for(self, device_id):
+        """Map a device to a shard so all of its jobs go to the same worker"""
+        return zlib.crc32(device_id.encode()) % self.shards
+
+    def enqueue(self, device_id, profile_hash, target=None):
+        """Add a single push job and return its id
+
+        With a `target`, older undelivered jobs for the same device and
+        target are superseded by this one.
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if target is not None:
+                self._supersede(device_id, target)
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (device_id, profile_hash, target, shard, available_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (device_id, profile_hash, target, self.shard_for(device_id), now, now)
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return cursor.lastrowid
+
+    def _supersede(self, device_id, target):
+        # A leased job is already being sent; later jobs wait for it (see lease)
+        return self.conn.execute(
+            "UPDATE jobs SET state = 'superseded' WHERE device_id = ? AND target = ? AND state IN ('pending', 'dead')",
+            (device_id, target)
+        ).rowcount
+
+    def cancel(self, device_id, target):
+        """Supersede undelivered jobs for a device and target (e.g. before sending
+        a newer profile for the same slot directly); returns how many"""
+        return self._supersede(device_id, target)
+
+    def enqueue_many(self, jobs):
+        """Add many (device_id, profile_hash) jobs in one transaction"""
+        now = time.time()
+        rows = [
+            (device_id, profile_hash, self.shard_for(device_id), now, now)
+            for device_id, profile_hash in jobs
+        ]
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "INSERT INTO jobs (device_id, profile_hash, shard, available_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        return len(rows)
+
+    def lease(self, owner, shards, limit=100):
+        """Lease up to `limit` ready jobs from the given shards
+
+        Only each device's oldest job that isn't done is considered. While
+        that job is leased, waiting out its retry backoff or dead, the
+        device gets nothing, so a newer UNBLOCK can never overtake an older
+        BLOCK and the device always ends in the state sent last.
+        """
+        now = time.time()
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute(
+                f"""
+                SELECT jobs.id, jobs.device_id, jobs.profile_hash, jobs.target, jobs.attempts FROM jobs
+                JOIN ({self._heads(shards)}) ON jobs.id = head
+                WHERE (jobs.state = 'pending' AND jobs.available_at <= ?)
+                   OR (jobs.state = 'leased' AND jobs.lease_expires < ?)
+                ORDER BY jobs.id
+                LIMIT ?
+                """,
+                (*shards, now, now, limit)
+            ).fetchall()
+
+            jobs = [
+                {"id": job_id, "device_id": device_id, "profile_hash": profile_hash, "target": target,
+                 "attempts": attempts}
+                for job_id, device_id, profile_hash, target, attempts in rows
+            ]
+
+            self.conn.executemany(
+                "UPDATE jobs SET state = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                [(owner, now + self.lease_seconds, job["id"]) for job in jobs]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        return jobs
+
+    def _heads(self, shards):
+        """Subquery for each device's oldest undelivered job (binds `shards`)"""
+        placeholders = ",".join("?" for _ in shards)
+        return (
+            f"SELECT MIN(id) AS head FROM jobs WHERE shard IN ({placeholders}) "
+            f"AND state IN {OPEN_STATES} GROUP BY device_id"
+        )
+
+    def next_ready(self, shards):
+        """When the next job in `shards` can be leased, or None if none ever can
+
+        Devices whose oldest job is dead stay blocked until it is requeued.
+        """
+        row = self.conn.execute(
+            f"""
+            SELECT MIN(CASE jobs.state WHEN 'pending' THEN jobs.available_at ELSE jobs.lease_expires END)
+            FROM jobs JOIN ({self._heads(shards)}) ON jobs.id = head
+            WHERE jobs.state IN ('pending', 'leased')
+            """,
+            tuple(shards)
+        ).fetchone()
+        return row[0]
+
+    def ack(self, job_ids):
+        """Mark leased jobs as done"""
+        self.conn.executemany(
+            "UPDATE jobs SET state = 'done', lease_owner = NULL, lease_expires = NULL WHERE id = ?",
+            [(job_id,) for job_id in job_ids]
+        )
+
+    def release(self, job_ids, delay, error=None):
+        """Return leased jobs unsent, without using up an attempt
+
+        For jobs that never reached nanomdm, e.g. because their backend's
+        circuit is open.
+        """
+        self.conn.executemany(
+            "UPDATE jobs SET state = 'pending', available_at = ?, attempts = MAX(attempts - 1, 0), "
+            "lease_owner = NULL, lease_expires = NULL, last_error = COALESCE(?, last_error) WHERE id = ?",
+            [(time.time() + delay, None if error is None else str(error)[:500], job_id) for job_id in job_ids]
+        )
+
+    def fail(self, job_ids, error):
+        """Release failed jobs for a retry, or dead-letter them after max_attempts"""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for job_id in job_ids:
+                row = self.conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is None:
+                    continue
+
+                attempts = row[0]
+                if attempts >= self.max_attempts:
+                    state, available_at = 'dead', now
+                else:
+                    # Exponential backoff between attempts
+                    state, available_at = 'pending', now + self.retry_delay * (2 ** (attempts - 1))
+
+                self.conn.execute(
+                    "UPDATE jobs SET state = ?, available_at = ?, lease_owner = NULL, lease_expires = NULL, last_error = ? WHERE id = ?",
+                    (state, available_at, str(error)[:500], job_id)
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def requeue_dead(self):
+        """Give dead-lettered jobs another full set of attempts
+
+        A dead job holds back its device's later jobs (see lease), so a
+        requeued job is still delivered before anything queued after it.
+        """
+        cursor = self.conn.execute(
+            "UPDATE jobs SET state = 'pending', attempts = 0, available_at = ? WHERE state = 'dead'",
+            (time.time(),)
+        )
+        return cursor.rowcount
+
+    def purge_done(self, older_than=86400):
+        """Delete finished or superseded jobs older than `older_than` seconds"""
+        cursor = self.conn.execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'superseded') AND created_at < ?",
+            (time.time() - older_than,)
+        )
+        return cursor.rowcount
+
+    def stats(self):
+        """Return job counts per state"""
+        rows = self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {"pending": 0, "leased": 0, "done": 0, "dead": 0, "superseded": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        self.conn.close()
+
+
+class PushWorker:
+    """Consumes jobs from a set of shards and sends them through nanomdm"""
+
+    def __init__(self, shards, queue_path=DEFAULT_QUEUE_PATH, profile_dir=DEFAULT_PROFILE_DIR,
+                 client_options=None, batch_size=100, poll_interval=0.5):
+        self.shards = list(shards)
+        self.queue_path = queue_path
+        self.profile_dir = profile_dir
+        self.client_options = client_options or {}
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def on_push_error(self, device_ids, error):
+        """Called by the coalescer once a wake-up push has failed every retry"""
+        # The commands are queued in nanomdm already, so the jobs stay done
+        print(f"⚠️ [{self.worker_id}] Push to {len(device_ids)} device(s) failed: {error} - "
+              f"they get their profile at the next check-in", file=sys.stderr)
+
+    def process_batch(self, queue, client, archive, coalescer=None, dispatcher=None, lane="bulk", tracker=None):
+        """Lease one batch and send it; returns the number of jobs handled
+
+        With a SendDispatcher the enqueue requests run on its `lane`, so
+        interactive sends from the same process go first. With a
+        CommandTracker every enqueued command is recorded, so a superseding
+        send elsewhere doesn't clear it from the device's queue.
+        """
+        jobs = queue.lease(self.worker_id, self.shards, self.batch_size)
+        if not jobs:
+            return 0
+
+        # Devices that get the same profile share a single multi-ID enqueue
+        groups = {}
+        for job in jobs:
+            groups.setdefault((job["profile_hash"], job["target"]), []).append(job)
+
+        sends = []
+        for (profile_hash, target), group in groups.items():
+            try:
+                profile_bytes = archive.get(profile_hash)
+                command_uuid, command = build_install_profile_command(profile_bytes)
+
+                device_ids = [job["device_id"] for job in group]
+
+                # With a coalescer the wake-up push is batched separately
+                no_push = coalescer is not None
+                if tracker is None:
+                    send, args = client.enqueue, (device_ids, command)
+                else:
+                    # Tracked under the job's slot so a newer direct send can replace it
+                    send, args = send_tracked, (
+                        client, tracker, device_ids, target or QUEUED_PROFILE_TARGET, command_uuid, command
+                    )
+                if dispatcher is None:
+                    response = send(*args, no_push=no_push)
+                else:
+                    response = dispatcher.submit(lane, send, *args, no_push=no_push)
+                sends.append((group, response))
+            except Exception as e:
+                self._settle(queue, group, e)
+
+        for group, response in sends:
+            try:
+                if dispatcher is not None:
+                    response = response.result()
+            except Exception as e:
+                self._settle(queue, group, e)
+                continue
+            delivered = self._settle(queue, group, response)
+            if coalescer is not None and delivered:
+                coalescer.request(delivered)
+
+        return len(jobs)
+
+    def _settle(self, queue, group, outcome):
+        """Ack, retry or release each job by its device's result; returns the delivered devices
+
+        `outcome` is the enqueue response or the exception it raised. With
+        several backends only devices on a failed backend are retried, so
+        devices that got the command aren't sent it twice.
+        """
+        device_ids = [job["device_id"] for job in group]
+        if isinstance(outcome, Exception):
+            results = dict.fromkeys(device_ids, outcome)
+        else:
+            results = device_results(outcome, device_ids)
+
+        done, unsent, failed = [], [], {}
+        for job in group:
+            result = results.get(job["device_id"])
+            if result == 200:
+                done.append(job)
+            elif isinstance(result, CircuitOpenError):
+                # The backend is known to be down - wait for it without burning attempts
+                unsent.append(job["id"])
+            else:
+                error = result if isinstance(result, Exception) else f"HTTP {result}: {outcome.text}"
+                failed.setdefault(str(error), []).append(job["id"])
+
+        queue.ack([job["id"] for job in done])
+        if unsent:
+            queue.release(unsent, queue.retry_delay, "backend circuit open")
+        for error, job_ids in failed.items():
+            queue.fail(job_ids, error)
+        return [job["device_id"] for job in done]
+
+    def run(self, stop_event=None):
+        """Process jobs until stop_event is set"""
+        queue = PushQueue(self.queue_path)
+        # Without an explicit host, devices are routed to their backend from backends.json
+        # Each worker process paces its own requests; limits are per process
+        # (and per backend when sharded)
+        if self.client_options.get("host"):
+            client = RateLimitedClient(NanoMDMClient(**self.client_options), topic=cached_topic())
+        else:
+            client = ShardedClient(limiter=RateLimiter(), topic=cached_topic())
+        archive = _archive(self.profile_dir)
+        coalescer = PushCoalescer(client, on_error=self.on_push_error)
+        tracker = CommandTracker()
+
+        try:
+            while stop_event is None or not stop_event.is_set():
+                if self.process_batch(queue, client, archive, coalescer, tracker=tracker) == 0:
+                    time.sleep(self.poll_interval)
+        finally:
+            coalescer.close()
+            client.close()
+            tracker.close()
+            queue.close()
+
+
+def _worker_main(shards, queue_path, profile_dir, client_options, stop_event):
+    """Entry point for worker processes"""
+    worker = PushWorker(shards, queue_path, profile_dir, client_options)
+    try:
+        worker.run(stop_event)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(processes=None, queue_path=DEFAULT_QUEUE_PATH, profile_dir=DEFAULT_PROFILE_DIR, client_options=None):
+    """Run one worker process per core, splitting the shards between them"""
+    processes = processes or os.cpu_count() or 1
+
+    queue = PushQueue(queue_path)
+    shard_count = queue.shards
+    queue.close()
+
+    processes = min(processes, shard_count)
+    stop_event = multiprocessing.Event()
+    workers = []
+
+    for index in range(processes):
+        shards = [shard for shard in range(shard_count) if shard % processes == index]
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(shards, queue_path, profile_dir, client_options, stop_event),
+            daemon=True
+        )
+        process.start()
+        workers.append(process)
+
+    print(f"🚀 Started {processes} push worker(s) over {shard_count} shards")
+
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping push workers...")
+        stop_event.set()
+        for process in workers:
+            process.join(timeout=10)
+        print("✅ Push workers stopped")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Durable push queue for Hideaway")
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help='Path to the queue database')
+    subparsers = parser.add_subparsers(dest='command')
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='Queue a profile for a device')
+    enqueue_parser.add_argument('device_id')
+    enqueue_parser.add_argument('profile', help='Path to a .mobileconfig file')
+    enqueue_parser.add_argument('--target', default=None, help='Slot the profile fills (supersedes older jobs for it)')
+
+    worker_parser = subparsers.add_parser('worker', help='Run push worker processes')
+    worker_parser.add_argument('--processes', type=int, default=None)
+    worker_parser.add_argument('--host', default=None, help='Single nanomdm URL (default: backends.json)')
+
+    subparsers.add_parser('stats', help='Show queue statistics')
+    subparsers.add_parser('requeue-dead', help='Retry dead-lettered jobs')
+
+    args = parser.parse_args()
+
+    if args.command == 'enqueue':
+        with open(args.profile, 'rb') as f:
+            profile_hash = store_profile(args.device_id, f.read())
+        queue = PushQueue(args.queue)
+        job_id = queue.enqueue(args.device_id, profile_hash, args.target)
+        print(f"✅ Queued job {job_id} for {args.device_id} ({profile_hash[:12]})")
+    elif args.command == 'worker':
+        run_workers(args.processes, args.queue, client_options={"host": args.host})
+    elif args.command == 'requeue-dead':
+        count = PushQueue(args.queue).requeue_dead()
+        print(f"✅ Requeued {count} dead job(s)")
+    elif args.command == 'stats':
+        for state, count in PushQueue(args.queue).stats().items():
+            print(f"  {state}: {count}")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
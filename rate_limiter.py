@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Rate Limiter - Token buckets around nanomdm API calls
+
+Large operations used to fire /v1/enqueue and /v1/push requests as fast as
+the loop ran, which ends in 429s from nanomdm (or throttling by APNs behind
+it) and slow retries. Every call now takes tokens from a bucket for its
+endpoint, and pushes also from a bucket for the APNs topic (one token per
+device woken). Buckets allow short bursts and then settle at their
+sustained rate.
+
+Callers are throttled by waiting for tokens. If the wait would be longer
+than they are willing to block, RateLimited is raised with the time until
+capacity is available, so callers can back off or requeue. A 429 from the
+server drains the bucket for the Retry-After period.
+
+Endpoint buckets belong to one nanomdm instance: a client created with
+`backend=<name>` uses "endpoint:<endpoint>@<name>", which takes its limit
+from "endpoint:<endpoint>" unless configured separately. ShardedClient
+wraps each backend's client this way. The APNs topic bucket stays shared,
+since every instance pushes with the same certificate.
+"""
+
+import time
+import threading
+
+# bucket name -> (tokens per second, burst capacity)
+DEFAULT_LIMITS = {
+    "endpoint:enqueue": (20.0, 50),
+    "endpoint:push": (20.0, 50),
+    "endpoint:queue": (10.0, 20),
+    "endpoint:pushcert": (1.0, 2),
+    "topic": (100.0, 500)
+}
+
+
+class RateLimited(Exception):
+    """Raised when a call would have to wait longer than allowed"""
+
+    def __init__(self, bucket, retry_after):
+        super().__init__(f"Rate limit for {bucket}: retry in {retry_after:.2f}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket with burst capacity
+
+    A request larger than the capacity is allowed once the bucket is full
+    and leaves it in debt, which delays the following requests instead of
+    blocking the large one forever.
+    """
+
+    def __init__(self, rate, capacity, name="bucket"):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.name = name
+
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.waited = 0.0
+        self.rejected = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_time(self, cost):
+        needed = min(cost, self.capacity) - self._tokens
+        return max(0.0, needed / self.rate)
+
+    def acquire(self, cost=1, timeout=None):
+        """Take `cost` tokens, waiting up to `timeout` seconds (None = forever)
+
+        Returns the time spent waiting; raises RateLimited if the wait would
+        exceed `timeout`.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_time(cost)
+
+                if wait <= 0:
+                    self._tokens -= cost
+                    self.waited += waited
+                    return waited
+
+                if timeout is not None and waited + wait > timeout:
+                    self.rejected += 1
+                    raise RateLimited(self.name, wait)
+
+            time.sleep(wait)
+            waited += wait
+
+    def penalize(self, seconds):
+        """Empty the bucket for `seconds` (e.g. after a 429 with Retry-After)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class RateLimiter:
+    """Named token buckets, created on first use from the configured limits"""
+
+    def __init__(self, limits=None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, name):
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                # Per-backend and per-topic buckets share the generic limit unless configured
+                base = name.split("@")[0]
+                rate, capacity = self.limits.get(name) or self.limits.get(base) or self.limits[base.split(":")[0]]
+                bucket = self._buckets[name] = TokenBucket(rate, capacity, name)
+            return bucket
+
+    def acquire(self, names_and_costs, timeout=None):
+        """Take tokens from several buckets; returns the total time waited"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = 0.0
+        for name, cost in names_and_costs:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            waited += self.bucket(name).acquire(cost, remaining)
+        return waited
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {"waited_s": round(b.waited, 3), "rejected": b.rejected}
+                for name, b in self._buckets.items()
+            }
+
+
+def _retry_after(response, default=1.0):
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except (TypeError, ValueError):
+        return default
+
+
+class RateLimitedClient:
+    """NanoMDMClient wrapper that takes tokens before every API call
+
+    `timeout` is the longest a call may wait for tokens before RateLimited
+    is raised (None waits as long as needed). With `backend` the endpoint
+    buckets are that nanomdm instance's own.
+    """
+
+    def __init__(self, client, limiter=None, topic=None, timeout=None, backend=None):
+        self.client = client
+        self.limiter = limiter or RateLimiter()
+        self.topic = topic
+        self.timeout = timeout
+        self.backend = backend
+
+    def __getattr__(self, name):
+        # host, session, queue_api, ... come from the wrapped client
+        return getattr(self.client, name)
+
+    def _call(self, endpoint, buckets, func, *args, **kwargs):
+        bucket = f"endpoint:{endpoint}" if self.backend is None else f"endpoint:{endpoint}@{self.backend}"
+        self.limiter.acquire([(bucket, 1)] + buckets, self.timeout)
+        response = func(*args, **kwargs)
+        if response.status_code == 429:
+            self.limiter.bucket(bucket).penalize(_retry_after(response))
+        return response
+
+    def _topic_bucket(self, device_ids):
+        count = 1 if isinstance(device_ids, str) else len(device_ids)
+        return [(f"topic:{self.topic or 'default'}", count)]
+
+    def push(self, device_ids):
+        return self._call("push", self._topic_bucket(device_ids), self.client.push, device_ids)
+
+    def enqueue(self, device_ids, command_bytes, no_push=False):
+        # Enqueueing without nopush also sends an APNs push per device
+        buckets = [] if no_push else self._topic_bucket(device_ids)
+        return self._call("enqueue", buckets, self.client.enqueue, device_ids, command_bytes, no_push=no_push)
+
+    def clear_queue(self, device_ids):
+        return self._call("queue", [], self.client.clear_queue, device_ids)
+
+    def upload_push_cert(self, pem_bundle):
+        return self._call("pushcert", [], self.client.upload_push_cert, pem_bundle)
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Readiness - Wait for SCEP and nanomdm to actually come up
+
+Replaces fixed sleeps after starting the servers. Each probe polls with fast
+exponential backoff (starting at 50 ms) under an overall deadline, so setup
+continues the moment a service answers and still tolerates a slow machine.
+"""
+
+import time
+import socket
+import requests
+
+
+class ServiceNotReady(Exception):
+    """Raised when a service doesn't become ready before the deadline"""
+
+
+def wait_until(probe, description, timeout=30.0, initial_delay=0.05, max_delay=1.0, server=None):
+    """Call `probe()` until it returns a truthy value or the deadline passes
+
+    If `server` (a ManagedServer) is given and its process exits, waiting
+    stops immediately instead of running out the clock.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    last_error = None
+
+    while True:
+        try:
+            result = probe()
+            if result:
+                return result
+        except Exception as e:
+            last_error = e
+
+        if server is not None and not server.is_running():
+            raise ServiceNotReady(f"{description}: process exited ({'; '.join(server.tail(3))})")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            detail = f" (last error: {last_error})" if last_error else ""
+            raise ServiceNotReady(f"{description} not ready after {timeout:g}s{detail}")
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def wait_for_tcp(host, port, timeout=30.0, server=None):
+    """Wait until something accepts TCP connections on host:port"""
+    def probe():
+        with socket.create_connection((host, port), timeout=1):
+            return True
+
+    return wait_until(probe, f"{host}:{port}", timeout, server=server)
+
+
+def wait_for_scep(scep_url, timeout=30.0, server=None, session=None):
+    """Wait until the SCEP server returns a CA certificate
+
+    `scep_url` is the server base URL (e.g. http://127.0.0.1:8080).
+    Returns the DER bytes of the GetCACert response.
+    """
+    session = session or requests.Session()
+    url = f"{scep_url.rstrip('/')}/scep"
+
+    def probe():
+        response = session.get(url, params={"operation": "GetCACert"}, timeout=2)
+        if response.status_code == 200 and response.content:
+            return response.content
+        return None
+
+    return wait_until(probe, f"SCEP GetCACert at {url}", timeout, server=server)
+
+
+def wait_for_nanomdm(nanomdm_url, timeout=30.0, server=None, session=None):
+    """Wait until the nanomdm listener answers HTTP requests
+
+    Any HTTP response (even 401/404) means the listener is up.
+    """
+    session = session or requests.Session()
+    url = f"{nanomdm_url.rstrip('/')}/version"
+
+    def probe():
+        session.get(url, timeout=2)
+        return True
+
+    return wait_until(probe, f"nanomdm at {nanomdm_url}", timeout, server=server)
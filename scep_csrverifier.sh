@@ -0,0 +1,10 @@
+#!/bin/sh
+# CSR verifier for scepserver -csrverifierexec
+#
+# scepserver runs this once per enrollment with the CSR on stdin and no
+# arguments; exit status 0 accepts it. The challenge in the CSR is checked
+# and consumed by the challenge service (python3 challenge_service.py serve).
+# Set HIDEAWAY_CHALLENGE_SERVICE if the service isn't on the default port.
+
+exec python3 "$(dirname "$0")/challenge_service.py" csrverifier \
+    --service "${HIDEAWAY_CHALLENGE_SERVICE:-http://127.0.0.1:8090}"
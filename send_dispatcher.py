@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Send Dispatcher - Priority lanes for sends to nanomdm
+
+Every send used to go through one synchronous path, so an urgent unblock
+from the GUI could sit behind a large scheduled rollout. The dispatcher
+keeps a bounded queue per priority lane and a small pool of sender threads:
+
+- "interactive" (GUI actions) is always served first, and one thread only
+  ever serves this lane, so it never waits behind a long bulk send
+- "bulk" and "scheduled" share the remaining capacity by weight (smooth
+  weighted round-robin), so neither starves the other
+
+Full lanes push back on the submitter (submit blocks, or raises queue.Full
+with block=False). Queue wait and run time are recorded per lane.
+"""
+
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# lane -> (weight, max queued tasks); interactive has strict priority
+DEFAULT_LANES = {
+    "interactive": (0, 100),
+    "bulk": (3, 1000),
+    "scheduled": (1, 1000)
+}
+PRIORITY_LANE = "interactive"
+
+
+class _Task:
+    __slots__ = ("func", "args", "kwargs", "future", "lane", "submitted_at")
+
+    def __init__(self, lane, func, args, kwargs):
+        self.lane = lane
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+
+
+class LaneStats:
+    """Rolling latency samples for one lane"""
+
+    def __init__(self, window=1000):
+        self.wait = deque(maxlen=window)
+        self.total = deque(maxlen=window)
+        self.completed = 0
+        self.failed = 0
+
+    @staticmethod
+    def _percentile(samples, fraction):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_p50_ms": _ms(self._percentile(self.wait, 0.5)),
+            "wait_p95_ms": _ms(self._percentile(self.wait, 0.95)),
+            "total_p50_ms": _ms(self._percentile(self.total, 0.5)),
+            "total_p95_ms": _ms(self._percentile(self.total, 0.95))
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class SendDispatcher:
+    """Runs send tasks from bounded priority lanes on a few threads"""
+
+    def __init__(self, lanes=None, workers=4):
+        self.lanes = dict(lanes or DEFAULT_LANES)
+        self.queues = {lane: queue.Queue(maxsize) for lane, (_, maxsize) in self.lanes.items()}
+        self.stats = {lane: LaneStats() for lane in self.lanes}
+
+        # Smooth weighted round-robin state for the weighted lanes
+        self._credit = {lane: 0 for lane, (weight, _) in self.lanes.items() if weight > 0}
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._stopped = False
+
+        self._threads = []
+        for index in range(max(1, workers)):
+            # The first thread only serves the interactive lane
+            lanes_served = [PRIORITY_LANE] if index == 0 and workers > 1 and PRIORITY_LANE in self.lanes else None
+            thread = threading.Thread(
+                target=self._run, args=(lanes_served,), name=f"send-dispatcher-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, lane, func, *args, block=True, timeout=None, **kwargs):
+        """Queue `func(*args, **kwargs)` on a lane and return a Future
+
+        Blocks while the lane is full (backpressure); with block=False or
+        a timeout, raises queue.Full instead.
+        """
+        if lane not in self.queues:
+            raise ValueError(f"Unknown lane '{lane}'")
+        if self._stopped:
+            raise RuntimeError("SendDispatcher is closed")
+
+        task = _Task(lane, func, args, kwargs)
+        self.queues[lane].put(task, block=block, timeout=timeout)
+
+        with self._available:
+            self._available.notify_all()
+        return task.future
+
+    def _next_task(self, lanes_served):
+        """Pick the next task: interactive first, then weighted round-robin"""
+        if lanes_served is None or PRIORITY_LANE in lanes_served:
+            try:
+                return self.queues[PRIORITY_LANE].get_nowait()
+            except (KeyError, queue.Empty):
+                pass
+        if lanes_served is not None:
+            return None
+
+        ready = [lane for lane in self._credit if not self.queues[lane].empty()]
+        while ready:
+            total = 0
+            for lane in ready:
+                self._credit[lane] += self.lanes[lane][0]
+                total += self.lanes[lane][0]
+            lane = max(ready, key=lambda name: self._credit[name])
+            self._credit[lane] -= total
+            try:
+                return self.queues[lane].get_nowait()
+            except queue.Empty:
+                ready.remove(lane)
+        return None
+
+    def _run(self, lanes_served):
+        while True:
+            with self._available:
+                while True:
+                    task = self._next_task(lanes_served)
+                    if task is not None:
+                        break
+                    if self._stopped:
+                        return
+                    self._available.wait()
+
+            if not task.future.set_running_or_notify_cancel():
+                continue
+
+            started = time.monotonic()
+            stats = self.stats[task.lane]
+            try:
+                result = task.func(*task.args, **task.kwargs)
+            except BaseException as e:
+                stats.failed += 1
+                task.future.set_exception(e)
+            else:
+                stats.completed += 1
+                task.future.set_result(result)
+            finally:
+                stats.wait.append(started - task.submitted_at)
+                stats.total.append(time.monotonic() - task.submitted_at)
+
+    def queued(self):
+        return {lane: q.qsize() for lane, q in self.queues.items()}
+
+    def report(self):
+        """Per-lane latency summary"""
+        return {lane: stats.summary() for lane, stats in self.stats.items()}
+
+    def close(self, wait=True):
+        """Stop accepting work; queued tasks still run before threads exit"""
+        with self._available:
+            self._stopped = True
+            self._available.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
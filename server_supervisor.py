@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Server Supervisor - Runs SCEP and nanomdm as managed child processes
+
+Each server's output is drained continuously by a background thread into a
+bounded in-memory ring buffer and a rotating log file, so a chatty `-debug`
+server can never fill the OS pipe buffer and stall. Servers that crash are
+restarted with exponential backoff, and everything is shut down cleanly on
+Ctrl+C.
+"""
+
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+
+class ManagedServer:
+    """A single supervised server process"""
+
+    def __init__(self, name, args, cwd=None, log_dir=None, ring_size=1000,
+                 max_log_bytes=5 * 1024 * 1024, log_backups=3,
+                 restart=True, max_backoff=30.0, healthy_after=60.0):
+        self.name = name
+        self.args = list(args)
+        self.cwd = cwd
+        self.restart = restart
+        self.max_backoff = max_backoff
+        self.healthy_after = healthy_after
+
+        self.process = None
+        self.restarts = 0
+        self.lines = deque(maxlen=ring_size)
+
+        self._stopping = threading.Event()
+        self._spawn_lock = threading.Lock()
+        self._monitor = None
+
+        # Each server gets its own rotating log file
+        self.logger = logging.getLogger(f"hideaway.server.{name}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.log_path = None
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+            self.log_path = os.path.join(log_dir, f"{name}.log")
+            if not self.logger.handlers:
+                handler = RotatingFileHandler(self.log_path, maxBytes=max_log_bytes, backupCount=log_backups)
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                self.logger.addHandler(handler)
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _spawn(self):
+        # stderr is merged into stdout so a single thread drains both
+        self.process = subprocess.Popen(
+            self.args,
+            cwd=self.cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL
+        )
+        threading.Thread(target=self._drain, args=(self.process,), daemon=True).start()
+
+    def _drain(self, process):
+        """Read output until EOF so the child never blocks on a full pipe"""
+        for raw_line in iter(process.stdout.readline, b""):
+            line = raw_line.decode(errors="replace").rstrip()
+            self.lines.append(line)
+            self.logger.info(line)
+        process.stdout.close()
+
+    def _watch(self):
+        backoff = 1.0
+        while not self._stopping.is_set():
+            started_at = time.time()
+            self.process.wait()
+
+            if self._stopping.is_set() or not self.restart:
+                break
+
+            # A server that stayed up for a while gets a fresh backoff
+            if time.time() - started_at >= self.healthy_after:
+                backoff = 1.0
+
+            self.lines.append(f"[supervisor] {self.name} exited with {self.process.returncode}, restarting in {backoff:.0f}s")
+            self.logger.info(self.lines[-1])
+
+            if self._stopping.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.max_backoff)
+
+            try:
+                # Checked under the lock so stop() can't miss a fresh process
+                with self._spawn_lock:
+                    if self._stopping.is_set():
+                        break
+                    self._spawn()
+                self.restarts += 1
+            except OSError as e:
+                self.lines.append(f"[supervisor] failed to restart {self.name}: {e}")
+                self.logger.info(self.lines[-1])
+
+    def start(self):
+        """Start the server; raises OSError if the binary can't be launched"""
+        self._stopping.clear()
+        self._spawn()
+        self._monitor = threading.Thread(target=self._watch, daemon=True)
+        self._monitor.start()
+        return self
+
+    def stop(self, timeout=10):
+        """Terminate the server, escalating to kill after `timeout` seconds"""
+        self._stopping.set()
+        with self._spawn_lock:
+            if self.is_running():
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+        if self._monitor:
+            self._monitor.join(timeout=timeout)
+
+    def tail(self, count=20):
+        """Return the last `count` lines of output"""
+        return list(self.lines)[-count:]
+
+
+class ServerSupervisor:
+    """Starts, watches and stops a group of managed servers"""
+
+    def __init__(self, log_dir=None):
+        self.log_dir = log_dir
+        self.servers = {}
+
+    def start(self, name, args, cwd=None, **options):
+        """Start and register a managed server"""
+        options.setdefault("log_dir", self.log_dir)
+        server = ManagedServer(name, args, cwd=cwd, **options)
+        server.start()
+        self.servers[name] = server
+        return server
+
+    def stop_all(self, timeout=10):
+        """Stop servers in reverse start order"""
+        for server in reversed(list(self.servers.values())):
+            server.stop(timeout)
+
+    def status(self):
+        """Return a short status line per server"""
+        return {
+            name: f"{'running' if server.is_running() else 'stopped'} (pid {server.pid}, restarts {server.restarts})"
+            for name, server in self.servers.items()
+        }
+
+    def wait_forever(self):
+        """Block until Ctrl+C or SIGTERM, then stop every server"""
+        stop_event = threading.Event()
+
+        def handle_sigterm(signum, frame):
+            stop_event.set()
+
+        # Signal handlers can only be installed from the main thread (the
+        # launcher GUIs run setup in a worker thread)
+        on_main_thread = threading.current_thread() is threading.main_thread()
+        previous = signal.signal(signal.SIGTERM, handle_sigterm) if on_main_thread else None
+        try:
+            while not stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if on_main_thread:
+                signal.signal(signal.SIGTERM, previous)
+            print("\n🛑 Stopping servers...")
+            self.stop_all()
+            print("✅ Servers stopped")
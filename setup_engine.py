@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Setup Engine - Idempotent, resumable setup steps with a manifest
+
+Setup is modelled as a DAG of named steps. After a step succeeds its input
+hash, output file hashes and result are recorded in a JSON manifest. On the
+next run a step whose inputs are unchanged and whose outputs are still on
+disk (with the same content) is skipped. Steps whose dependencies are done
+run in parallel on a thread pool.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class SetupStepFailed(Exception):
+    """Raised when a setup step fails"""
+
+
+class SetupStep:
+    """A single unit of setup work
+
+    Args:
+        name: Unique step name
+        func: Callable taking a dict of dependency results and returning the
+            step result. Returning False marks the step as failed.
+        deps: Names of steps that must finish first
+        inputs: Callable returning JSON-able data that determines whether the
+            step needs to run again (e.g. URLs, versions, hashes of files)
+        outputs: Callable returning file paths the step produces
+        always_run: Never skip (e.g. starting a server process)
+    """
+
+    def __init__(self, name, func, deps=(), inputs=None, outputs=None, always_run=False):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.inputs = inputs or (lambda: None)
+        self.outputs = outputs or (lambda: [])
+        self.always_run = always_run
+
+
+def hash_file(path):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SetupEngine:
+    """Runs setup steps in dependency order, skipping completed ones"""
+
+    def __init__(self, manifest_path, max_workers=4):
+        self.manifest_path = manifest_path
+        self.max_workers = max_workers
+        self.steps = {}
+        self.results = {}
+        self.skipped = []
+        self.executed = []
+        self._changed = set()
+
+        self._lock = threading.Lock()
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"steps": {}}
+
+    def _save_manifest(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def add(self, name, func, **options):
+        """Register a step (see SetupStep for options)"""
+        self.steps[name] = SetupStep(name, func, **options)
+        return self.steps[name]
+
+    def _inputs_hash(self, step):
+        data = json.dumps(step.inputs(), sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _output_record(self, path, previous=None):
+        """Hash an output file, reusing the previous hash if size and mtime match"""
+        st = os.stat(path)
+        if previous and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns:
+            return previous
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": hash_file(path)}
+
+    def _is_up_to_date(self, step, inputs_hash):
+        if step.always_run:
+            return False
+
+        record = self.manifest["steps"].get(step.name)
+        if not record or record.get("inputs") != inputs_hash:
+            return False
+
+        # Anything a dependency re-ran may have changed
+        if any(dep in self._changed for dep in step.deps):
+            return False
+
+        for path, previous in record.get("outputs", {}).items():
+            if not os.path.exists(path):
+                return False
+            if self._output_record(path, previous)["sha256"] != previous["sha256"]:
+                return False
+
+        return True
+
+    def _run_step(self, step):
+        inputs_hash = self._inputs_hash(step)
+
+        with self._lock:
+            up_to_date = self._is_up_to_date(step, inputs_hash)
+        if up_to_date:
+            with self._lock:
+                self.results[step.name] = self.manifest["steps"][step.name].get("result")
+                self.skipped.append(step.name)
+            return
+
+        dep_results = {dep: self.results.get(dep) for dep in step.deps}
+        result = step.func(dep_results)
+        if result is False:
+            raise SetupStepFailed(step.name)
+
+        with self._lock:
+            self.results[step.name] = result
+            self.executed.append(step.name)
+
+            # Always-run steps (e.g. server starts) only pass on changes from
+            # their own dependencies, so a warm run can still skip after them
+            if not step.always_run or any(dep in self._changed for dep in step.deps):
+                self._changed.add(step.name)
+
+            if not step.always_run:
+                previous = self.manifest["steps"].get(step.name, {}).get("outputs", {})
+                outputs = {
+                    path: self._output_record(path, previous.get(path))
+                    for path in step.outputs() if os.path.exists(path)
+                }
+                try:
+                    json.dumps(result)
+                    stored_result = result
+                except TypeError:
+                    stored_result = None
+
+                self.manifest["steps"][step.name] = {
+                    "inputs": inputs_hash,
+                    "outputs": outputs,
+                    "result": stored_result,
+                    "completed_at": time.time()
+                }
+                self._save_manifest()
+
+    def run(self):
+        """Run all steps; returns True on success, raises SetupStepFailed otherwise"""
+        for step in self.steps.values():
+            for dep in step.deps:
+                if dep not in self.steps:
+                    raise ValueError(f"Step '{step.name}' depends on unknown step '{dep}'")
+
+        done = set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(done) < len(self.steps):
+                ready = [
+                    step for name, step in self.steps.items()
+                    if name not in done and name not in running.values()
+                    and all(dep in done for dep in step.deps)
+                ]
+                for step in ready:
+                    running[executor.submit(self._run_step, step)] = step.name
+
+                if not running:
+                    raise ValueError("Setup steps contain a dependency cycle")
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        # Let steps already running finish before reporting
+                        for other in running:
+                            other.cancel()
+                        wait(list(running))
+                        raise
+                    done.add(name)
+
+        return True
@@ -12,6 +12,17 @@ import uuid
 import plistlib
 from datetime import datetime, timedelta
 import json
+import platform
+
+from server_supervisor import ServerSupervisor
+from readiness import wait_for_scep, wait_for_nanomdm, ServiceNotReady
+from capability_probe import probe_requirements
+import ca_certificate
+from setup_engine import SetupEngine, hash_file
+from nanomdm_client import NanoMDMClient
+from backend_registry import BackendRegistry, DEFAULT_WEBHOOK_BASE
+from challenge_service import ChallengeStore, CSR_VERIFIER, service_command
+import push_certificate
 
 class iPhoneSetup:
     def __init__(self, base_dir="/Users/paul/Files/vsc_projekte/app_block"):
@@ -19,6 +30,8 @@ class iPhoneSetup:
         self.nanomdm_dir = f"{base_dir}/nanomdm"
         self.certs_dir = f"{base_dir}/certs"
         self.scep_dir = f"{base_dir}/scep"
+        self.push_cert_path = f"{base_dir}/push.pem"
+        self.push_key_path = f"{base_dir}/push.key"
         
         # Server configuration
         self.nanomdm_port = 9000
@@ -31,8 +44,25 @@ class iPhoneSetup:
         self.public_nanomdm_url = ""
         self.public_scep_url = ""
         
+        # The nanomdm started here is a backend in backends.json; enrolled
+        # devices are pinned to it through its webhook
+        self.backends, self.backend_name = self.register_backend()
+        
+        # Server processes are supervised so their output is always drained
+        self.supervisor = ServerSupervisor(log_dir=f"{base_dir}/logs")
+        
         self.setup_directories()
         
+    def register_backend(self):
+        """Find (or add) this nanomdm in the backend registry; returns (registry, name)"""
+        registry = BackendRegistry.load(default_host=self.nanomdm_url, password=self.api_key)
+        name = registry.find(self.nanomdm_url)
+        if name is None:
+            name = "local"
+            registry.add(name, self.nanomdm_url, password=self.api_key, server_url=self.public_nanomdm_url)
+            registry.save()
+        return registry, name
+        
     def setup_directories(self):
         """Create necessary directories"""
         for directory in [self.certs_dir, self.scep_dir]:
@@ -40,25 +70,16 @@ class iPhoneSetup:
             
     def check_requirements(self):
         """Check if all requirements are installed"""
-        requirements = {
-            "python3": "python3 --version",
-            "go": "go version",
-            "curl": "curl --version",
-            "openssl": "openssl version"
-        }
-        
         print("🔍 Checking requirements...")
         missing = []
         
-        for tool, cmd in requirements.items():
-            try:
-                result = subprocess.run(cmd.split(), capture_output=True, text=True)
-                if result.returncode == 0:
-                    print(f"  ✅ {tool}: OK")
-                else:
-                    print(f"  ❌ {tool}: Not found")
-                    missing.append(tool)
-            except FileNotFoundError:
+        # Resolved via PATH, probed concurrently and cached between runs
+        results = probe_requirements(state_path=f"{self.base_dir}/capabilities.json")
+        
+        for tool, info in results.items():
+            if info["ok"]:
+                print(f"  ✅ {tool}: OK")
+            else:
                 print(f"  ❌ {tool}: Not found")
                 missing.append(tool)
                 
@@ -126,44 +147,39 @@ class iPhoneSetup:
         scep_binary = f"{self.scep_dir}/scepserver"
         
         try:
+            # One-time challenges are checked (and consumed) by the challenge service
+            self.supervisor.start("challenges", service_command())
+            
             # Start SCEP server
-            process = subprocess.Popen([
+            server = self.supervisor.start("scep", [
                 scep_binary,
                 "-allowrenew", "0",
-                "-challenge", "focuscontroller",
+                "-csrverifierexec", CSR_VERIFIER,
                 "-port", str(self.scep_port)
-            ], cwd=self.scep_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            ], cwd=self.scep_dir)
             
             print(f"  ✅ SCEP server started on port {self.scep_port}")
-            print(f"  🔑 Challenge password: focuscontroller")
+            print(f"  🔑 Challenges: one-time, issued per enrollment profile")
+            print(f"  📄 Logs: {server.log_path}")
             
-            return process
+            return server
             
         except Exception as e:
             print(f"  ❌ Failed to start SCEP server: {e}")
             return None
             
-    def get_ca_certificate(self):
+    def get_ca_certificate(self, response_data=None):
         """Download CA certificate from SCEP server"""
         print("📜 Getting CA certificate...")
         
-        ca_path = f"{self.certs_dir}/ca.pem"
-        
         try:
-            # Get CA cert from SCEP server
-            url = f"{self.scep_url}/scep?operation=GetCACert"
-            
-            subprocess.run([
-                "curl", url, "-o", f"{self.certs_dir}/ca.der"
-            ], check=True)
-            
-            # Convert to PEM
-            subprocess.run([
-                "openssl", "x509", "-inform", "DER", "-in", f"{self.certs_dir}/ca.der",
-                "-out", ca_path
-            ], check=True)
+            # Fetched, converted to PEM and verified in-process
+            ca_path, fingerprint = ca_certificate.get_ca_certificate(
+                self.scep_url, self.certs_dir, response_data
+            )
             
             print(f"  ✅ CA certificate saved to {ca_path}")
+            print(f"  🔏 SHA-256: {fingerprint[:16]}...")
             return ca_path
             
         except Exception as e:
@@ -178,25 +194,27 @@ class iPhoneSetup:
             # Start nanomdm
             nanomdm_binary = f"{self.nanomdm_dir}/nanomdm-darwin-arm64"
             
-            process = subprocess.Popen([
+            server = self.supervisor.start("nanomdm", [
                 nanomdm_binary,
                 "-ca", ca_path,
                 "-api", self.api_key,
                 "-debug",
+                "-webhook-url", f"{DEFAULT_WEBHOOK_BASE}/{self.backend_name}",
                 "-listen", f":{self.nanomdm_port}"
-            ], cwd=self.nanomdm_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            ], cwd=self.nanomdm_dir)
             
             print(f"  ✅ nanomdm server started on port {self.nanomdm_port}")
             print(f"  🔑 API key: {self.api_key}")
+            print(f"  📄 Logs: {server.log_path}")
             
-            return process
+            return server
             
         except Exception as e:
             print(f"  ❌ Failed to start nanomdm: {e}")
             return None
             
-    def create_enrollment_profile(self, nanomdm_url, scep_url, push_topic):
-        """Create iPhone enrollment profile"""
+    def create_enrollment_profile(self, mdm_url, scep_url, push_topic):
+        """Create iPhone enrollment profile (`mdm_url` is the backend's check-in URL)"""
         print("📱 Creating enrollment profile...")
         
         profile_uuid = str(uuid.uuid4())
@@ -214,7 +232,7 @@ class iPhoneSetup:
                     "PayloadVersion": 1,
                     
                     "URL": f"{scep_url}/scep",
-                    "Challenge": "focuscontroller",
+                    "Challenge": ChallengeStore().issue("iPhone"),
                     "Subject": [
                         [ ["CN", "Focus Controller Device"] ],
                         [ ["O", "Focus Controller"] ]
@@ -235,8 +253,8 @@ class iPhoneSetup:
                     
                     "IdentityCertificateUUID": scep_uuid,
                     "Topic": push_topic,
-                    "ServerURL": f"{nanomdm_url}/mdm",
-                    "CheckInURL": f"{nanomdm_url}/mdm",
+                    "ServerURL": mdm_url,
+                    "CheckInURL": mdm_url,
                     "CheckOutWhenRemoved": True,
                     
                     "AccessRights": 8191,  # All access rights
@@ -265,8 +283,18 @@ class iPhoneSetup:
         return profile_path
         
     def setup_push_certificate(self):
-        """Instructions for push certificate setup"""
+        """Read the push topic from the push certificate, if there is one"""
         print("\n📋 Push Certificate Setup:")
+        
+        if os.path.exists(self.push_cert_path) and os.path.exists(self.push_key_path):
+            try:
+                topic = push_certificate.read_push_topic(self.push_cert_path, self.push_key_path)
+                print(f"  ✅ Push certificate is valid, topic: {topic}")
+                return topic
+            except (OSError, push_certificate.PushCertificateError) as e:
+                print(f"  ❌ {e}")
+                return False
+                
         print("")
         print("To complete the setup, you need an Apple MDM Push Certificate:")
         print("")
@@ -276,66 +304,144 @@ class iPhoneSetup:
         print("4. Upload to Apple's Push Certificates Portal")
         print("5. Download the resulting push certificate")
         print("")
-        print("Then upload it to nanomdm with:")
-        print(f"  cat push.pem push.key | curl -T - -u nanomdm:{self.api_key} '{self.nanomdm_url}/v1/pushcert'")
+        print(f"Then save it as {self.push_cert_path} (with its key as {self.push_key_path})")
+        print("and run setup again - it will be validated and uploaded automatically.")
         print("")
         print("For now, we'll use a placeholder topic...")
         
         # Return a placeholder topic for testing
-        return "com.apple.mgmt.External.placeholder"
-        
-    def run_full_setup(self):
-        """Run the complete iPhone setup process"""
-        print("🎯 Focus Controller - iPhone Setup")
-        print("=" * 50)
+        return push_certificate.PLACEHOLDER_TOPIC
         
-        # Check requirements
-        if not self.check_requirements():
-            return False
+    def upload_push_certificate(self):
+        """Upload the push certificate to the running nanomdm"""
+        if not (os.path.exists(self.push_cert_path) and os.path.exists(self.push_key_path)):
+            return None
             
-        print("\n" + "="*50)
-        
-        # Setup SCEP server
-        if not self.setup_scep_server():
+        print("📤 Uploading push certificate...")
+        client = NanoMDMClient(self.nanomdm_url, password=self.api_key)
+        try:
+            topic = push_certificate.upload_push_certificate(self.push_cert_path, self.push_key_path, client)
+            print(f"  ✅ Push certificate uploaded, topic: {topic}")
+            return topic
+        except (OSError, push_certificate.PushCertificateError) as e:
+            print(f"  ❌ {e}")
             return False
+        finally:
+            client.close()
             
-        print("\n" + "="*50)
-        
-        # Start SCEP server
+    def _push_cert_inputs(self):
+        """Re-read/re-upload only when the push certificate pair changes"""
+        return [
+            hash_file(path) if os.path.exists(path) else None
+            for path in (self.push_cert_path, self.push_key_path)
+        ]
+        
+    def _start_scep_step(self, results):
+        """Start SCEP and wait until it serves its CA certificate"""
         scep_process = self.start_scep_server()
         if not scep_process:
             return False
-            
-        # Wait a bit for SCEP to start
-        import time
-        time.sleep(2)
-        
-        # Get CA certificate
-        ca_path = self.get_ca_certificate()
-        if not ca_path:
-            scep_process.terminate()
+        
+        try:
+            return wait_for_scep(self.scep_url, server=scep_process)
+        except ServiceNotReady as e:
+            print(f"  ❌ {e}")
             return False
             
-        print("\n" + "="*50)
-        
-        # Start nanomdm server
-        nanomdm_process = self.start_nanomdm_server(ca_path)
+    def _start_nanomdm_step(self, results):
+        """Start nanomdm and wait until it is listening"""
+        nanomdm_process = self.start_nanomdm_server(results["ca_certificate"])
         if not nanomdm_process:
-            scep_process.terminate()
             return False
             
-        # Wait for nanomdm to start
-        time.sleep(2)
+        try:
+            wait_for_nanomdm(self.nanomdm_url, server=nanomdm_process)
+        except ServiceNotReady as e:
+            print(f"  ❌ {e}")
+            return False
+        return True
         
-        print("\n" + "="*50)
+    def _challenge_valid(self, profile_path):
+        """Whether an existing enrollment profile's challenge can still be used"""
+        try:
+            with open(profile_path, 'rb') as f:
+                profile = plistlib.load(f)
+        except (OSError, plistlib.InvalidFileException):
+            return False
+        challenge = profile["PayloadContent"][0].get("Challenge")
+        return bool(challenge) and ChallengeStore().verify(challenge, consume=False) is not None
+        
+    def _ca_inputs(self):
+        """The SCEP CA only changes when the depot's CA certificate changes"""
+        depot_ca = f"{self.scep_dir}/depot/ca.pem"
+        depot_hash = hash_file(depot_ca) if os.path.exists(depot_ca) else None
+        return [self.scep_url, depot_hash]
+        
+    def build_setup_engine(self):
+        """Describe the setup as a DAG of resumable steps"""
+        engine = SetupEngine(f"{self.base_dir}/setup_manifest.json")
+        profile_path = f"{self.base_dir}/FocusController_Enrollment.mobileconfig"
         
-        # Setup push certificate (placeholder)
-        push_topic = self.setup_push_certificate()
+        engine.add("requirements", lambda r: self.check_requirements(), always_run=True)
+        engine.add(
+            "scep_binary", lambda r: self.setup_scep_server(),
+            deps=["requirements"],
+            inputs=lambda: ["v2.1.0", platform.system(), platform.machine()],
+            outputs=lambda: [f"{self.scep_dir}/scepserver", f"{self.scep_dir}/depot/ca.pem"]
+        )
+        engine.add("start_scep", self._start_scep_step, deps=["scep_binary"], always_run=True)
+        engine.add(
+            "ca_certificate", lambda r: self.get_ca_certificate(r["start_scep"]) or False,
+            deps=["start_scep"],
+            inputs=self._ca_inputs,
+            outputs=lambda: [f"{self.certs_dir}/ca.pem"]
+        )
+        engine.add("start_nanomdm", self._start_nanomdm_step, deps=["ca_certificate"], always_run=True)
         
-        # Create enrollment profile
-        profile_path = self.create_enrollment_profile(
-            self.nanomdm_url, self.scep_url, push_topic
+        # The enrollment profile only depends on URLs and topic (read from the
+        # certificate in-process), so it is built while the servers are starting
+        engine.add(
+            "push_topic", lambda r: self.setup_push_certificate(),
+            inputs=self._push_cert_inputs
+        )
+        engine.add(
+            "upload_push_certificate", lambda r: self.upload_push_certificate(),
+            deps=["start_nanomdm", "push_topic"],
+            inputs=lambda: [self.nanomdm_url] + self._push_cert_inputs()
         )
+        engine.add(
+            "enrollment_profile",
+            lambda r: self.create_enrollment_profile(
+                self.backends.enrollment_url(self.backend_name), self.scep_url, r["push_topic"]
+            ),
+            deps=["push_topic"],
+            # A profile whose challenge was used or expired can't enroll again
+            inputs=lambda: [
+                self.backends.enrollment_url(self.backend_name), self.scep_url,
+                self._challenge_valid(profile_path)
+            ],
+            outputs=lambda: [profile_path]
+        )
+        return engine
+        
+    def run_full_setup(self):
+        """Run the complete iPhone setup process"""
+        print("🎯 Focus Controller - iPhone Setup")
+        print("=" * 50)
+        
+        # Completed, unchanged steps are skipped; independent ones run in parallel
+        engine = self.build_setup_engine()
+        try:
+            engine.run()
+        except Exception as e:
+            print(f"\n❌ Setup step failed: {e}")
+            self.supervisor.stop_all()
+            return False
+            
+        if engine.skipped:
+            print(f"\n⏭️  Already done: {', '.join(engine.skipped)}")
+            
+        profile_path = engine.results["enrollment_profile"]
         
         print("\n" + "="*50)
         print("🎉 Setup Complete!")
@@ -352,17 +458,8 @@ class iPhoneSetup:
         print("")
         print("Press Ctrl+C to stop servers")
         
-        # Keep servers running
-        try:
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            print("\n🛑 Stopping servers...")
-            if scep_process:
-                scep_process.terminate()
-            if nanomdm_process:
-                nanomdm_process.terminate()
-            print("✅ Servers stopped")
+        # Keep servers running (restarted on crash) until Ctrl+C
+        self.supervisor.wait_forever()
         
         return True
         
@@ -10,6 +10,9 @@ import uuid
 import plistlib
 import os
 
+from domain_trie import minimize_domains
+from payload_packer import DEFAULT_PAYLOAD_BUDGET, split_payload
+
 class SimpleProfileGenerator:
     def __init__(self):
         # App bundle database (same as before)
@@ -106,6 +109,8 @@ class SimpleProfileGenerator:
         Create a profile that blocks specific websites using web content filter
         """
         
+        blocked_websites = minimize_domains(blocked_websites)
+        
         profile_uuid = str(uuid.uuid4())
         filter_uuid = str(uuid.uuid4())
         
@@ -191,11 +196,15 @@ class SimpleProfileGenerator:
             if app_id in website_mapping:
                 websites.extend(website_mapping[app_id])
         
-        return websites
+        # "youtube.com" already covers www./m./music.youtube.com
+        return minimize_domains(websites)
     
-    def create_combo_profile(self, blocked_apps, profile_name="Focus Mode"):
+    def create_combo_profile(self, blocked_apps, profile_name="Focus Mode", payload_budget=DEFAULT_PAYLOAD_BUDGET):
         """
         Create a profile that blocks both apps and their corresponding websites
+        
+        App blacklists too long for `payload_budget` bytes are split over
+        several payloads; the web filter always stays a single payload.
         """
         
         websites = self.get_website_list_for_apps(blocked_apps)
@@ -227,7 +236,7 @@ class SimpleProfileGenerator:
                 "PayloadVersion": 1,
                 "blacklistedAppBundleIDs": blocked_apps
             }
-            profile["PayloadContent"].append(app_payload)
+            profile["PayloadContent"].extend(split_payload(app_payload, "blacklistedAppBundleIDs", payload_budget))
         
         # Add web filtering
         if websites:
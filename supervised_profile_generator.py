@@ -11,6 +11,9 @@ import plistlib
 from datetime import datetime
 import os
 
+from domain_trie import DomainTrie, minimize_domains
+from payload_packer import DEFAULT_PAYLOAD_BUDGET, split_payload
+
 class SupervisedProfileGenerator:
     def __init__(self):
         # Comprehensive app bundle database
@@ -59,15 +62,38 @@ class SupervisedProfileGenerator:
             "Messenger": "com.facebook.Messenger"
         }
         
-    def create_app_blocking_profile(self, blocked_apps, profile_name="Focus Mode"):
+        # Details of the last allowlist/blocklist choice (see choose_app_restriction)
+        self.last_restriction_report = None
+        # (permitted, blocked) domain pairs that overlap in the last web filter
+        self.last_web_filter_conflicts = []
+        
+    def create_app_blocking_profile(self, blocked_apps, profile_name="Focus Mode", installed_apps=None, mode="auto",
+                                    permitted_urls=None, payload_budget=DEFAULT_PAYLOAD_BUDGET):
         """
         Create a configuration profile that blocks specific apps on supervised devices
         
         Args:
             blocked_apps: List of app bundle IDs to block
             profile_name: Name of the profile
+            installed_apps: Bundle IDs installed on the device (from AppInventory);
+                if given, only installed apps are blacklisted. Websites are
+                still blocked for the whole selection.
+            mode: "blocklist", "allowlist" or "auto" (whichever is smaller)
+            permitted_urls: Domains to allow in the web filter; overlaps with
+                the deny list are recorded in last_web_filter_conflicts
+            payload_budget: Largest serialized payload in bytes; longer app
+                blacklists are split over several payloads (the web filter
+                always stays whole)
         """
         
+        app_ids = blocked_apps
+        if installed_apps is not None:
+            app_ids = [bundle_id for bundle_id in blocked_apps if bundle_id in installed_apps]
+        
+        restriction_key, restriction_ids, self.last_restriction_report = self.choose_app_restriction(
+            blocked_apps, installed_apps, mode
+        )
+        
         profile_uuid = str(uuid.uuid4())
         restrictions_uuid = str(uuid.uuid4())
         
@@ -99,20 +125,20 @@ class SupervisedProfileGenerator:
             "allowAppRemoval": False,      # Prevent app removal
             "allowUIAppInstallation": False,
             
-            # App whitelist approach (more reliable on supervised devices)
-            # This creates an allowlist - only these apps can run
-            # Comment out blacklistedAppBundleIDs and uncomment this for whitelist approach
-            # "whitelistedAppBundleIDs": self._get_essential_apps(),
-            
-            # Blacklist approach - block specific apps
-            "blacklistedAppBundleIDs": blocked_apps,
+            # Either blacklistedAppBundleIDs (block these) or
+            # whitelistedAppBundleIDs (only these can run), whichever is smaller
+            restriction_key: restriction_ids,
             
             # Additional restrictions
             "allowMultiplayer": False,
             "allowAddingGameCenterFriends": False,
         }
         
-        profile["PayloadContent"].append(restrictions_payload)
+        if restriction_key == "blacklistedAppBundleIDs":
+            profile["PayloadContent"].extend(split_payload(restrictions_payload, restriction_key, payload_budget))
+        else:
+            # Several allowlists would intersect, so an allowlist stays in one payload
+            profile["PayloadContent"].append(restrictions_payload)
         
         # Add parental controls payload for extra blocking
         parental_uuid = str(uuid.uuid4())
@@ -125,7 +151,7 @@ class SupervisedProfileGenerator:
             
             # Block by app category
             "restrictedApps": {
-                "bundleIdentifiers": blocked_apps
+                "bundleIdentifiers": app_ids
             },
             
             # Time-based restrictions
@@ -137,7 +163,9 @@ class SupervisedProfileGenerator:
             }
         }
         
-        profile["PayloadContent"].append(parental_payload)
+        profile["PayloadContent"].extend(
+            split_payload(parental_payload, ("restrictedApps", "bundleIdentifiers"), payload_budget)
+        )
         
         # Add web content filtering to block web versions
         web_filter_uuid = str(uuid.uuid4())
@@ -157,10 +185,65 @@ class SupervisedProfileGenerator:
             "DenyListURLs": self._get_related_websites(blocked_apps)
         }
         
+        if permitted_urls:
+            web_filter_payload["PermittedURLs"] = list(permitted_urls)
+        self.last_web_filter_conflicts = DomainTrie(web_filter_payload["DenyListURLs"]).conflicts(permitted_urls or [])
+        
+        # Several built-in web filters aren't a documented union, so this one stays whole
         profile["PayloadContent"].append(web_filter_payload)
         
         return profile
     
+    def choose_app_restriction(self, blocked_apps, installed_apps=None, mode="auto"):
+        """
+        Pick the smaller of the blocklist and the equivalent allowlist
+        
+        An allowlist blocks every app it doesn't name, so it's only equivalent
+        to the blocklist when the device's apps are known (installed_apps).
+        InstalledApplicationList leaves out most built-in apps, so the
+        allowlist also names every built-in iOS app (_get_builtin_apps) that
+        isn't blocked. Without an inventory, "auto" keeps the blocklist and an
+        explicit "allowlist" allows the catalog and built-in apps that aren't
+        blocked. Essential apps stay allowed unless they are blocked explicitly.
+        
+        Returns (payload key, bundle IDs, report).
+        """
+        blocked = set(blocked_apps)
+        blocklist = list(blocked_apps)
+        if installed_apps is not None:
+            blocklist = [bundle_id for bundle_id in blocked_apps if bundle_id in installed_apps]
+        
+        if installed_apps is not None:
+            universe = set(installed_apps)
+        else:
+            universe = set(self.app_bundles.values())
+        universe.update(self._get_essential_apps())
+        universe.update(self._get_builtin_apps())
+        allowlist = sorted(universe - blocked)
+        
+        blocklist_bytes = len(plistlib.dumps(blocklist))
+        allowlist_bytes = len(plistlib.dumps(allowlist))
+        
+        if mode == "allowlist":
+            use_allowlist = True
+        elif mode == "auto":
+            use_allowlist = installed_apps is not None and allowlist_bytes < blocklist_bytes
+        else:
+            use_allowlist = False
+        
+        report = {
+            "representation": "allowlist" if use_allowlist else "blocklist",
+            "blocklist_entries": len(blocklist),
+            "blocklist_bytes": blocklist_bytes,
+            "allowlist_entries": len(allowlist),
+            "allowlist_bytes": allowlist_bytes,
+            "bytes_saved": max(0, blocklist_bytes - allowlist_bytes) if use_allowlist else 0
+        }
+        
+        if use_allowlist:
+            return "whitelistedAppBundleIDs", allowlist, report
+        return "blacklistedAppBundleIDs", blocklist, report
+    
     def _get_essential_apps(self):
         """Get list of essential apps to allow (for whitelist approach)"""
         essential_apps = [
@@ -181,6 +264,23 @@ class SupervisedProfileGenerator:
         ]
         return essential_apps
     
+    def _get_builtin_apps(self):
+        """Bundle IDs of the apps that ship with iOS (missing from InstalledApplicationList)"""
+        return [
+            "com.apple.AppStore", "com.apple.Bridge", "com.apple.camera",
+            "com.apple.clips", "com.apple.DocumentsApp", "com.apple.facetime",
+            "com.apple.findmy", "com.apple.Fitness", "com.apple.freeform",
+            "com.apple.GenerativePlaygroundApp", "com.apple.Health", "com.apple.Home",
+            "com.apple.iBooks", "com.apple.iMovie", "com.apple.journal",
+            "com.apple.Keynote", "com.apple.Magnifier", "com.apple.Maps",
+            "com.apple.measure", "com.apple.MobileAddressBook", "com.apple.mobilegarageband",
+            "com.apple.mobilenotes", "com.apple.mobileslideshow", "com.apple.mobiletimer",
+            "com.apple.Music", "com.apple.news", "com.apple.Numbers",
+            "com.apple.Pages", "com.apple.Passbook", "com.apple.Passwords",
+            "com.apple.podcasts", "com.apple.shortcuts", "com.apple.tips",
+            "com.apple.Translate", "com.apple.tv",
+        ] + self._get_essential_apps()
+    
     def _get_related_websites(self, blocked_apps):
         """Get websites to block based on blocked apps"""
         website_mapping = {
@@ -215,7 +315,8 @@ class SupervisedProfileGenerator:
             if app in website_mapping:
                 websites.extend(website_mapping[app])
         
-        return websites
+        # "youtube.com" already covers www./m./music.youtube.com
+        return minimize_domains(websites)
     
     def create_unblock_profile(self):
         """Create a profile that removes all restrictions"""